@@ -0,0 +1,132 @@
+"""
+Admission Limits
+This module provides the building blocks for keeping backend load bounded
+by distinct work rather than by the number of connected dashboards:
+
+    SingleFlight      - concurrent calls with the same key share one execution
+    ConcurrencyLimit  - at most N running, a bounded queue, then fast rejection
+    RateLimiter       - token bucket per client
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Run fn, or join the identical call already running; returns (result, shared)"""
+        task = self._calls.get(key)
+        shared = task is not None
+        if task is None:
+            # A separate task, so the caller that started it can go away
+            # (client disconnect) without cancelling the work for the others
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task), shared
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception retrieved when every waiter has gone away
+        if not task.cancelled():
+            task.exception()
+
+
+class ConcurrencyLimit:
+    """Semaphore with a bounded wait queue and a wait timeout"""
+
+    def __init__(self, limit: int, queue: int, timeout: float):
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self) -> bool:
+        """Take a slot, queueing for up to timeout; False means reject now"""
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            self.active += 1
+            return True
+        if self.waiting >= self.queue:
+            return False
+        self.waiting += 1
+        # Not wait_for: a permit granted just as the wait times out or is cancelled would be lost
+        acquire = asyncio.ensure_future(self._semaphore.acquire())
+        try:
+            done, _ = await asyncio.wait((acquire,), timeout=self.timeout)
+        except BaseException:
+            self._abandon(acquire)
+            raise
+        finally:
+            self.waiting -= 1
+        if not done:
+            self._abandon(acquire)
+            return False
+        self.active += 1
+        return True
+
+    def _abandon(self, acquire: asyncio.Future) -> None:
+        """Give up a pending acquire, handing back the permit if it was granted anyway"""
+        acquire.cancel()
+        acquire.add_done_callback(self._release_granted)
+
+    def _release_granted(self, acquire: asyncio.Future) -> None:
+        if not acquire.cancelled() and acquire.exception() is None:
+            self._semaphore.release()
+
+    def release(self) -> None:
+        self.active -= 1
+        self._semaphore.release()
+
+
+class RateLimiter:
+    """Token bucket per client key, refilled lazily on each check"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        # client -> [tokens, last refill time]
+        self._buckets: Dict[Hashable, List[float]] = {}
+
+    def allow(self, client: Hashable, cost: float = 1.0) -> Tuple[bool, float]:
+        """Spend tokens for one request; returns (allowed, seconds until it would be)"""
+        now = time.monotonic()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= self.max_clients:
+                self._prune(now)
+            bucket = self._buckets[client] = [self.burst, now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return True, 0.0
+        return False, (cost - bucket[0]) / self.rate
+
+    def _prune(self, now: float) -> None:
+        """Forget clients whose buckets have refilled; they start full again anyway"""
+        full_after = self.burst / self.rate
+        for client, (_, last) in list(self._buckets.items()):
+            if now - last >= full_after:
+                del self._buckets[client]
+        # Still full of active clients: drop the least recently seen half
+        if len(self._buckets) >= self.max_clients:
+            by_age = sorted(self._buckets.items(), key=lambda item: item[1][1])
+            for client, _ in by_age[:len(by_age) // 2]:
+                del self._buckets[client]
+
+
+# Shared single-flight group for coalescing identical backend queries in code
+single_flight = SingleFlight()
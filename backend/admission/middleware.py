@@ -0,0 +1,196 @@
+"""
+Admission Middleware
+This module applies per-client rate limits, single-flight coalescing and
+per-endpoint concurrency limits to API requests
+
+Rate limiting is off unless RATE_LIMIT_PER_SECOND is set. Clients are
+told apart by the admin user the auth proxy forwards, or by
+their address (from X-Forwarded-For), not by the proxy's own address that
+every request shares. Both headers only count when the peer is a trusted
+proxy; anyone else could pick a fresh identity per request.
+
+For hot read endpoints, concurrent identical GETs (same path and query) are
+served from one execution of the route: the first request runs it, its
+response messages are captured and replayed to every request that arrived
+while it was running. Only that one execution takes an endpoint concurrency
+slot. Requests over the rate limit get 429, requests that cannot get a slot
+before the queue fills or the wait times out get 503; both with Retry-After.
+"""
+
+import json
+import math
+import os
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from admission.limits import ConcurrencyLimit, RateLimiter, SingleFlight
+from metrics.registry import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Hot read endpoints: (concurrent executions, queued executions, queue timeout seconds)
+ENDPOINT_LIMITS = {
+    "/api/buses": (16, 64, 2.0),
+    "/api/kpis": (8, 32, 2.0),
+    "/api/delay-predictions": (8, 32, 2.0),
+    "/api/buses/clusters": (16, 64, 2.0),
+    "/api/analytics": (8, 32, 5.0),
+}
+
+# Endpoints whose identical concurrent GETs share one execution
+COALESCED = set(ENDPOINT_LIMITS)
+
+# Paths never rate limited
+EXEMPT_PATHS = {"/api/health"}
+
+# Proxies (comma-separated addresses) whose X-Forwarded-For names the real client
+TRUSTED_PROXIES = {address.strip() for address in os.environ.get("TRUSTED_PROXIES", "").split(",") if address.strip()}
+
+admission_coalesced = REGISTRY.counter("admission_coalesced_total", "Requests served from a shared execution",
+                                       ["path"])
+admission_rejected = REGISTRY.counter("admission_rejected_total", "Requests rejected by admission control",
+                                      ["path", "reason"])
+admission_queue_wait = REGISTRY.histogram("admission_queue_wait_seconds", "Time spent waiting for a slot", ["path"])
+
+
+async def _empty_receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+def _error(status: int, detail: str, retry_after: float) -> List[dict]:
+    """Response messages for a rejection, in FastAPI's error format"""
+    body = json.dumps({"detail": detail}).encode()
+    return [
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        },
+        {"type": "http.response.body", "body": body},
+    ]
+
+
+async def _send_all(send, messages: List[dict]) -> None:
+    for message in messages:
+        # Each request gets its own copies: outer middleware (CORS) edits headers in place
+        if "headers" in message:
+            message = {**message, "headers": list(message["headers"])}
+        else:
+            message = dict(message)
+        await send(message)
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", ()):
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _peer(scope) -> str:
+    return scope["client"][0] if scope.get("client") else "unknown"
+
+
+def forwarded_user(scope, trusted_proxies=TRUSTED_PROXIES) -> Optional[str]:
+    """Admin user forwarded by the auth proxy, or None when the peer is not a trusted proxy"""
+    if _peer(scope) not in trusted_proxies:
+        return None
+    return _header(scope, b"x-admin-user") or None
+
+
+def _client_key(scope, trusted_proxies=TRUSTED_PROXIES) -> str:
+    """Rate limit key: the admin user forwarded by the auth proxy, else the client address"""
+    user = forwarded_user(scope, trusted_proxies)
+    if user:
+        return f"user:{user}"
+    address = _peer(scope)
+    forwarded = _header(scope, b"x-forwarded-for")
+    if forwarded and address in trusted_proxies:
+        # The last address the trusted proxy appended is the one that reached it
+        address = forwarded.split(",")[-1].strip()
+    return f"ip:{address}"
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, rate: Optional[float] = None, burst: Optional[float] = None,
+                 limits: Optional[Dict[str, tuple]] = None, trusted_proxies: Optional[set] = None):
+        self.app = app
+        self.trusted_proxies = TRUSTED_PROXIES if trusted_proxies is None else trusted_proxies
+        if rate is None and os.environ.get("RATE_LIMIT_PER_SECOND"):
+            rate = float(os.environ["RATE_LIMIT_PER_SECOND"])
+        burst = burst or float(os.environ.get("RATE_LIMIT_BURST", 60))
+        # Off unless configured: behind an unlisted proxy every dashboard would share one bucket
+        self.rate_limiter = RateLimiter(rate, burst) if rate else None
+        if self.rate_limiter is not None and not self.trusted_proxies:
+            logger.warning("Rate limiting without TRUSTED_PROXIES: clients behind a reverse proxy "
+                           "share the proxy's rate limit")
+        self.limits = {path: ConcurrencyLimit(*config) for path, config in (limits or ENDPOINT_LIMITS).items()}
+        self.flights = SingleFlight()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/") or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+
+        if self.rate_limiter is not None:
+            allowed, retry_after = self.rate_limiter.allow(_client_key(scope, self.trusted_proxies))
+            if not allowed:
+                admission_rejected.labels(path, "rate_limited").inc()
+                await _send_all(send, _error(429, "Rate limit exceeded", retry_after))
+                return
+
+        limit = self.limits.get(path)
+        if scope["method"] == "GET" and path in COALESCED:
+            key = (path, scope.get("query_string", b""))
+            (messages, route), shared = await self.flights.do(key, lambda: self._capture(scope, limit))
+            if shared:
+                admission_coalesced.labels(path).inc()
+            if route is not None:
+                # Lets the metrics middleware label shared responses by route too
+                scope["route"] = route
+            await _send_all(send, messages)
+            return
+
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        if not await self._acquire(limit, path):
+            await _send_all(send, _error(503, "Server busy, retry shortly", 1))
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release()
+
+    async def _acquire(self, limit: ConcurrencyLimit, path: str) -> bool:
+        started = time.perf_counter()
+        acquired = await limit.acquire()
+        admission_queue_wait.labels(path).observe(time.perf_counter() - started)
+        if not acquired:
+            admission_rejected.labels(path, "overloaded").inc()
+        return acquired
+
+    async def _capture(self, scope, limit: Optional[ConcurrencyLimit]) -> Tuple[List[dict], object]:
+        """Run the route once and keep its response messages for every waiting request"""
+        messages: List[dict] = []
+
+        async def collect(message):
+            messages.append(message)
+
+        if limit is not None and not await self._acquire(limit, scope["path"]):
+            return _error(503, "Server busy, retry shortly", 1), None
+        # The request that started the flight may disconnect; the route runs on
+        # a copy of its scope with an empty request body either way
+        scope = dict(scope)
+        try:
+            await self.app(scope, _empty_receive, collect)
+        finally:
+            if limit is not None:
+                limit.release()
+        return messages, scope.get("route")
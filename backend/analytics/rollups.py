@@ -0,0 +1,410 @@
+"""
+Operational Rollups
+This module maintains hourly and daily aggregates per route, depot and
+driver as stop arrivals come in, so analytics queries read a few hundred
+small buckets instead of scanning raw documents
+
+Each bucket keeps counts and fixed-edge histograms rather than raw values,
+so buckets merge exactly and p95 delay and the occupancy distribution of
+any time range come from adding histograms together.
+
+Only a recent window (HOURLY_WINDOW_DAYS of hourly buckets, DAILY_WINDOW_DAYS
+of daily ones) is held in memory, reloaded from MongoDB after every flush so
+that every API process converges on the same totals. Older ranges are read
+from MongoDB per query. Stored buckets expire through a TTL index on
+expires_at once they are past their retention.
+"""
+
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Arrivals at most this many minutes late count as on time
+ON_TIME_MINUTES = 5.0
+
+# Upper edges of the delay histogram in minutes (early arrivals fall in the first bins)
+DELAY_EDGES = tuple(range(-10, 61))
+
+# Upper edges of the occupancy histogram in percent; the last bin is overcrowding
+OCCUPANCY_EDGES = (10, 20, 30, 40, 50, 60, 70, 80, 90, 100)
+OCCUPANCY_LABELS = [f"{low}-{high}" for low, high in zip((0,) + OCCUPANCY_EDGES, OCCUPANCY_EDGES)] + \
+                   [f">{OCCUPANCY_EDGES[-1]}"]
+
+# Buckets align to local service hours and days (IST)
+UTC_OFFSET = timedelta(hours=5, minutes=30)
+
+GRANULARITIES = {"hour": 3600, "day": 86400}
+DIMENSIONS = ("route", "depot", "driver")
+GROUPINGS = ("bucket", "total", "hour_of_day")
+
+# Seconds between writes of changed buckets to MongoDB
+FLUSH_INTERVAL = 30.0
+
+# Longest wait between attempts to load stored rollups
+MAX_LOAD_RETRY = 300.0
+
+# Days of buckets held in memory per granularity; queries reaching further back read MongoDB
+WINDOW_DAYS = {"hour": 35, "day": 400}
+
+# Days a stored bucket is kept after it starts (daily buckets as long as other operational data)
+RETENTION_DAYS = {"hour": 400, "day": 1095}
+
+# (granularity, dimension) -> key -> bucket -> rollup
+Rollups = Dict[Tuple[str, str], Dict[str, Dict[int, "Rollup"]]]
+
+
+class Rollup:
+    """Mergeable aggregate of arrivals in one bucket"""
+
+    __slots__ = ("count", "on_time", "delay_sum", "delay_hist", "occupancy_sum", "occupancy_max",
+                 "occupancy_hist")
+
+    def __init__(self):
+        self.count = 0
+        self.on_time = 0
+        self.delay_sum = 0.0
+        self.delay_hist = [0] * (len(DELAY_EDGES) + 1)
+        self.occupancy_sum = 0.0
+        self.occupancy_max = 0.0
+        self.occupancy_hist = [0] * (len(OCCUPANCY_EDGES) + 1)
+
+    def add(self, delay: float, occupancy: float) -> None:
+        self.count += 1
+        if delay <= ON_TIME_MINUTES:
+            self.on_time += 1
+        self.delay_sum += delay
+        self.delay_hist[bisect_left(DELAY_EDGES, delay)] += 1
+        self.occupancy_sum += occupancy
+        if occupancy > self.occupancy_max:
+            self.occupancy_max = occupancy
+        self.occupancy_hist[bisect_left(OCCUPANCY_EDGES, occupancy)] += 1
+
+    def merge(self, other: "Rollup") -> None:
+        self.count += other.count
+        self.on_time += other.on_time
+        self.delay_sum += other.delay_sum
+        self.occupancy_sum += other.occupancy_sum
+        self.occupancy_max = max(self.occupancy_max, other.occupancy_max)
+        self.delay_hist = [a + b for a, b in zip(self.delay_hist, other.delay_hist)]
+        self.occupancy_hist = [a + b for a, b in zip(self.occupancy_hist, other.occupancy_hist)]
+
+    def p95_delay(self) -> float:
+        """Upper edge of the histogram bin holding the 95th percentile"""
+        target = 0.95 * self.count
+        seen = 0
+        for i, value in enumerate(self.delay_hist):
+            seen += value
+            if seen >= target:
+                return float(DELAY_EDGES[i]) if i < len(DELAY_EDGES) else float(DELAY_EDGES[-1])
+        return 0.0
+
+    def summary(self) -> dict:
+        if not self.count:
+            return {"observations": 0}
+        return {
+            "observations": self.count,
+            "otp": round(self.on_time / self.count * 100, 1),
+            "mean_delay": round(self.delay_sum / self.count, 2),
+            "p95_delay": self.p95_delay(),
+            "mean_occupancy": round(self.occupancy_sum / self.count, 1),
+            "peak_occupancy": self.occupancy_max,
+            "occupancy_distribution": dict(zip(OCCUPANCY_LABELS, self.occupancy_hist))
+        }
+
+    def to_update(self) -> dict:
+        """Update that adds this rollup to a stored bucket, so concurrent writers never overwrite each other"""
+        increments = {"count": self.count, "on_time": self.on_time, "delay_sum": self.delay_sum,
+                      "occupancy_sum": self.occupancy_sum}
+        for slot in ("delay_hist", "occupancy_hist"):
+            for i, value in enumerate(getattr(self, slot)):
+                if value:
+                    increments[f"{slot}.{i}"] = value
+        return {"$inc": increments, "$max": {"occupancy_max": self.occupancy_max}}
+
+    @classmethod
+    def from_document(cls, document: dict) -> "Rollup":
+        rollup = cls()
+        for slot in cls.__slots__:
+            if slot not in document:
+                continue
+            value = document[slot]
+            if isinstance(value, dict):
+                # Histograms built by $inc are sub-documents keyed by bin index
+                hist = getattr(rollup, slot)
+                for i, count in value.items():
+                    hist[int(i)] += count
+            else:
+                setattr(rollup, slot, value)
+        return rollup
+
+
+def bucket_of(timestamp: float, granularity: str) -> int:
+    """Local bucket number of a Unix timestamp"""
+    return int((timestamp + UTC_OFFSET.total_seconds()) // GRANULARITIES[granularity])
+
+
+def bucket_start(bucket: int, granularity: str) -> datetime:
+    """Local start time of a bucket"""
+    local = datetime(1970, 1, 1) + timedelta(seconds=bucket * GRANULARITIES[granularity])
+    return local.replace(tzinfo=timezone(UTC_OFFSET))
+
+
+def expires_at(bucket: int, granularity: str) -> datetime:
+    """When the TTL index removes a stored bucket (naive UTC, as MongoDB returns it)"""
+    start = bucket_start(bucket, granularity).astimezone(timezone.utc).replace(tzinfo=None)
+    return start + timedelta(days=RETENTION_DAYS[granularity])
+
+
+def window_start(granularity: str, now: Optional[float] = None) -> int:
+    """First bucket of a granularity held in memory"""
+    if now is None:
+        now = time.time()
+    return bucket_of(now - WINDOW_DAYS[granularity] * 86400, granularity)
+
+
+def _empty() -> Rollups:
+    return {(granularity, dimension): {} for granularity in GRANULARITIES for dimension in DIMENSIONS}
+
+
+def _place(rollups: Rollups, granularity: str, dimension: str, key: str, bucket: int, rollup: "Rollup") -> None:
+    buckets = rollups[(granularity, dimension)].setdefault(key, {})
+    if bucket in buckets:
+        buckets[bucket].merge(rollup)
+    else:
+        buckets[bucket] = rollup
+
+
+class RollupStore:
+    def __init__(self):
+        # The in-memory window: stored buckets as last loaded plus what was recorded since
+        self._rollups: Rollups = _empty()
+        # What each bucket gained since the last flush
+        self._pending: Dict[Tuple[str, str, str, int], Rollup] = {}
+        # Stored rollups have been merged in; flushing before that would count them twice once loaded
+        self.loaded = False
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, timestamp: float, delay: float, occupancy: float, route: Optional[str] = None,
+               depot: Optional[str] = None, driver: Optional[str] = None) -> None:
+        """Fold one stop arrival into every rollup it belongs to"""
+        for granularity in GRANULARITIES:
+            bucket = bucket_of(timestamp, granularity)
+            for dimension, key in (("route", route), ("depot", depot), ("driver", driver)):
+                if not key:
+                    continue
+                buckets = self._rollups[(granularity, dimension)].setdefault(key, {})
+                rollup = buckets.get(bucket)
+                if rollup is None:
+                    rollup = buckets[bucket] = Rollup()
+                rollup.add(delay, occupancy)
+                name = (granularity, dimension, key, bucket)
+                delta = self._pending.get(name)
+                if delta is None:
+                    delta = self._pending[name] = Rollup()
+                delta.add(delay, occupancy)
+
+    def keys(self, dimension: str) -> List[str]:
+        return sorted(self._rollups[("day", dimension)])
+
+    async def query(self, dimension: str, granularity: str, start: datetime, end: datetime,
+                    key: Optional[str] = None, group_by: str = "bucket", collection=None) -> List[dict]:
+        """Summaries over [start, end) grouped by bucket, per key in total, or per local hour of day
+
+        Served from memory when the range is inside the in-memory window, otherwise
+        from the stored buckets in collection (when given).
+        """
+        first = bucket_of(start.timestamp(), granularity)
+        last = bucket_of(end.timestamp() - 1e-6, granularity)
+        rollups = self._rollups
+        if collection is not None and first < window_start(granularity):
+            rollups = await self._stored(collection, dimension, granularity, first, last, key)
+        by_key = rollups[(granularity, dimension)]
+        keys = [key] if key is not None else sorted(by_key)
+
+        results = []
+        for name in keys:
+            buckets = by_key.get(name)
+            if not buckets:
+                continue
+            if group_by == "total" and granularity == "hour":
+                total = self._hourly_total(rollups, dimension, name, first, last)
+                if total.count:
+                    results.append({"key": name, **total.summary()})
+                continue
+
+            matched = self._matched(buckets, first, last)
+            if group_by == "bucket":
+                for bucket, rollup in matched:
+                    results.append({"key": name, "bucket": bucket_start(bucket, granularity).isoformat(),
+                                    **rollup.summary()})
+            elif group_by == "hour_of_day":
+                hours: Dict[int, Rollup] = {}
+                for bucket, rollup in matched:
+                    hours.setdefault(bucket % 24, Rollup()).merge(rollup)
+                for hour in sorted(hours):
+                    results.append({"key": name, "hour": hour, **hours[hour].summary()})
+            else:
+                total = Rollup()
+                for _, rollup in matched:
+                    total.merge(rollup)
+                if total.count:
+                    results.append({"key": name, **total.summary()})
+        return results
+
+    async def _stored(self, collection, dimension: str, granularity: str, first: int, last: int,
+                      key: Optional[str]) -> Rollups:
+        """Stored buckets of a range, plus increments not flushed yet"""
+        ranges = {granularity: (first, last)}
+        if granularity == "hour":
+            # Hourly totals use the daily buckets for whole days
+            ranges["day"] = (first // 24, last // 24)
+        query = {"dimension": dimension,
+                 "$or": [{"granularity": g, "bucket": {"$gte": low, "$lte": high}} for g, (low, high) in ranges.items()]}
+        if key is not None:
+            query["key"] = key
+        rollups = _empty()
+        async for document in collection.find(query, {"_id": 0}):
+            _place(rollups, document["granularity"], dimension, document["key"], document["bucket"],
+                   Rollup.from_document(document))
+        for (g, d, k, bucket), delta in self._pending.items():
+            if d == dimension and g in ranges and ranges[g][0] <= bucket <= ranges[g][1] and key in (None, k):
+                _place(rollups, g, d, k, bucket, self._copy(delta))
+        return rollups
+
+    @staticmethod
+    def _copy(rollup: Rollup) -> Rollup:
+        copy = Rollup()
+        copy.merge(rollup)
+        return copy
+
+    @staticmethod
+    def _matched(buckets: Dict[int, Rollup], first: int, last: int) -> List[Tuple[int, Rollup]]:
+        """Buckets in [first, last], walking whichever is smaller: the range or the buckets held"""
+        if last - first + 1 <= len(buckets):
+            return [(b, buckets[b]) for b in range(first, last + 1) if b in buckets]
+        return sorted((b, rollup) for b, rollup in buckets.items() if first <= b <= last)
+
+    def _hourly_total(self, rollups: Rollups, dimension: str, key: str, first: int, last: int) -> Rollup:
+        """Total over an hour range, using daily buckets for the whole days inside it"""
+        hours = rollups[("hour", dimension)].get(key, {})
+        days = rollups[("day", dimension)].get(key, {})
+        first_day = -(-first // 24)
+        last_day = (last + 1) // 24 - 1
+        if first_day > last_day:
+            spans = [(hours, first, last)]
+        else:
+            spans = [(hours, first, first_day * 24 - 1), (days, first_day, last_day),
+                     (hours, (last_day + 1) * 24, last)]
+        total = Rollup()
+        for buckets, low, high in spans:
+            if low <= high:
+                for _, rollup in self._matched(buckets, low, high):
+                    total.merge(rollup)
+        return total
+
+    async def flush(self, collection) -> int:
+        """Add what the buckets gained since the last flush to the stored buckets"""
+        if not self.loaded:
+            raise RuntimeError("stored rollups are not loaded yet")
+        return await self._write(collection)
+
+    async def _write(self, collection) -> int:
+        from pymongo import UpdateOne
+        from pymongo.errors import BulkWriteError
+
+        pending, self._pending = self._pending, {}
+        names = list(pending)
+        operations = []
+        for granularity, dimension, key, bucket in names:
+            update = pending[(granularity, dimension, key, bucket)].to_update()
+            update["$max"]["expires_at"] = expires_at(bucket, granularity)
+            operations.append(UpdateOne({"granularity": granularity, "dimension": dimension, "key": key,
+                                         "bucket": bucket}, update, upsert=True))
+        if operations:
+            try:
+                await collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                # Only the failed updates are retried; the rest are already added
+                failed = [names[error["index"]] for error in e.details.get("writeErrors", [])]
+                self._requeue({name: pending[name] for name in failed})
+                raise
+            except Exception:
+                self._requeue(pending)
+                raise
+        return len(operations)
+
+    def _requeue(self, pending: Dict[Tuple[str, str, str, int], Rollup]) -> None:
+        for name, delta in pending.items():
+            current = self._pending.get(name)
+            if current is None:
+                self._pending[name] = delta
+            else:
+                current.merge(delta)
+
+    async def load(self, collection) -> int:
+        """Replace the in-memory window with the stored buckets plus increments not flushed yet"""
+        now = time.time()
+        firsts = {granularity: window_start(granularity, now) for granularity in GRANULARITIES}
+        query = {"$or": [{"granularity": granularity, "bucket": {"$gte": first}}
+                         for granularity, first in firsts.items()]}
+        fresh = _empty()
+        loaded = 0
+        async for document in collection.find(query, {"_id": 0}):
+            _place(fresh, document["granularity"], document["dimension"], document["key"], document["bucket"],
+                   Rollup.from_document(document))
+            loaded += 1
+        # Recorded here but not stored yet; older buckets leave memory
+        for (granularity, dimension, key, bucket), delta in self._pending.items():
+            if bucket >= firsts[granularity]:
+                _place(fresh, granularity, dimension, key, bucket, self._copy(delta))
+        self._rollups = fresh
+        self.loaded = True
+        return loaded
+
+    def start(self, collection) -> None:
+        """Load stored rollups and keep flushing changes in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(collection))
+
+    async def stop(self, collection) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            try:
+                # Increments are safe to write even if the stored rollups never loaded
+                await self._write(collection)
+            except Exception as e:
+                logger.warning(f"Final rollup flush failed: {e}")
+
+    async def _run(self, collection) -> None:
+        # Load before the first flush, retrying until it works, so stored counts are merged once
+        delay = FLUSH_INTERVAL
+        while not self.loaded:
+            try:
+                loaded = await self.load(collection)
+                logger.info(f"Loaded {loaded} rollup buckets")
+            except Exception as e:
+                logger.warning(f"Rollup load failed, retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_LOAD_RETRY)
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.flush(collection)
+                # Picks up other processes' flushes and drops buckets that left the window
+                await self.load(collection)
+            except Exception as e:
+                logger.warning(f"Rollup flush failed, retrying: {e}")
+
+
+# Shared rollups fed by stop arrivals and read by /api/analytics
+rollups = RollupStore()
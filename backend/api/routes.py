@@ -1,9 +1,30 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+import asyncio
+import json
+import math
+import os
+from pydantic import BaseModel, Field, TypeAdapter, model_validator
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import uuid
 
+from admission.middleware import TRUSTED_PROXIES, forwarded_user
+from analytics.rollups import rollups, DIMENSIONS, GRANULARITIES, GROUPINGS
+from audit.writer import audit_log
+from changefeed.feed import LocalChangeFeed, ResumeTokenExpired
+from checkpoint.store import Checkpointer
+from exports.stream import DATASETS, ENCODERS, ExportStream, build_query
+from fleet.eta import EtaEngine, build_engine
+from fleet.geofence import StopGeofencer, build_geofencer
+from fleet.clustering import ClusterIndex, MAX_CLUSTER_ZOOM
+from fleet.monitor import OccupancyMonitor, fleet_totals
+from fleet.state import BusState, FleetState
+from sharding.pool import PartitionError, ShardedFleet
+from simulation.runner import simulation_runner
+from profiling.sampler import sampler, render_collapsed
+from profiling.slow import slow_operations
+
 router = APIRouter(prefix="/api")
 
 # Data Models
@@ -24,17 +45,21 @@ class Bus(BaseModel):
     last_update: datetime
     speed: float = 0.0
     direction: int = 0
+    distance_to_next_stop: Optional[float] = None  # metres along the route
+    eta_seconds: Optional[float] = None  # to next_stop
 
 class Stop(BaseModel):
     id: str
     name: str
     location: BusLocation
     crowd_level: int  # 0-100
+    etas: List[dict] = []  # upcoming arrivals, soonest first
 
 class Route(BaseModel):
     id: str
     name: str
     points: List[List[float]]  # List of [lat, lng] coordinates
+    stops: List[str] = []  # Stop IDs served by the route
 
 class DelayPrediction(BaseModel):
     bus_id: str
@@ -68,6 +93,35 @@ class Anomaly(BaseModel):
     reported_by: str
     resolved: bool
 
+# Most buses a what-if scenario may add to a route
+MAX_ADDED_BUSES = 50
+
+# HH:MM between 00:00 and 24:00
+CLOCK_PATTERN = r"^(([01][0-9]|2[0-3]):[0-5][0-9]|24:00)$"
+
+class Scenario(BaseModel):
+    """What-if change to a route's service; bounded so every simulation is small and terminates"""
+    model_config = {"extra": "forbid"}
+
+    add_buses: int = Field(0, ge=0, le=MAX_ADDED_BUSES)
+    headway_minutes: Optional[float] = Field(None, ge=1, le=240)
+    start: Optional[str] = Field(None, pattern=CLOCK_PATTERN)
+    end: Optional[str] = Field(None, pattern=CLOCK_PATTERN)
+
+    @model_validator(mode="after")
+    def window_in_order(self):
+        # Zero-padded HH:MM strings order like the times they stand for
+        if self.start and self.end and self.start >= self.end:
+            raise ValueError("start must be before end")
+        return self
+
+    def engine_input(self) -> dict:
+        """Plain scenario dict for the simulation engine and the result cache"""
+        return self.model_dump(exclude_none=True, exclude={"route"})
+
+class RecommendationScenario(Scenario):
+    route: str
+
 class Recommendation(BaseModel):
     id: str
     title: str
@@ -78,6 +132,7 @@ class Recommendation(BaseModel):
     rationale: str
     simulation_applied: bool
     applied: bool
+    scenario: Optional[RecommendationScenario] = None
 
 class Alert(BaseModel):
     id: str
@@ -94,6 +149,10 @@ class Alert(BaseModel):
     escalation: str
     acknowledged: bool
 
+class SimulationRequest(BaseModel):
+    route: str
+    scenarios: List[Scenario] = Field(min_length=1, max_length=100)
+
 class KPI(BaseModel):
     title: str
     value: str
@@ -115,34 +174,37 @@ class Driver(BaseModel):
     rating: float
 
 # Mock data storage
-buses_data = [
-    Bus(
-        id="APSRTC001",
+# Live fleet as compact records; Bus models are built only for API responses
+live_buses = FleetState([
+    BusState(
+        bus_id="APSRTC001",
         route="Route 12",
-        location=BusLocation(lat=16.5062, lng=80.6480, address="Vijayawada Railway Station"),
+        lat=16.5062,
+        lng=80.6480,
+        address="Vijayawada Railway Station",
         status="active",
         occupancy=67,
         driver="Rajesh Kumar",
         next_stop="Benz Circle",
         delay=0,
-        last_update=datetime.now(),
         speed=25.0,
         direction=45
     ),
-    Bus(
-        id="APSRTC002",
+    BusState(
+        bus_id="APSRTC002",
         route="Route 15",
-        location=BusLocation(lat=16.5119, lng=80.6332, address="MG Road, Vijayawada"),
+        lat=16.5119,
+        lng=80.6332,
+        address="MG Road, Vijayawada",
         status="delayed",
         occupancy=85,
         driver="Suresh Singh",
         next_stop="Governorpet",
         delay=8,
-        last_update=datetime.now(),
         speed=15.0,
         direction=120
     )
-]
+])
 
 stops_data = [
     Stop(
@@ -150,6 +212,18 @@ stops_data = [
         name="Benz Circle",
         location=BusLocation(lat=16.5062, lng=80.6480, address="Benz Circle, Vijayawada"),
         crowd_level=85
+    ),
+    Stop(
+        id="STOP002",
+        name="Governorpet",
+        location=BusLocation(lat=16.5089, lng=80.6256, address="Governorpet, Vijayawada"),
+        crowd_level=60
+    ),
+    Stop(
+        id="STOP003",
+        name="MG Road",
+        location=BusLocation(lat=16.5119, lng=80.6332, address="MG Road, Vijayawada"),
+        crowd_level=45
     )
 ]
 
@@ -157,7 +231,8 @@ routes_data = [
     Route(
         id="ROUTE12",
         name="Route 12",
-        points=[[16.5062, 80.6480], [16.5089, 80.6256], [16.5119, 80.6332]]
+        points=[[16.5062, 80.6480], [16.5089, 80.6256], [16.5119, 80.6332]],
+        stops=["STOP001", "STOP002", "STOP003"]
     )
 ]
 
@@ -208,7 +283,8 @@ recommendations_data = [
         priority="high",
         rationale="Predicted delay due to recurring congestion at Benz Circle between 17:00–18:00 based on last 30 days",
         simulation_applied=False,
-        applied=False
+        applied=False,
+        scenario={"route": "Route 12", "add_buses": 1, "start": "17:00", "end": "19:00"}
     )
 ]
 
@@ -262,21 +338,340 @@ drivers_data = [
     )
 ]
 
+# Route geometry for live ETAs, stop geofences and checkpoints; built by
+# start_live_state when the app starts, not when this module is imported
+eta_engine: Optional[EtaEngine] = None
+geofencer: Optional[StopGeofencer] = None
+checkpointer: Optional[Checkpointer] = None
+
+# Buses the ETA engine and geofencer hold state for, diffed against the fleet each refresh
+tracked_bus_ids: set = set()
+
+def forget_departed_buses():
+    """Drop ETA and geofence state of buses that left the live fleet since the last refresh"""
+    global tracked_bus_ids
+    fleet_ids = {bus.bus_id for bus in live_buses}
+    departed = tracked_bus_ids - fleet_ids
+    if departed:
+        eta_engine.forget(departed)
+        geofencer.forget(departed)
+    tracked_bus_ids = fleet_ids
+
+def refresh_delay_predictions(stop_etas: dict, now: float):
+    """Point each delay prediction at its bus's soonest live stop ETA; kept as is when the bus has none"""
+    soonest = {prediction.bus_id: None for prediction in delay_predictions_data}
+    for stop_id, arrivals in stop_etas.items():
+        for arrival in arrivals:
+            if arrival["bus_id"] not in soonest:
+                continue
+            best = soonest[arrival["bus_id"]]
+            if best is None or arrival["eta_seconds"] < best[1]:
+                soonest[arrival["bus_id"]] = (stop_id, arrival["eta_seconds"])
+    stop_names = {stop.id: stop.name for stop in stops_data}
+    for prediction in delay_predictions_data:
+        best = soonest[prediction.bus_id]
+        if best is None:
+            continue
+        prediction.next_stop = stop_names.get(best[0], prediction.next_stop)
+        prediction.eta = datetime.fromtimestamp(now + best[1]).strftime("%H:%M")
+
+def refresh_etas():
+    """Snap every bus onto its route and refresh bus, stop and delay prediction ETAs"""
+    now = datetime.now().timestamp()
+    forget_departed_buses()
+    results = eta_engine.update(
+        (bus.bus_id, bus.route, bus.lat, bus.lng, now) for bus in live_buses
+    )
+    for bus in live_buses:
+        result = results.get(bus.bus_id)
+        if result is None:
+            continue
+        if result["next_stop"] is not None:
+            bus.next_stop = result["next_stop"]
+        bus.distance_to_next_stop = result["distance_to_next_stop"]
+        bus.eta_seconds = result["eta_seconds"]
+    for stop in stops_data:
+        stop.etas = eta_engine.stop_etas.get(stop.id, [])[:5]
+    refresh_delay_predictions(eta_engine.stop_etas, now)
+
+def record_stop_events(events: list, dwell_recorded: bool = True):
+    """Fold departures into driver dwell KPIs and arrivals (with delay and occupancy) into rollups"""
+    departed_drivers = set()
+    for event in events:
+        if event["type"] != "departure":
+            continue
+        if not dwell_recorded:
+            # Measured by a partition worker's geofencer
+            for kind, key in (("stop", event["stop_id"]), ("route", event["route"]), ("driver", event["driver"])):
+                if key:
+                    geofencer.dwell.add(kind, key, event["dwell_seconds"])
+        departed_drivers.add(event["driver"])
+    for driver in drivers_data:
+        if driver.name in departed_drivers:
+            driver.kpi["avg_dwell_time"] = geofencer.dwell.get("driver", driver.name)["mean"]
+
+    depots = {driver.name: driver.depot for driver in drivers_data}
+    for event in events:
+        if event["type"] == "arrival":
+            rollups.record(event["timestamp"], event["delay"], event["occupancy"],
+                           route=event["route"], depot=depots.get(event["driver"]), driver=event["driver"])
+
+def process_geofences():
+    """Detect stop arrivals/departures and record them"""
+    now = datetime.now().timestamp()
+    events = geofencer.process(
+        (bus.bus_id, bus.route, bus.driver, bus.lat, bus.lng, now) for bus in live_buses
+    )
+    for event in events:
+        if event["type"] == "arrival":
+            bus = live_buses.get(event["bus_id"])
+            event["delay"] = bus.delay
+            event["occupancy"] = bus.occupancy
+    record_stop_events(events)
+    return events
+
+# Writes made through this process, streamed to the WebSocket server from /api/changes
+change_feed = LocalChangeFeed()
+
+# Occupancy anomalies, raised once per episode; open ones are not raised again
+occupancy_monitor = OccupancyMonitor()
+
+def open_anomalies() -> dict:
+    """Anomaly status of every bus with an unresolved anomaly"""
+    return {anomaly.bus_id: anomaly.status for anomaly in anomalies_data if not anomaly.resolved}
+
+def record_anomalies(anomalies: list):
+    anomalies_data.extend(Anomaly(**anomaly) for anomaly in anomalies)
+    for anomaly in anomalies:
+        change_feed.publish("anomalies", "insert", anomaly)
+
+def check_anomalies():
+    """Raise anomalies for buses that crossed an occupancy threshold"""
+    record_anomalies(occupancy_monitor.check(live_buses, datetime.now().timestamp()))
+
+def refresh_kpis(totals: dict):
+    """Fold live fleet totals into the on-time KPI"""
+    kpi = next((kpi for kpi in kpis_data if kpi.title == "On-time Performance"), None)
+    if kpi is None or not totals["buses"]:
+        return
+    delayed = len(totals["delayed_routes"])
+    kpi.value = f"{totals['on_time'] * 100 / totals['buses']:.1f}%"
+    kpi.sub_stats = f"{delayed} delayed route{'' if delayed == 1 else 's'}"
+
+# Map clusters per zoom level, moved incrementally as buses update
+bus_clusters = ClusterIndex()
+
+def refresh_clusters():
+    """Move every bus to its current cluster cells and drop buses that left the fleet"""
+    bus_clusters.retain(live_buses)
+    for bus in live_buses:
+        bus_clusters.update(bus.bus_id, bus.lat, bus.lng, bus.status)
+
+def start_live_state() -> list:
+    """Build the live pipeline, restore the last checkpoint and derive ETAs and clusters; returns the restored sections"""
+    global eta_engine, geofencer, checkpointer
+    eta_engine = build_engine(routes_data, stops_data)
+
+    # Stop geofences; driver dwell statistics continue from the stored KPI
+    geofencer = build_geofencer(stops_data)
+    for driver in drivers_data:
+        geofencer.dwell.seed("driver", driver.name, driver.kpi.get("avg_dwell_time", 0), driver.total_trips)
+
+    # Live fleet, alert and KPI state saved across restarts
+    checkpointer = Checkpointer("api_state.ckpt")
+    checkpointer.register("buses", live_buses.dump, live_buses.restore)
+    checkpointer.register_list("alerts", alerts_data, Alert)
+    checkpointer.register_list("anomalies", anomalies_data, Anomaly)
+    checkpointer.register_list("kpis", kpis_data, KPI)
+    checkpointer.register_list("drivers", drivers_data, Driver)
+    checkpointer.register("dwell", geofencer.dwell.dump, geofencer.dwell.restore)
+    restored = checkpointer.restore()
+
+    for bus_id, status in open_anomalies().items():
+        occupancy_monitor.seed(bus_id, status)
+    refresh_etas()
+    refresh_clusters()
+    return restored
+
+# Partition worker pool running the live pipeline, when FLEET_WORKERS is set
+sharded_fleet: Optional[ShardedFleet] = None
+
+async def start_partitions(workers: int):
+    """Hand the live fleet to partition workers; it is served from their snapshots from now on"""
+    global sharded_fleet
+    sharded_fleet = ShardedFleet(workers, routes_data, stops_data, flagged=open_anomalies)
+    await sharded_fleet.start(live_buses, open_anomalies())
+    live_buses.replace(())
+    checkpointer.register("buses", sharded_fleet.rows_json, live_buses.restore)
+
+async def stop_partitions():
+    """Take the fleet back from the partition workers and stop them"""
+    global sharded_fleet
+    if sharded_fleet is not None:
+        live_buses.restore(json.loads(sharded_fleet.rows_json()))
+        checkpointer.register("buses", live_buses.dump, live_buses.restore)
+        await sharded_fleet.stop()
+        sharded_fleet = None
+
+async def refresh_live_state():
+    """One pass of the live pipeline: ETAs, stop events, anomalies, KPIs and map clusters"""
+    if sharded_fleet is None:
+        refresh_etas()
+        process_geofences()
+        check_anomalies()
+        refresh_kpis(fleet_totals(live_buses))
+        refresh_clusters()
+        return
+    tick = await sharded_fleet.tick()
+    record_stop_events(tick["stop_events"], dwell_recorded=False)
+    record_anomalies(tick["anomalies"])
+    refresh_kpis(sharded_fleet.totals())
+    for stop in stops_data:
+        stop.etas = tick["stop_etas"].get(stop.id, [])
+    refresh_delay_predictions(tick["stop_etas"], datetime.now().timestamp())
+
+# Service assumptions for what-if simulations
+DEFAULT_HEADWAY_MINUTES = 15
+BUS_CAPACITY = 60
+
+def route_profile(route_name: str) -> dict:
+    """Demand and travel-time inputs for simulating a route"""
+    if route_name not in eta_engine.routes:
+        raise HTTPException(status_code=404, detail="Route geometry not found")
+    geometry = eta_engine.routes[route_name]
+    if len(geometry.stop_names) < 2:
+        raise HTTPException(status_code=400, detail="Route needs at least 2 stops to simulate")
+    demand = []
+    for forecast in demand_forecast_data:
+        hours, minutes = forecast.time.split(":")
+        start = int(hours) * 60 + int(minutes)
+        # Forecasts are per half hour
+        demand.append([start, start + 30, forecast.demand * 2])
+    return {
+        "route": route_name,
+        "stops": geometry.stop_names,
+        "segment_minutes": eta_engine.stop_travel_minutes(route_name),
+        "demand": demand,
+        "headway_minutes": DEFAULT_HEADWAY_MINUTES,
+        "capacity": BUS_CAPACITY
+    }
+
+def _request_user(request: Request) -> str:
+    """Admin user for audit entries, as forwarded by a trusted auth proxy"""
+    return forwarded_user(request.scope, TRUSTED_PROXIES) or "admin_user"
+
+def _privileged_users() -> set:
+    """Admin users allowed raw personal data, from PRIVILEGED_USERS (comma-separated)"""
+    return {user.strip() for user in os.environ.get("PRIVILEGED_USERS", "").split(",") if user.strip()}
+
+def _is_privileged(request: Request) -> bool:
+    # Only an identity a trusted auth proxy forwarded counts, never the audit default
+    # or a header the client set itself
+    user = forwarded_user(request.scope, TRUSTED_PROXIES)
+    return user is not None and user in _privileged_users()
+
+def _as_utc(value: datetime) -> datetime:
+    """Treat naive query times as UTC, like the feed timestamps"""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def _client_ip(request: Request) -> Optional[str]:
+    """Client IP for audit entries"""
+    return request.client.host if request.client else None
+
+def bus_model(bus: BusState) -> Bus:
+    """API model for a live bus; the record's fields are already typed, so skip validation"""
+    return Bus.model_construct(
+        id=bus.bus_id,
+        route=bus.route,
+        location=BusLocation.model_construct(lat=bus.lat, lng=bus.lng, address=bus.address or ""),
+        status=bus.status,
+        occupancy=bus.occupancy,
+        driver=bus.driver or "",
+        next_stop=bus.next_stop or "",
+        delay=bus.delay,
+        # Naive UTC, like the feed's last_update
+        last_update=datetime.fromtimestamp(bus.updated_at, timezone.utc).replace(tzinfo=None),
+        speed=bus.speed,
+        direction=bus.direction,
+        distance_to_next_stop=bus.distance_to_next_stop,
+        eta_seconds=bus.eta_seconds
+    )
+
+# Serializes bus lists in one pass of Pydantic's compiled serializer
+bus_list = TypeAdapter(List[Bus])
+
+def buses_response(buses) -> Response:
+    """JSON response for live buses, built at the edge"""
+    return Response(content=bus_list.dump_json([bus_model(bus) for bus in buses]), media_type="application/json")
+
+def mark_stale(response: Response) -> Response:
+    """Flag answers from partition snapshots while a crashed partition worker is being replaced"""
+    if sharded_fleet is not None and sharded_fleet.stale:
+        response.headers["X-Data-Stale"] = "true"
+    return response
+
+# Seconds until a crashed partition worker is replaced by the next live refresh
+PARTITION_RETRY_AFTER = 2
+
+def partition_unavailable(error: PartitionError) -> HTTPException:
+    """503 for lookups that need a partition worker while it is being replaced"""
+    return HTTPException(status_code=503, detail=f"Live data partition unavailable: {error}",
+                         headers={"Retry-After": str(PARTITION_RETRY_AFTER)})
+
 # API Routes
 @router.get("/buses")
 async def get_buses(status: Optional[str] = None):
     """Get all buses or filter by status"""
+    if sharded_fleet is not None:
+        return mark_stale(Response(content=sharded_fleet.buses_json(status), media_type="application/json"))
     if status:
-        return [bus for bus in buses_data if bus.status == status]
-    return buses_data
+        return buses_response(bus for bus in live_buses if bus.status == status)
+    return buses_response(live_buses)
+
+@router.get("/buses/clusters")
+async def get_bus_clusters(response: Response, zoom: int, bbox: Optional[str] = None):
+    """Get bus clusters for a map view; bbox is west,south,east,north"""
+    bounds = None
+    if bbox:
+        try:
+            bounds = tuple(float(value) for value in bbox.split(","))
+        except ValueError:
+            bounds = ()
+        # float() also accepts nan and inf, which no map view has
+        if len(bounds) != 4 or not all(math.isfinite(value) for value in bounds):
+            raise HTTPException(status_code=400, detail="bbox must be west,south,east,north")
+    if sharded_fleet is not None:
+        try:
+            if zoom > MAX_CLUSTER_ZOOM:
+                buses = await sharded_fleet.buses_in_json(bounds) if bounds else sharded_fleet.buses_json()
+                return mark_stale(Response(content=b'{"zoom":%d,"clustered":false,"buses":%s}' % (zoom, buses),
+                                           media_type="application/json"))
+            clusters = await sharded_fleet.clusters(zoom, bounds)
+        except PartitionError as e:
+            raise partition_unavailable(e)
+        mark_stale(response)
+        return {"zoom": zoom, "clustered": True, "clusters": clusters}
+    if zoom > MAX_CLUSTER_ZOOM:
+        bus_ids = set(bus_clusters.bus_ids_in(bounds)) if bounds else None
+        buses = [bus_model(bus) for bus in live_buses if bus_ids is None or bus.bus_id in bus_ids]
+        return {"zoom": zoom, "clustered": False, "buses": buses}
+    return {"zoom": zoom, "clustered": True, "clusters": bus_clusters.clusters(zoom, bounds)}
 
 @router.get("/buses/{bus_id}")
 async def get_bus(bus_id: str):
     """Get specific bus by ID"""
-    bus = next((bus for bus in buses_data if bus.id == bus_id), None)
+    if sharded_fleet is not None:
+        try:
+            bus = await sharded_fleet.bus_json(bus_id)
+        except PartitionError as e:
+            raise partition_unavailable(e)
+        if bus is None:
+            raise HTTPException(status_code=404, detail="Bus not found")
+        return mark_stale(Response(content=bus, media_type="application/json"))
+    bus = live_buses.get(bus_id)
     if not bus:
         raise HTTPException(status_code=404, detail="Bus not found")
-    return bus
+    return bus_model(bus)
 
 @router.get("/stops")
 async def get_stops():
@@ -308,6 +703,26 @@ async def get_recommendations():
     """Get optimization recommendations"""
     return recommendations_data
 
+@router.post("/recommendations/{recommendation_id}/simulate")
+async def simulate_recommendation(recommendation_id: str):
+    """Project a recommendation's KPI impact with the what-if simulator"""
+    recommendation = next((rec for rec in recommendations_data if rec.id == recommendation_id), None)
+    if not recommendation:
+        raise HTTPException(status_code=404, detail="Recommendation not found")
+    if not recommendation.scenario:
+        raise HTTPException(status_code=400, detail="Recommendation has no simulation scenario")
+    scenario = recommendation.scenario
+    result = await simulation_runner.run(route_profile(scenario.route), scenario.engine_input())
+    recommendation.kpi_impact = result["kpi_impact"]
+    recommendation.simulation_applied = True
+    return {"recommendation": recommendation, "simulation": result}
+
+@router.post("/simulations")
+async def run_simulations(simulation: SimulationRequest):
+    """Compare what-if scenarios for a route"""
+    scenarios = [scenario.engine_input() for scenario in simulation.scenarios]
+    return await simulation_runner.run_many(route_profile(simulation.route), scenarios)
+
 @router.get("/alerts")
 async def get_alerts(status: Optional[str] = None):
     """Get alerts or filter by status"""
@@ -316,27 +731,56 @@ async def get_alerts(status: Optional[str] = None):
     return alerts_data
 
 @router.put("/alerts/{alert_id}/acknowledge")
-async def acknowledge_alert(alert_id: str):
+async def acknowledge_alert(alert_id: str, request: Request):
     """Acknowledge an alert"""
     for alert in alerts_data:
         if alert.id == alert_id:
             alert.acknowledged = True
             alert.status = "acknowledged"
+            change_feed.publish("alerts", "update", key=alert_id,
+                                updated_fields={"acknowledged": True, "status": "acknowledged"})
+            audit_log.record(_request_user(request), "Acknowledged alert", alert_id, _client_ip(request))
             return alert
     raise HTTPException(status_code=404, detail="Alert not found")
 
 @router.put("/alerts/{alert_id}/resolve")
-async def resolve_alert(alert_id: str):
+async def resolve_alert(alert_id: str, request: Request):
     """Resolve an alert"""
     for alert in alerts_data:
         if alert.id == alert_id:
             alert.status = "resolved"
+            change_feed.publish("alerts", "update", key=alert_id, updated_fields={"status": "resolved"})
+            audit_log.record(_request_user(request), "Resolved alert", alert_id, _client_ip(request))
             return alert
     raise HTTPException(status_code=404, detail="Alert not found")
 
+@router.get("/changes")
+async def stream_changes(resume_after: Optional[str] = None):
+    """Stream this process's writes as NDJSON change events, after resume_after when given"""
+    if resume_after is not None:
+        try:
+            covered = change_feed.covers(resume_after)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid resume token")
+        if not covered:
+            raise HTTPException(status_code=410, detail="Change history no longer reaches this resume token")
+
+    async def body():
+        try:
+            async for event in change_feed.watch(resume_after):
+                yield json.dumps(event).encode() + b"\n"
+        except ResumeTokenExpired:
+            # Fell further behind than the history: the reconnect after the last token gets a 410
+            return
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
 @router.get("/kpis")
-async def get_kpis():
+async def get_kpis(response: Response):
     """Get KPIs"""
+    if sharded_fleet is not None:
+        refresh_kpis(sharded_fleet.totals())
+        mark_stale(response)
     return kpis_data
 
 @router.get("/drivers")
@@ -354,7 +798,123 @@ async def get_driver(driver_id: str):
         raise HTTPException(status_code=404, detail="Driver not found")
     return driver
 
+@router.get("/dwell-times")
+async def get_dwell_times(kind: str = "stop"):
+    """Get running dwell-time statistics per stop, route or driver"""
+    if kind not in ("stop", "route", "driver"):
+        raise HTTPException(status_code=400, detail="kind must be stop, route or driver")
+    return geofencer.dwell.all(kind)
+
+@router.get("/analytics")
+async def get_analytics(request: Request,
+                        dimension: str = "route",
+                        granularity: str = "hour",
+                        start: Optional[datetime] = None,
+                        end: Optional[datetime] = None,
+                        key: Optional[str] = None,
+                        group_by: str = "bucket"):
+    """OTP, delay and occupancy rollups per route, depot or driver (defaults to the last 30 days)"""
+    if dimension not in DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"dimension must be one of {', '.join(DIMENSIONS)}")
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+    if group_by not in GROUPINGS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(GROUPINGS)}")
+    if group_by == "hour_of_day" and granularity != "hour":
+        raise HTTPException(status_code=400, detail="group_by=hour_of_day needs hourly granularity")
+
+    end = _as_utc(end) if end else datetime.now(timezone.utc)
+    start = _as_utc(start) if start else end - timedelta(days=30)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    # Ranges older than the in-memory window are read from the stored rollups
+    db = getattr(request.app.state, "db", None)
+    results = await rollups.query(dimension, granularity, start, end, key, group_by,
+                                  collection=db.rollups if db is not None else None)
+    return {
+        "dimension": dimension,
+        "granularity": granularity,
+        "group_by": group_by,
+        "start": start,
+        "end": end,
+        "results": results
+    }
+
+@router.get("/exports/{dataset}")
+async def export_dataset(dataset: str,
+                         request: Request,
+                         format: str = "csv",
+                         route: Optional[str] = None,
+                         start: Optional[datetime] = None,
+                         end: Optional[datetime] = None,
+                         anonymize: bool = True):
+    """Stream a dataset as CSV, NDJSON or Arrow; raw passenger data only for consenting passengers"""
+    if dataset not in DATASETS:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    if format not in ENCODERS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(ENCODERS)}")
+    if not anonymize and DATASETS[dataset]["personal"] and not _is_privileged(request):
+        raise HTTPException(status_code=403, detail="Raw personal data exports need a privileged admin user")
+    db = getattr(request.app.state, "db", None)
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database not configured")
+    try:
+        encoder = ENCODERS[format](DATASETS[dataset]["fields"])
+    except ImportError:
+        raise HTTPException(status_code=501, detail=f"{format} export needs pyarrow installed")
+
+    export = ExportStream(db, dataset, encoder, build_query(dataset, route, start, end), anonymize)
+    user, ip_address = _request_user(request), _client_ip(request)
+    resource = f"{route or 'All routes'} {DATASETS[dataset]['title']}"
+
+    async def body():
+        try:
+            async for chunk in export:
+                yield chunk
+        finally:
+            label = DATASETS[dataset]["label"]
+            action = f"Exported {label} data" if export.completed else f"Interrupted {label} data export"
+            audit_log.record(user, action, f"{resource} ({format}, {export.rows} rows)", ip_address,
+                             anonymized=anonymize or not DATASETS[dataset]["personal"])
+
+    filename = f"{dataset}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{encoder.extension}"
+    return StreamingResponse(body(), media_type=encoder.media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
 @router.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "timestamp": datetime.now()}
\ No newline at end of file
+    return {"status": "healthy", "timestamp": datetime.now()}
+
+@router.post("/admin/profile", response_class=PlainTextResponse)
+async def profile(request: Request, seconds: float = 10.0, interval_ms: float = Query(5.0, ge=1, le=1000)):
+    """Sample all thread stacks for N seconds and return collapsed stacks"""
+    if not 0 < seconds <= 120:
+        raise HTTPException(status_code=400, detail="seconds must be between 0 and 120")
+    if sampler.running:
+        raise HTTPException(status_code=409, detail="A profiling session is already running")
+    audit_log.record(_request_user(request), "Started profiler", f"{seconds}s", _client_ip(request))
+    try:
+        stacks = await asyncio.to_thread(sampler.sample, seconds, interval_ms / 1000)
+    except RuntimeError as e:
+        # Another session started between the check above and this one
+        raise HTTPException(status_code=409, detail=str(e))
+    return render_collapsed(stacks)
+
+@router.get("/admin/slow-requests")
+async def get_slow_requests():
+    """Get captured slow requests with stacks and timing breakdowns"""
+    return {
+        "threshold_ms": slow_operations.threshold * 1000 if slow_operations.enabled else None,
+        "requests": slow_operations.recent()
+    }
+
+@router.put("/admin/slow-requests")
+async def configure_slow_requests(request: Request, threshold_ms: Optional[float] = Query(None, ge=1, le=60000)):
+    """Enable slow request capture above threshold_ms, or disable it when omitted"""
+    if threshold_ms:
+        slow_operations.enable(threshold_ms)
+    else:
+        slow_operations.disable()
+    audit_log.record(_request_user(request), "Configured slow request capture", str(threshold_ms), _client_ip(request))
+    return {"threshold_ms": threshold_ms}
@@ -0,0 +1,277 @@
+"""
+Audit Log Writer
+This module buffers audit log entries in memory and writes them to the
+audit_logs collection in batches from a background task
+
+Entries get their _id when they are recorded, so writing an entry again
+after a partial failure or a spill replay is a duplicate key error that is
+ignored rather than a second copy of the entry. Entries the database keeps
+rejecting for other reasons (validation, say) are moved to a dead-letter
+file after MAX_ATTEMPTS writes instead of being retried forever.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+# Writes of an entry the database rejected before it is dead-lettered
+MAX_ATTEMPTS = 3
+
+
+def _encode(value: Any) -> str:
+    """JSON encoding for the spill file"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _decode(line: str) -> Dict[str, Any]:
+    entry = json.loads(line)
+    entry["timestamp"] = datetime.fromisoformat(entry["timestamp"])
+    # Entries spilled before IDs were assigned on record get one now
+    entry["_id"] = ObjectId(entry["_id"]) if "_id" in entry else ObjectId()
+    return entry
+
+
+class AuditLogWriter:
+    def __init__(self,
+                 collection=None,
+                 batch_size: int = 500,
+                 flush_interval: float = 1.0,
+                 max_buffer: int = 50000,
+                 spill_path: str = "audit_spill.ndjson"):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = Path(spill_path)
+        self.dead_letter_path = self.spill_path.with_suffix(".dead")
+
+        # Ring buffer of pending entries; the oldest entries are evicted when full
+        self._buffer: deque = deque(maxlen=max_buffer)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # Rejected writes so far of entries the database refused, by _id
+        self._attempts: Dict[ObjectId, int] = {}
+
+        # Counters for health reporting
+        self.written = 0
+        self.spilled = 0
+        self.dropped = 0
+        self.dead_lettered = 0
+
+    def record(self, user: str, action: str, resource: str,
+               ip_address: Optional[str] = None, anonymized: bool = False) -> None:
+        """Queue an audit log entry without waiting for the database"""
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append({
+            "_id": ObjectId(),
+            "user": user,
+            "action": action,
+            "resource": resource,
+            "timestamp": datetime.utcnow(),
+            "ip_address": ip_address,
+            "anonymized": anonymized
+        })
+        if self._wakeup is not None and len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self, collection=None) -> None:
+        """Start the background flush task on the running event loop"""
+        if collection is not None:
+            self.collection = collection
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background task and flush everything still buffered"""
+        if self._task is not None:
+            # Not cancelled: a flush in progress finishes rather than losing its batch
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._wakeup = None
+        while self._buffer:
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Write one batch of buffered entries, spilling to disk on failure"""
+        batch = self._take_batch()
+        if not batch:
+            return 0
+        if self.collection is None:
+            self._spill(batch)
+            return 0
+        try:
+            await self._replay_spill()
+            failed = await self._insert(batch)
+        except Exception as e:
+            logger.warning(f"Audit log write failed, spilling {len(batch)} entries: {e}")
+            self._spill(batch)
+            return 0
+        except BaseException:
+            # Cancelled mid-write: back into the buffer; entries already stored are ignored duplicates
+            self._buffer.extendleft(reversed(batch))
+            raise
+        if failed:
+            logger.warning(f"Audit log write failed for {len(failed)} of {len(batch)} entries")
+            self._spill(self._retry_later(failed))
+        self.written += len(batch) - len(failed)
+        return len(batch) - len(failed)
+
+    async def _run(self):
+        """Flush when a batch fills up or the flush interval elapses, until stopped"""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                break
+            try:
+                while self._buffer:
+                    await self.flush()
+                    if len(self._buffer) < self.batch_size:
+                        break
+            except Exception:
+                # Keep flushing later batches rather than ending the task
+                logger.exception("Audit log flush failed")
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        """Pop up to batch_size entries off the buffer"""
+        count = min(self.batch_size, len(self._buffer))
+        return [self._buffer.popleft() for _ in range(count)]
+
+    async def _insert(self, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Insert entries, returning the ones that failed (entries already stored are not failures)"""
+        try:
+            await self.collection.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            return [entries[error["index"]] for error in e.details.get("writeErrors", [])
+                    if error.get("code") != DUPLICATE_KEY]
+        return []
+
+    def _retry_later(self, failed: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Count a rejected write of each entry; returns those to retry, dead-lettering the rest"""
+        retry, dead = [], []
+        for entry in failed:
+            attempts = self._attempts.get(entry["_id"], 0) + 1
+            if attempts >= MAX_ATTEMPTS:
+                self._attempts.pop(entry["_id"], None)
+                dead.append(entry)
+            else:
+                self._attempts[entry["_id"]] = attempts
+                retry.append(entry)
+        if dead:
+            logger.error(f"Audit log entries rejected {MAX_ATTEMPTS} times, moving {len(dead)} to {self.dead_letter_path}")
+            try:
+                with open(self.dead_letter_path, "a") as f:
+                    for entry in dead:
+                        f.write(json.dumps(entry, default=_encode) + "\n")
+                self.dead_lettered += len(dead)
+            except OSError as e:
+                logger.error(f"Audit log dead-letter write failed, dropping {len(dead)} entries: {e}")
+                self.dropped += len(dead)
+        return retry
+
+    def _lines(self, batch: List[Dict[str, Any]]) -> str:
+        # Rejection counts travel with spilled entries so they survive a restart
+        return "".join(
+            json.dumps({**entry, "_attempts": self._attempts[entry["_id"]]} if entry["_id"] in self._attempts
+                       else entry, default=_encode) + "\n"
+            for entry in batch
+        )
+
+    def _spill(self, batch: List[Dict[str, Any]]) -> None:
+        """Append entries to the local spill file; entries are dropped if the file cannot be written"""
+        if not batch:
+            return
+        try:
+            with open(self.spill_path, "a") as f:
+                f.write(self._lines(batch))
+        except OSError as e:
+            logger.error(f"Audit log spill to {self.spill_path} failed, dropping {len(batch)} entries: {e}")
+            self.dropped += len(batch)
+            return
+        self.spilled += len(batch)
+
+    async def _replay_spill(self) -> None:
+        """Write spilled entries back to the database once it is reachable, one batch at a time"""
+        replay_path = self.spill_path.with_suffix(".replay")
+        # A replay file left by an interrupted replay is finished before the spill file is taken
+        if not replay_path.exists():
+            if not self.spill_path.exists():
+                return
+            os.replace(self.spill_path, replay_path)
+        with open(replay_path) as replay:
+            batch: List[Dict[str, Any]] = []
+            for line in replay:
+                if line.strip():
+                    entry = _decode(line)
+                    attempts = entry.pop("_attempts", 0)
+                    if attempts:
+                        self._attempts[entry["_id"]] = attempts
+                    batch.append(entry)
+                if len(batch) == self.batch_size:
+                    await self._replay_batch(batch, replay)
+                    batch = []
+            if batch:
+                await self._replay_batch(batch, replay)
+        os.remove(replay_path)
+
+    async def _replay_batch(self, batch: List[Dict[str, Any]], replay) -> None:
+        try:
+            failed = await self._insert(batch)
+        except Exception:
+            # Put this batch and the rest of the replay file back so they are retried on the next flush
+            with open(self.spill_path, "a") as f:
+                f.write(self._lines(batch))
+                shutil.copyfileobj(replay, f)
+            replay.close()
+            os.remove(replay.name)
+            raise
+        failed_ids = {entry["_id"] for entry in failed}
+        for entry in batch:
+            if entry["_id"] not in failed_ids:
+                self._attempts.pop(entry["_id"], None)
+        retry = self._retry_later(failed)
+        if retry:
+            # Already counted as spilled, they just go back into the spill file
+            self._spill(retry)
+            self.spilled -= len(retry)
+        self.written += len(batch) - len(failed)
+        self.spilled -= min(self.spilled, len(batch) - len(retry))
+
+    def stats(self) -> Dict[str, int]:
+        """Return writer counters for health checks"""
+        return {
+            "buffered": len(self._buffer),
+            "written": self.written,
+            "spilled": self.spilled,
+            "dropped": self.dropped,
+            "dead_lettered": self.dead_lettered
+        }
+
+
+# Shared writer used by the API routes
+audit_log = AuditLogWriter()
@@ -0,0 +1,367 @@
+"""
+Benchmark Suite
+Drives the REST API and the WebSocket feed in-process with a synthetic fleet
+and compares the results against stored JSON baselines
+
+Usage (from the backend directory):
+    python -m benchmarks.run --fleet 1000 --clients 50
+    python -m benchmarks.run --fleet 10000 --save
+    python -m benchmarks.run --fleet 10000 --memory --skip-websocket
+    python -m benchmarks.run --fleet 100000 --shards 1 2 4 8 --endpoints --skip-websocket
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+import httpx
+import websockets
+
+from api import routes
+from fleet.state import BusState, FleetState
+from sharding.pool import ShardedFleet
+from websocket import server as ws_server
+
+BASELINE_DIR = Path(__file__).parent / "baselines"
+
+# Depot centres the synthetic fleet is scattered around
+DEPOTS = [
+    ("Vijayawada", 16.5062, 80.6480),
+    ("Visakhapatnam", 17.6868, 83.2185),
+    ("Guntur", 16.3067, 80.4365),
+    ("Tirupati", 13.6288, 79.4192),
+    ("Kurnool", 15.8281, 78.0373)
+]
+
+STATUSES = ["active", "active", "active", "delayed", "emergency", "inactive"]
+
+
+def make_fleet(size: int, seed: int = 42) -> List[BusState]:
+    """Generate a reproducible synthetic fleet of buses"""
+    rng = random.Random(seed)
+    now = time.time()
+    fleet = []
+    for i in range(size):
+        depot, lat, lng = DEPOTS[i % len(DEPOTS)]
+        fleet.append(BusState(
+            bus_id=f"APSRTC{i + 1:06d}",
+            route=f"Route {rng.randint(1, 400)}",
+            lat=lat + rng.uniform(-0.3, 0.3),
+            lng=lng + rng.uniform(-0.3, 0.3),
+            address=f"{depot} Depot",
+            status=rng.choice(STATUSES),
+            occupancy=rng.randint(0, 100),
+            driver=f"Driver {i + 1}",
+            next_stop="Benz Circle",
+            delay=rng.randint(0, 20),
+            updated_at=now,
+            speed=rng.uniform(0, 60),
+            direction=rng.randint(0, 359)
+        ))
+    return fleet
+
+
+def make_alerts(size: int, seed: int = 42) -> List[routes.Alert]:
+    """Generate one alert per twenty buses"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    return [
+        routes.Alert(
+            id=f"ALERT{i + 1:06d}",
+            type=rng.choice(["emergency", "delay", "violation", "maintenance", "crowd", "schedule"]),
+            title="Synthetic alert",
+            message="Generated by the benchmark suite",
+            bus_id=f"APSRTC{rng.randint(1, max(size, 1)):06d}",
+            route=f"Route {rng.randint(1, 400)}",
+            location="Vijayawada",
+            timestamp=now,
+            status=rng.choice(["active", "acknowledged", "resolved"]),
+            priority=rng.choice(["high", "medium", "low"]),
+            assigned_to="Control Room",
+            escalation="SMS",
+            acknowledged=False
+        )
+        for i in range(max(1, size // 20))
+    ]
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def rss_mb() -> float:
+    """Current resident set size in MiB"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        # Fall back to the peak RSS where /proc is unavailable
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def summarize(name: str, latencies: List[float], elapsed: float, total_bytes: int,
+              count: int, extra: Dict[str, Any]) -> Dict[str, Any]:
+    """Build a result record from raw latency samples (seconds)"""
+    result = {
+        "benchmark": name,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+        "throughput_per_s": round(count / elapsed, 2) if elapsed else 0.0,
+        "bytes_per_op": total_bytes // count if count else 0,
+        "rss_mb": round(rss_mb(), 1)
+    }
+    result.update(extra)
+    return result
+
+
+async def bench_rest(path: str, fleet_size: int, clients: int, requests_per_client: int) -> Dict[str, Any]:
+    """Hammer a REST endpoint from concurrent in-process clients"""
+    from server import app
+
+    latencies: List[float] = []
+    total_bytes = 0
+
+    async def worker(number: int):
+        nonlocal total_bytes
+        # A distinct address per client, like separate dashboards, so each gets its own rate limit
+        transport = httpx.ASGITransport(app=app, client=(f"10.0.{number // 250}.{number % 250 + 1}", 40000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for _ in range(requests_per_client):
+                started = time.perf_counter()
+                response = await client.get(path)
+                latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+                total_bytes += len(response.content)
+
+    # Warm up routing and serialization before measuring
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        await client.get(path)
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(number) for number in range(clients)))
+    elapsed = time.perf_counter() - started
+
+    return summarize(f"rest:{path}", latencies, elapsed, total_bytes, len(latencies),
+                     {"fleet": fleet_size, "clients": clients})
+
+
+async def bench_websocket(fleet_size: int, clients: int, ticks: int) -> Dict[str, Any]:
+    """Measure fan-out latency of feed ticks to connected WebSocket clients"""
+    server = await websockets.serve(ws_server.handle_client, "127.0.0.1", 0, max_size=None)
+    port = server.sockets[0].getsockname()[1]
+    connections = [
+        await websockets.connect(f"ws://127.0.0.1:{port}", max_size=None)
+        for _ in range(clients)
+    ]
+    for connection in connections:
+        await connection.recv()  # initial_data snapshot
+
+    latencies: List[float] = []
+    tick_durations: List[float] = []
+    total_bytes = 0
+
+    async def receive(connection, started: float):
+        message = await connection.recv()
+        latencies.append(time.perf_counter() - started)
+        return len(message)
+
+    started_all = time.perf_counter()
+    for _ in range(ticks):
+        started = time.perf_counter()
+        ws_server.step_mock_data()
+        receivers = [asyncio.create_task(receive(c, started)) for c in connections]
+        await ws_server.broadcast_data(ws_server.fleet_message())
+        tick_durations.append(time.perf_counter() - started)
+        sizes = await asyncio.gather(*receivers)
+        total_bytes += sizes[0] if sizes else 0
+    elapsed = time.perf_counter() - started_all
+
+    for connection in connections:
+        await connection.close()
+    server.close()
+    await server.wait_closed()
+
+    return summarize("websocket:bus_updates", latencies, elapsed, total_bytes, ticks, {
+        "fleet": fleet_size,
+        "clients": clients,
+        "tick_p95_ms": round(percentile(tick_durations, 95) * 1000, 3)
+    })
+
+
+async def bench_shards(fleet_size: int, workers: int, ticks: int) -> Dict[str, Any]:
+    """Live pipeline ticks with the fleet partitioned across worker processes"""
+    pool = ShardedFleet(workers, routes.routes_data, routes.stops_data)
+    await pool.start(make_fleet(fleet_size))
+    try:
+        # Synthetic movement inside the workers, so the tick measures the partitions
+        await pool.tick(jitter=0.0001)
+        latencies: List[float] = []
+        started_all = time.perf_counter()
+        for _ in range(ticks):
+            started = time.perf_counter()
+            await pool.tick(jitter=0.0001)
+            latencies.append(time.perf_counter() - started)
+        elapsed = time.perf_counter() - started_all
+        started = time.perf_counter()
+        buses = pool.buses_json()
+        gather_ms = (time.perf_counter() - started) * 1000
+    finally:
+        await pool.stop()
+    return summarize(f"shards:{workers}", latencies, elapsed, len(buses) * ticks, ticks, {
+        "fleet": fleet_size,
+        "clients": 0,
+        "workers": workers,
+        "gather_ms": round(gather_ms, 3)
+    })
+
+
+def load_fleet(fleet_size: int):
+    """Install the synthetic fleet into the REST and WebSocket stores"""
+    routes.live_buses.replace(make_fleet(fleet_size))
+    routes.alerts_data[:] = make_alerts(fleet_size)
+    ws_server.live_buses.replace(make_fleet(fleet_size))
+
+
+def allocated_bytes(build) -> int:
+    """Bytes still allocated by what build() returns"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = build()
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del kept
+    return allocated
+
+
+def bench_memory(fleet_size: int) -> Dict[str, Any]:
+    """Memory held per bus by the live fleet records, against Pydantic models and feed dicts"""
+    fleet = make_fleet(fleet_size)
+    per_bus = {
+        "bytes_per_bus": allocated_bytes(lambda: FleetState(make_fleet(fleet_size))) / fleet_size,
+        "model_bytes_per_bus": allocated_bytes(lambda: [routes.bus_model(bus) for bus in fleet]) / fleet_size,
+        "dict_bytes_per_bus": allocated_bytes(lambda: [bus.to_message() for bus in fleet]) / fleet_size
+    }
+    result = {"benchmark": "memory:live_fleet", "fleet": fleet_size, "clients": 0}
+    result.update({key: round(value, 1) for key, value in per_bus.items()})
+    result["mb_per_10k_buses"] = round(per_bus["bytes_per_bus"] * 10000 / 2 ** 20, 2)
+    return result
+
+
+def baseline_path(result: Dict[str, Any]) -> Path:
+    """Baseline file for a benchmark at a given fleet and client count"""
+    name = result["benchmark"].replace(":", "_").replace("/", "_").strip("_")
+    return BASELINE_DIR / f"{name}-{result['fleet']}x{result['clients']}.json"
+
+
+def compare(result: Dict[str, Any], tolerance: float) -> List[str]:
+    """Return regressions of a result against its stored baseline"""
+    path = baseline_path(result)
+    if not path.exists():
+        return []
+    baseline = json.loads(path.read_text())
+    regressions = []
+    for key in ("p50_ms", "p95_ms", "p99_ms", "bytes_per_op", "rss_mb", "bytes_per_bus"):
+        if baseline.get(key) and result[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{result['benchmark']} {key}: {baseline[key]} -> {result[key]}")
+    if baseline.get("throughput_per_s") and result["throughput_per_s"] < baseline["throughput_per_s"] * (1 - tolerance):
+        regressions.append(f"{result['benchmark']} throughput_per_s: "
+                           f"{baseline['throughput_per_s']} -> {result['throughput_per_s']}")
+    return regressions
+
+
+async def run(args) -> List[Dict[str, Any]]:
+    """Run every selected benchmark, with the app lifespan when a MongoDB is given"""
+    if not args.mongo_url:
+        # The part of the lifespan the in-memory endpoints need
+        routes.start_live_state()
+        return await run_benchmarks(args)
+
+    from server import app
+    os.environ["MONGO_URL"] = args.mongo_url
+    os.environ["DB_NAME"] = args.db_name
+    async with app.router.lifespan_context(app):
+        return await run_benchmarks(args)
+
+
+async def run_benchmarks(args) -> List[Dict[str, Any]]:
+    """Run every selected benchmark for each fleet size"""
+    results = []
+    for fleet_size in args.fleet:
+        if args.memory:
+            results.append(bench_memory(fleet_size))
+        load_fleet(fleet_size)
+        for path in args.endpoints:
+            results.append(await bench_rest(path, fleet_size, args.clients, args.requests))
+        if not args.skip_websocket:
+            results.append(await bench_websocket(fleet_size, args.clients, args.ticks))
+        sharded = [await bench_shards(fleet_size, workers, args.ticks) for workers in args.shards]
+        for result in sharded:
+            # Tick throughput relative to the smallest pool
+            result["speedup"] = round(result["throughput_per_s"] / sharded[0]["throughput_per_s"], 2)
+        results.extend(sharded)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="APSRTC dashboard benchmark suite")
+    parser.add_argument("--fleet", type=int, nargs="+", default=[1000],
+                        help="fleet sizes to benchmark (e.g. 1000 10000 100000)")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent REST and WebSocket clients")
+    parser.add_argument("--requests", type=int, default=10, help="requests per REST client")
+    parser.add_argument("--ticks", type=int, default=20, help="WebSocket ticks to broadcast")
+    parser.add_argument("--endpoints", nargs="*", default=["/api/buses", "/api/alerts"])
+    parser.add_argument("--skip-websocket", action="store_true")
+    parser.add_argument("--memory", action="store_true", help="also measure memory held per live bus")
+    parser.add_argument("--shards", type=int, nargs="*", default=[],
+                        help="partition worker counts to benchmark live pipeline ticks with (e.g. 1 2 4 8)")
+    parser.add_argument("--mongo-url", help="run the app lifespan against this MongoDB instead of in-memory data")
+    parser.add_argument("--db-name", default=os.environ.get("DB_NAME", "apsrtc_benchmark"),
+                        help="database to use with --mongo-url (default: $DB_NAME, else apsrtc_benchmark)")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression ratio")
+    args = parser.parse_args()
+
+    # Keep per-request client logging out of the results
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+
+    regressions = [r for result in results for r in compare(result, args.tolerance)]
+    if args.save:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        for result in results:
+            baseline_path(result).write_text(json.dumps(result, indent=2) + "\n")
+        print(f"Saved {len(results)} baselines to {BASELINE_DIR}")
+    elif regressions:
+        print("Regressions against baseline:")
+        for regression in regressions:
+            print(f"- {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""
+Change Feed
+This module turns writes to the buses, alerts and anomalies collections into
+typed change events for live clients
+
+Three sources produce the same events:
+    MongoChangeFeed  - MongoDB change streams (requires a replica set)
+    LocalChangeFeed  - in-process feed; the API publishes its writes to one
+    HttpChangeFeed   - another process's LocalChangeFeed, streamed over HTTP
+
+Every event carries a resume token. Passing the last token seen back to
+watch() continues the feed after that event instead of starting over.
+Local feed tokens carry a per-process epoch, so a token from before an API
+restart is reported as expired rather than silently skipping events.
+"""
+
+import asyncio
+import json
+import logging
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Any, AsyncIterator, Deque, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Collections pushed to live clients and the field identifying their documents
+KEY_FIELDS = {"buses": "bus_id", "alerts": "id", "anomalies": "id"}
+
+# Event name prefix per collection
+EVENT_PREFIXES = {"buses": "bus", "alerts": "alert", "anomalies": "anomaly"}
+
+# Change stream operation to event action
+ACTIONS = {"insert": "created", "update": "updated", "replace": "updated", "delete": "removed"}
+
+# Events the local feed keeps for resuming subscribers
+HISTORY_SIZE = 4096
+
+# Events queued per local feed subscriber; one further behind catches up from the history
+SUBSCRIBER_QUEUE_SIZE = 1024
+
+# Seconds to wait before reopening a dropped change stream, doubling up to the maximum
+RETRY_SECONDS = 1.0
+MAX_RETRY_SECONDS = 30.0
+
+# Server error code for a resume token that fell off the oplog
+CHANGE_STREAM_HISTORY_LOST = 286
+
+
+class ResumeTokenExpired(Exception):
+    """The feed no longer has history back to the requested resume token"""
+
+
+def _jsonable(value: Any) -> Any:
+    """Copy a document into JSON-safe types (ObjectIds and other BSON types become strings)"""
+    if isinstance(value, dict):
+        return {key: _jsonable(item) for key, item in value.items() if key != "_id"}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def change_event(collection: str, operation: str, key: str, resume_token: str,
+                 document: Optional[dict] = None, updated_fields: Optional[dict] = None,
+                 removed_fields: Optional[List[str]] = None) -> dict:
+    """Build the typed event sent to clients for one collection write"""
+    event = {
+        "type": "change",
+        "event": f"{EVENT_PREFIXES.get(collection, collection)}_{ACTIONS.get(operation, operation)}",
+        "collection": collection,
+        "operation": operation,
+        "id": key,
+        "resume_token": resume_token,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    if document is not None:
+        event["document"] = _jsonable(document)
+    if updated_fields:
+        event["updated_fields"] = _jsonable(updated_fields)
+    if removed_fields:
+        event["removed_fields"] = list(removed_fields)
+    return event
+
+
+class LocalChangeFeed:
+    """In-process change feed with the same resume semantics as Mongo change streams"""
+
+    def __init__(self, history: int = HISTORY_SIZE, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self._history: Deque[dict] = deque(maxlen=history)
+        self._sequence = 0
+        # Tokens from another process (or an earlier run of this one) are never resumable here
+        self.epoch = uuid.uuid4().hex[:8]
+        self.queue_size = queue_size
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    def _token(self, sequence: int) -> str:
+        # Fixed-width hex, so tokens of one epoch compare in publish order
+        return f"{self.epoch}-{sequence:016x}"
+
+    def publish(self, collection: str, operation: str, document: Optional[dict] = None,
+                key: Optional[str] = None, updated_fields: Optional[dict] = None,
+                removed_fields: Optional[List[str]] = None) -> dict:
+        """Record a write and deliver it to every watcher"""
+        if key is None:
+            key = str(document[KEY_FIELDS.get(collection, "_id")])
+        self._sequence += 1
+        event = change_event(collection, operation, key, self._token(self._sequence),
+                             document, updated_fields, removed_fields)
+        self._history.append(event)
+        for queue in self._subscribers:
+            if queue.full():
+                # Too far behind: drop what it has queued and let it catch up from the history
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+            else:
+                queue.put_nowait(event)
+        return event
+
+    def covers(self, resume_after: str) -> bool:
+        """Whether the history still holds every event after a resume token (ValueError if it is not one)"""
+        epoch, _, sequence = resume_after.partition("-")
+        position = int(sequence, 16)
+        if epoch != self.epoch or position > self._sequence:
+            return False
+        # The event right after the token must still be in the history
+        return not self._history or position + 1 >= int(self._history[0]["resume_token"].partition("-")[2], 16)
+
+    def _since(self, last: str) -> List[dict]:
+        if not self.covers(last):
+            raise ResumeTokenExpired(last)
+        return [event for event in self._history if event["resume_token"] > last]
+
+    async def watch(self, resume_after: Optional[str] = None) -> AsyncIterator[dict]:
+        """Yield events after resume_after (or from now), then live ones as they are published"""
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        # Subscribe before replaying so nothing published meanwhile is missed
+        self._subscribers.add(queue)
+        try:
+            last = resume_after or self._token(self._sequence)
+            backlog = self._since(resume_after) if resume_after is not None else []
+            while True:
+                for event in backlog:
+                    if event["resume_token"] > last:
+                        last = event["resume_token"]
+                        yield event
+                event = await queue.get()
+                # None: this watcher fell behind its queue, replay what it missed
+                backlog = self._since(last) if event is None else [event]
+        finally:
+            self._subscribers.discard(queue)
+
+
+class MongoChangeFeed:
+    """Change events from a MongoDB change stream over the watched collections"""
+
+    def __init__(self, db, collections: Iterable[str] = tuple(KEY_FIELDS)):
+        self.db = db
+        self.collections = list(collections)
+
+    def _event(self, change: dict) -> dict:
+        collection = change["ns"]["coll"]
+        document = change.get("fullDocument")
+        key_field = KEY_FIELDS.get(collection)
+        if document is not None and key_field in document:
+            key = str(document[key_field])
+        else:
+            key = str(change["documentKey"]["_id"])
+        update = change.get("updateDescription") or {}
+        return change_event(collection, change["operationType"], key, change["_id"]["_data"],
+                            document, update.get("updatedFields"), update.get("removedFields"))
+
+    async def watch(self, resume_after: Optional[str] = None) -> AsyncIterator[dict]:
+        """Yield change events, reopening the stream after the last token if it drops"""
+        from pymongo.errors import OperationFailure, PyMongoError
+
+        pipeline = [
+            {"$match": {"ns.coll": {"$in": self.collections}, "operationType": {"$in": list(ACTIONS)}}}
+        ]
+        token = resume_after
+        while True:
+            try:
+                async with self.db.watch(pipeline, full_document="updateLookup",
+                                         resume_after={"_data": token} if token else None) as stream:
+                    async for change in stream:
+                        event = self._event(change)
+                        token = event["resume_token"]
+                        yield event
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    raise ResumeTokenExpired(token) from e
+                raise
+            except PyMongoError as e:
+                logger.warning(f"Change stream interrupted, resuming after {token}: {e}")
+                await asyncio.sleep(RETRY_SECONDS)
+
+
+class HttpChangeFeed:
+    """Change events streamed as NDJSON from the API's /api/changes endpoint"""
+
+    def __init__(self, url: str, transport=None):
+        self.url = url
+        # httpx transport override, e.g. to stream from an in-process app
+        self.transport = transport
+
+    async def watch(self, resume_after: Optional[str] = None) -> AsyncIterator[dict]:
+        """Yield change events, reconnecting after the last token with backoff if the stream drops"""
+        import httpx
+
+        token = resume_after
+        delay = RETRY_SECONDS
+        async with httpx.AsyncClient(transport=self.transport, timeout=httpx.Timeout(10.0, read=None)) as client:
+            while True:
+                try:
+                    async with client.stream("GET", self.url, params={"resume_after": token} if token else None) as response:
+                        if response.status_code == 410:
+                            raise ResumeTokenExpired(token)
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if line:
+                                event = json.loads(line)
+                                token = event["resume_token"]
+                                delay = RETRY_SECONDS
+                                yield event
+                except httpx.HTTPError as e:
+                    logger.warning(f"API change stream interrupted, resuming after {token} in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_SECONDS)
+
+
+class ChangeBuffer:
+    """Recent change events by resume token, so reconnecting clients catch up without a snapshot"""
+
+    def __init__(self, size: int = HISTORY_SIZE):
+        self._events: Deque[dict] = deque(maxlen=size)
+        self._positions: Dict[str, int] = {}
+        self._appended = 0
+
+    def append(self, event: dict) -> None:
+        if len(self._events) == self._events.maxlen:
+            self._positions.pop(self._events[0]["resume_token"], None)
+        self._events.append(event)
+        self._positions[event["resume_token"]] = self._appended
+        self._appended += 1
+
+    def dump(self) -> List[dict]:
+        return list(self._events)
+
+    def restore(self, events: List[dict]) -> None:
+        self._events.clear()
+        self._positions.clear()
+        self._appended = 0
+        for event in events:
+            self.append(event)
+
+    @property
+    def last_token(self) -> Optional[str]:
+        return self._events[-1]["resume_token"] if self._events else None
+
+    def since(self, resume_token: str) -> Optional[List[dict]]:
+        """Events after a token, or None when the token is unknown or already evicted"""
+        position = self._positions.get(resume_token)
+        if position is None:
+            return None
+        first = self._appended - len(self._events)
+        return list(self._events)[position - first + 1:]
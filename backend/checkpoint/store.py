@@ -0,0 +1,245 @@
+"""
+State Checkpoints
+This module periodically snapshots live in-memory state to a local file and
+restores it on startup, so a restarted process serves the last known fleet
+instead of starting empty
+
+Sections are registered as (dump, restore) pairs. Dumping and JSON encoding
+run back to back on the event loop, so a snapshot never mixes state from
+different ticks; only compression and the write happen off the loop. The
+file is written to a temporary name, fsynced and renamed over the previous
+checkpoint, so a crash mid-write leaves the old checkpoint intact.
+
+Checkpoints live in CHECKPOINT_DIR, which must be absolute, or next to the
+backend package. Each file is claimed with a lock when it is first used, so
+a second process configured with the same name (another uvicorn worker, say)
+takes the next numbered slot (state-1.ckpt, state-2.ckpt, ...) instead of
+overwriting the first one's. Slots are reused, so a restarted worker
+restores from whichever free slot it claims; give every instance a stable
+CHECKPOINT_INSTANCE to tie each one to its own checkpoint.
+
+File layout: magic, format version, CRC32 and length of the payload, then
+the zlib-compressed JSON payload.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pydantic import TypeAdapter
+
+from metrics.registry import REGISTRY, SIZE_BUCKETS
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on Windows; CHECKPOINT_INSTANCE keeps processes apart there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"APCK"
+VERSION = 1
+HEADER = struct.Struct("<4sHII")
+
+# Seconds between checkpoints
+CHECKPOINT_INTERVAL = 5.0
+
+# Numbered files tried in turn when the plain checkpoint file is locked by another process
+MAX_SLOTS = 64
+
+# Where checkpoints go when CHECKPOINT_DIR is not set
+DEFAULT_DIR = Path(__file__).resolve().parent.parent / "checkpoints"
+
+checkpoint_duration = REGISTRY.histogram("checkpoint_duration_seconds", "Time to snapshot and write a checkpoint",
+                                         ["file"])
+checkpoint_bytes = REGISTRY.histogram("checkpoint_size_bytes", "Size of written checkpoints", ["file"],
+                                      buckets=SIZE_BUCKETS)
+
+
+class CheckpointError(Exception):
+    """The checkpoint file is unreadable, truncated or from another format version"""
+
+
+class Checkpointer:
+    def __init__(self, filename: str, interval: float = CHECKPOINT_INTERVAL):
+        self.filename = filename
+        self.interval = interval
+        self._sections: Dict[str, Tuple[Callable[[], Any], Callable[[Any], None]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._path: Optional[Path] = None
+        self._lock = None
+
+    @property
+    def path(self) -> Path:
+        # Resolved on first use so CHECKPOINT_DIR from a .env file loaded later still applies
+        if self._path is None:
+            self._path = self._claim()
+        return self._path
+
+    def _claim(self) -> Path:
+        """Pick this process's checkpoint file and lock it against other processes"""
+        directory = Path(os.environ.get("CHECKPOINT_DIR") or DEFAULT_DIR)
+        if not directory.is_absolute():
+            raise CheckpointError(f"CHECKPOINT_DIR must be an absolute path, not {directory}")
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / self.filename
+        instance = os.environ.get("CHECKPOINT_INSTANCE")
+        if instance:
+            path = path.with_stem(f"{path.stem}-{instance}")
+        if fcntl is None:
+            return path
+
+        for slot in range(MAX_SLOTS):
+            candidate = path.with_stem(f"{path.stem}-{slot}") if slot else path
+            lock = open(candidate.with_name(candidate.name + ".lock"), "a")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock.close()
+                continue
+            self._lock = lock
+            if slot:
+                logger.info(f"Checkpoint {path} is in use by another process, using {candidate}")
+            return candidate
+        raise CheckpointError(f"no free checkpoint file for {path}")
+
+    def release(self) -> None:
+        """Give up the checkpoint file, e.g. after the final checkpoint"""
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+        self._path = None
+
+    def register(self, name: str, dump: Callable[[], Any], restore: Callable[[Any], None]) -> None:
+        """Add a section; dump returns JSON-compatible data (or encoded JSON bytes) that restore accepts"""
+        self._sections[name] = (dump, restore)
+
+    def register_list(self, name: str, items: List[Any], model=None) -> None:
+        """Add a list that is replaced in place on restore, so existing references stay valid"""
+        if model is None:
+            self.register(name, lambda: items, lambda data: items.__setitem__(slice(None), data))
+        else:
+            # Pydantic's compiled serializer, far faster than dumping model by model
+            adapter = TypeAdapter(List[model])
+            self.register(name,
+                          lambda: adapter.dump_json(items),
+                          lambda data: items.__setitem__(slice(None), adapter.validate_python(data)))
+
+    def snapshot(self) -> bytes:
+        """Dump and serialize every section at once"""
+        sections = []
+        for name, (dump, _) in self._sections.items():
+            data = dump()
+            if not isinstance(data, bytes):
+                data = json.dumps(data, separators=(",", ":"), default=str).encode()
+            sections.append(json.dumps(name).encode() + b":" + data)
+        return b'{"saved_at":%r,"sections":{%s}}' % (time.time(), b",".join(sections))
+
+    @staticmethod
+    def encode(snapshot: bytes) -> bytes:
+        payload = zlib.compress(snapshot, 6)
+        return HEADER.pack(MAGIC, VERSION, zlib.crc32(payload), len(payload)) + payload
+
+    @staticmethod
+    def decode(data: bytes) -> Dict[str, Any]:
+        if len(data) < HEADER.size:
+            raise CheckpointError("truncated header")
+        magic, version, crc, length = HEADER.unpack_from(data)
+        payload = data[HEADER.size:]
+        if magic != MAGIC or version != VERSION:
+            raise CheckpointError(f"unsupported checkpoint format {magic!r} v{version}")
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            raise CheckpointError("checksum mismatch")
+        return json.loads(zlib.decompress(payload))
+
+    def _write(self, snapshot: bytes) -> int:
+        data = self.encode(snapshot)
+        path = self.path
+        temporary = path.with_name(path.name + ".tmp")
+        with open(temporary, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+        return len(data)
+
+    def save(self) -> int:
+        """Write a checkpoint synchronously"""
+        started = time.perf_counter()
+        size = self._write(self.snapshot())
+        checkpoint_duration.labels(self.filename).observe(time.perf_counter() - started)
+        checkpoint_bytes.labels(self.filename).observe(size)
+        return size
+
+    async def save_async(self) -> int:
+        """Snapshot on the loop, then compress and write in a thread"""
+        started = time.perf_counter()
+        size = await asyncio.to_thread(self._write, self.snapshot())
+        checkpoint_duration.labels(self.filename).observe(time.perf_counter() - started)
+        checkpoint_bytes.labels(self.filename).observe(size)
+        return size
+
+    def restore(self) -> List[str]:
+        """Load the last checkpoint into the registered sections; returns the restored section names"""
+        try:
+            data = self.path.read_bytes()
+        except FileNotFoundError:
+            return []
+        try:
+            state = self.decode(data)
+        except (CheckpointError, zlib.error, ValueError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return []
+
+        restored = []
+        for name, section in state["sections"].items():
+            if name not in self._sections:
+                continue
+            try:
+                self._sections[name][1](section)
+                restored.append(name)
+            except Exception as e:
+                logger.warning(f"Could not restore {name} from checkpoint: {e}")
+        return restored
+
+    def start(self) -> None:
+        """Checkpoint periodically on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the periodic task and write a final checkpoint"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                logger.exception("Periodic checkpoints had stopped")
+            self._task = None
+        try:
+            await self.save_async()
+        except OSError as e:
+            logger.warning(f"Final checkpoint failed: {e}")
+        except Exception:
+            logger.exception("Final checkpoint failed")
+        self.release()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save_async()
+            except OSError as e:
+                logger.warning(f"Checkpoint failed: {e}")
+            except Exception:
+                # A section that fails to dump or encode this time may succeed next time
+                logger.exception("Checkpoint failed")
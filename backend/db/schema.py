@@ -3,11 +3,17 @@ Database Schema for APSRTC Admin Dashboard
 This script defines the MongoDB collections and their schemas
 """
 
-from pymongo import MongoClient
-from datetime import datetime
+import asyncio
+import socket
+from pymongo import MongoClient, IndexModel
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
 import os
+from typing import Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 
+from privacy.consent import CONSENT_INDEX
+
 # Load environment variables
 load_dotenv()
 
@@ -15,20 +21,189 @@ load_dotenv()
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
 DB_NAME = os.getenv("DB_NAME", "apsrtc_dashboard")
 
-client = MongoClient(MONGO_URL)
-db = client[DB_NAME]
+# Created on first use so importing this module never opens a connection
+_client: Optional[MongoClient] = None
+
+def get_db():
+    """Return the synchronous database handle, connecting lazily"""
+    global _client
+    if _client is None:
+        from metrics.mongo import MongoCommandMetrics
+        _client = MongoClient(MONGO_URL, event_listeners=[MongoCommandMetrics()])
+    return _client[DB_NAME]
 
 # Collection schemas and indexes
 
+INDEXES: Dict[str, List[IndexModel]] = {
+    "buses": [
+        IndexModel("bus_id", unique=True),
+        IndexModel("route"),
+        IndexModel("status"),
+        IndexModel("last_update")
+    ],
+    "stops": [
+        IndexModel("stop_id", unique=True),
+        IndexModel("location")
+    ],
+    "routes": [
+        IndexModel("route_id", unique=True),
+        IndexModel("name")
+    ],
+    "delay_predictions": [
+        IndexModel("bus_id"),
+        IndexModel("route"),
+        IndexModel("timestamp")
+    ],
+    "demand_forecast": [
+        IndexModel("route"),
+        IndexModel("time_slot"),
+        IndexModel("timestamp")
+    ],
+    "anomalies": [
+        IndexModel("bus_id"),
+        IndexModel("status"),
+        IndexModel("severity"),
+        IndexModel("timestamp")
+    ],
+    "recommendations": [
+        IndexModel("priority"),
+        IndexModel("applied"),
+        IndexModel("timestamp")
+    ],
+    "alerts": [
+        IndexModel("bus_id"),
+        IndexModel("type"),
+        IndexModel("status"),
+        IndexModel("priority"),
+        IndexModel("timestamp")
+    ],
+    "drivers": [
+        IndexModel("driver_id", unique=True),
+        IndexModel("employee_id", unique=True),
+        IndexModel("route"),
+        IndexModel("depot"),
+        IndexModel("status")
+    ],
+    "audit_logs": [
+        IndexModel("user"),
+        IndexModel("action"),
+        IndexModel("timestamp")
+    ],
+    "consents": [
+        IndexModel(CONSENT_INDEX)
+    ],
+    "passenger_trips": [
+        IndexModel("trip_id", unique=True),
+        IndexModel("passenger_id"),
+        IndexModel([("route", 1), ("timestamp", 1)]),
+        IndexModel("timestamp")
+    ],
+    "rollups": [
+        IndexModel([("granularity", 1), ("dimension", 1), ("key", 1), ("bucket", 1)], unique=True),
+        # Buckets past their retention (analytics.rollups.RETENTION_DAYS)
+        IndexModel("expires_at", expireAfterSeconds=0)
+    ]
+}
+
+# Lock document held by the one process migrating indexes; expires in case that process dies
+INDEX_LOCK_COLLECTION = "schema_locks"
+INDEX_LOCK_ID = "indexes"
+INDEX_LOCK_SECONDS = 300
+
+# Index info fields that do not change what an index does
+_IGNORED_INDEX_FIELDS = {"v", "ns", "name", "key", "background"}
+
+def _index_key(key) -> list:
+    """Key spec as [field, direction] pairs; servers may report directions as floats"""
+    return [[field, int(direction) if isinstance(direction, float) else direction]
+            for field, direction in dict(key).items()]
+
+def _index_options(document: dict) -> dict:
+    return {name: value for name, value in document.items() if name not in _IGNORED_INDEX_FIELDS}
+
+def _index_changes(existing: List[dict], indexes: List[IndexModel]) -> Tuple[List[str], List[IndexModel]]:
+    """Indexes to drop and to create so the collection matches the definitions"""
+    by_name = {index["name"]: index for index in existing}
+    drop, create = [], []
+    for model in indexes:
+        wanted = model.document
+        key = _index_key(wanted["key"])
+        current = by_name.get(wanted["name"]) or next(
+            (index for index in existing if _index_key(index["key"]) == key), None)
+        if current is None:
+            create.append(model)
+        # Found by name or by key spec, but defined differently now: rebuild it
+        elif _index_key(current["key"]) != key or _index_options(current) != _index_options(wanted):
+            drop.append(current["name"])
+            create.append(model)
+    return drop, create
+
+async def _ensure_collection_indexes(collection, indexes: List[IndexModel]) -> List[str]:
+    """Create missing and rebuild changed indexes of one collection"""
+    existing = [index async for index in collection.list_indexes()]
+    drop, create = _index_changes(existing, indexes)
+    for name in drop:
+        await collection.drop_index(name)
+    if not create:
+        return []
+    return await collection.create_indexes(create)
+
+def _lock_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _lock_claim(owner: str) -> Tuple[dict, dict]:
+    """Filter and update taking the index lock when it is free or expired"""
+    now = datetime.utcnow()
+    return ({"_id": INDEX_LOCK_ID, "expires_at": {"$lt": now}},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=INDEX_LOCK_SECONDS)}})
+
+async def ensure_indexes(db) -> List[str]:
+    """Create missing and rebuild changed indexes across all collections concurrently (Motor database)
+
+    Workers starting together race here; only the one holding the lock document
+    migrates, so no worker drops an index another is building. The others
+    return [] straight away.
+    """
+    locks = db[INDEX_LOCK_COLLECTION]
+    owner = _lock_owner()
+    try:
+        await locks.find_one_and_update(*_lock_claim(owner), upsert=True)
+    except DuplicateKeyError:
+        return []
+    try:
+        results = await asyncio.gather(*(
+            _ensure_collection_indexes(db[name], indexes)
+            for name, indexes in INDEXES.items()
+        ))
+    finally:
+        await locks.delete_one({"_id": INDEX_LOCK_ID, "owner": owner})
+    return [name for created in results for name in created]
+
+def ensure_indexes_sync(db) -> List[str]:
+    """Create missing and rebuild changed indexes across all collections (PyMongo database)"""
+    locks = db[INDEX_LOCK_COLLECTION]
+    owner = _lock_owner()
+    try:
+        locks.find_one_and_update(*_lock_claim(owner), upsert=True)
+    except DuplicateKeyError:
+        raise RuntimeError("Another process is migrating indexes; try again once it has finished")
+    created = []
+    try:
+        for name, indexes in INDEXES.items():
+            collection = db[name]
+            drop, create = _index_changes(list(collection.list_indexes()), indexes)
+            for index_name in drop:
+                collection.drop_index(index_name)
+            if create:
+                created.extend(collection.create_indexes(create))
+    finally:
+        locks.delete_one({"_id": INDEX_LOCK_ID, "owner": owner})
+    return created
+
 def setup_database():
     """Setup all collections with proper indexes"""
-    
-    # Buses collection
-    buses_collection = db.buses
-    buses_collection.create_index("bus_id", unique=True)
-    buses_collection.create_index("route")
-    buses_collection.create_index("status")
-    buses_collection.create_index("last_update")
+    db = get_db()
+    created = ensure_indexes_sync(db)
     
     # Sample bus document
     sample_bus = {
@@ -49,11 +224,6 @@ def setup_database():
         "last_update": datetime.utcnow()
     }
     
-    # Stops collection
-    stops_collection = db.stops
-    stops_collection.create_index("stop_id", unique=True)
-    stops_collection.create_index("location")
-    
     # Sample stop document
     sample_stop = {
         "stop_id": "STOP001",
@@ -66,11 +236,6 @@ def setup_database():
         "crowd_level": 85
     }
     
-    # Routes collection
-    routes_collection = db.routes
-    routes_collection.create_index("route_id", unique=True)
-    routes_collection.create_index("name")
-    
     # Sample route document
     sample_route = {
         "route_id": "ROUTE12",
@@ -79,12 +244,6 @@ def setup_database():
         "stops": ["STOP001", "STOP002", "STOP003"]
     }
     
-    # Delay predictions collection
-    delay_predictions_collection = db.delay_predictions
-    delay_predictions_collection.create_index("bus_id")
-    delay_predictions_collection.create_index("route")
-    delay_predictions_collection.create_index("timestamp")
-    
     # Sample delay prediction document
     sample_delay_prediction = {
         "bus_id": "APSRTC002",
@@ -100,12 +259,6 @@ def setup_database():
         "timestamp": datetime.utcnow()
     }
     
-    # Demand forecast collection
-    demand_forecast_collection = db.demand_forecast
-    demand_forecast_collection.create_index("route")
-    demand_forecast_collection.create_index("time_slot")
-    demand_forecast_collection.create_index("timestamp")
-    
     # Sample demand forecast document
     sample_demand_forecast = {
         "route": "Route 12",
@@ -116,13 +269,6 @@ def setup_database():
         "timestamp": datetime.utcnow()
     }
     
-    # Anomalies collection
-    anomalies_collection = db.anomalies
-    anomalies_collection.create_index("bus_id")
-    anomalies_collection.create_index("status")
-    anomalies_collection.create_index("severity")
-    anomalies_collection.create_index("timestamp")
-    
     # Sample anomaly document
     sample_anomaly = {
         "bus_id": "APSRTC002",
@@ -139,12 +285,6 @@ def setup_database():
         "notes": []
     }
     
-    # Recommendations collection
-    recommendations_collection = db.recommendations
-    recommendations_collection.create_index("priority")
-    recommendations_collection.create_index("applied")
-    recommendations_collection.create_index("timestamp")
-    
     # Sample recommendation document
     sample_recommendation = {
         "title": "Add 1 bus to Route 12",
@@ -162,14 +302,6 @@ def setup_database():
         "timestamp": datetime.utcnow()
     }
     
-    # Alerts collection
-    alerts_collection = db.alerts
-    alerts_collection.create_index("bus_id")
-    alerts_collection.create_index("type")
-    alerts_collection.create_index("status")
-    alerts_collection.create_index("priority")
-    alerts_collection.create_index("timestamp")
-    
     # Sample alert document
     sample_alert = {
         "type": "emergency",  # emergency, delay, violation, maintenance, crowd, schedule
@@ -187,14 +319,6 @@ def setup_database():
         "resolved": False
     }
     
-    # Drivers collection
-    drivers_collection = db.drivers
-    drivers_collection.create_index("driver_id", unique=True)
-    drivers_collection.create_index("employee_id", unique=True)
-    drivers_collection.create_index("route")
-    drivers_collection.create_index("depot")
-    drivers_collection.create_index("status")
-    
     # Sample driver document
     sample_driver = {
         "driver_id": "DRV001",
@@ -217,12 +341,6 @@ def setup_database():
         "updated_at": datetime.utcnow()
     }
     
-    # Audit logs collection
-    audit_logs_collection = db.audit_logs
-    audit_logs_collection.create_index("user")
-    audit_logs_collection.create_index("action")
-    audit_logs_collection.create_index("timestamp")
-    
     # Sample audit log document
     sample_audit_log = {
         "user": "admin_user",
@@ -233,8 +351,34 @@ def setup_database():
         "anonymized": True
     }
     
+    # Sample passenger trip document (exported as the passenger manifest)
+    sample_passenger_trip = {
+        "trip_id": "TRIP123456",
+        "passenger_id": "PAX100234",
+        "name": "John Doe",
+        "phone": "9876543210",
+        "email": "john.doe@example.com",
+        "address": "123 Main St, Vijayawada",
+        "route": "Route 12",
+        "bus_id": "APSRTC001",
+        "boarding_stop": "Benz Circle",
+        "alighting_stop": "MG Road",
+        "fare": 25.0,
+        "timestamp": datetime.utcnow()
+    }
+    
+    # Sample consent document (a later record with consent_given=False revokes it)
+    sample_consent = {
+        "user_id": "PAX100234",
+        "purpose": "analytics",
+        "consent_given": True,
+        "timestamp": datetime.utcnow().isoformat(),
+        "consent_id": "3f5a9c..."
+    }
+    
     print("Database schema setup completed successfully!")
     print(f"Database: {DB_NAME}")
+    print(f"Indexes created: {len(created)}")
     print("Collections created:")
     print("- buses")
     print("- stops")
@@ -246,6 +390,8 @@ def setup_database():
     print("- alerts")
     print("- drivers")
     print("- audit_logs")
+    print("- consents")
+    print("- passenger_trips")
 
 def insert_sample_data():
     """Insert sample data for testing"""
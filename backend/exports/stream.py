@@ -0,0 +1,308 @@
+"""
+Streaming Exports
+This module streams collections out as CSV, NDJSON or Arrow IPC (columnar)
+in fixed-size batches, anonymizing personal data batch by batch
+
+Rows are read from a Mongo cursor, prepared and encoded one batch at a time
+off the event loop, and yielded as response chunks, so memory stays flat no
+matter how many rows an export holds.
+"""
+
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from privacy.compliance import PrivacyCompliance
+from privacy.consent import ConsentStore
+
+# Rows read, prepared and encoded together
+BATCH_SIZE = 1000
+
+# Consent purpose required to export personal data without anonymization
+EXPORT_PURPOSE = "data_export"
+
+# Exportable datasets: audit wording, source collection, time field and typed
+# columns (dotted names read nested fields)
+DATASETS: Dict[str, Dict[str, Any]] = {
+    "passengers": {
+        "label": "passenger",
+        "title": "passenger manifest",
+        "collection": "passenger_trips",
+        "time_field": "timestamp",
+        "personal": True,
+        "fields": {
+            "trip_id": "str", "passenger_id": "str", "name": "str", "phone": "str", "email": "str",
+            "address": "str", "route": "str", "bus_id": "str", "boarding_stop": "str",
+            "alighting_stop": "str", "fare": "float", "timestamp": "datetime"
+        }
+    },
+    "buses": {
+        "label": "bus",
+        "title": "bus positions",
+        "collection": "buses",
+        "time_field": "last_update",
+        "personal": False,
+        "fields": {
+            "bus_id": "str", "route": "str", "status": "str", "occupancy": "int", "driver": "str",
+            "location.lat": "float", "location.lng": "float", "speed": "float", "delay": "int",
+            "last_update": "datetime"
+        }
+    },
+    "alerts": {
+        "label": "alert",
+        "title": "alert log",
+        "collection": "alerts",
+        "time_field": "timestamp",
+        "personal": False,
+        "fields": {
+            "type": "str", "title": "str", "message": "str", "bus_id": "str", "route": "str",
+            "location": "str", "status": "str", "priority": "str", "assigned_to": "str",
+            "acknowledged": "bool", "resolved": "bool", "timestamp": "datetime"
+        }
+    },
+    "anomalies": {
+        "label": "anomaly",
+        "title": "anomaly log",
+        "collection": "anomalies",
+        "time_field": "timestamp",
+        "personal": False,
+        "fields": {
+            "bus_id": "str", "route": "str", "status": "str", "severity": "str", "occupancy": "int",
+            "threshold": "int", "location": "str", "mitigation": "str", "reported_by": "str",
+            "resolved": "bool", "timestamp": "datetime"
+        }
+    },
+    "delay_predictions": {
+        "label": "delay prediction",
+        "title": "delay predictions",
+        "collection": "delay_predictions",
+        "time_field": "timestamp",
+        "personal": False,
+        "fields": {
+            "bus_id": "str", "route": "str", "depot": "str", "delay": "int", "confidence": "int",
+            "cause": "str", "location": "str", "next_stop": "str", "eta": "str", "occupancy": "int",
+            "timestamp": "datetime"
+        }
+    }
+}
+
+# Created on first export so importing this module never touches the key file
+_privacy: Optional[PrivacyCompliance] = None
+
+
+def _compliance() -> PrivacyCompliance:
+    global _privacy
+    if _privacy is None:
+        _privacy = PrivacyCompliance()
+    return _privacy
+
+
+def _value(document: Dict[str, Any], path: str) -> Any:
+    for part in path.split("."):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(part)
+    return document
+
+
+def _text(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _json_value(value: Any) -> Any:
+    # Datetimes as ISO strings, like the CSV cells; anything else JSON lacks as text
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+class CsvEncoder:
+    media_type = "text/csv"
+    extension = "csv"
+
+    def __init__(self, fields: Dict[str, str]):
+        self.fields = list(fields)
+
+    def header(self) -> bytes:
+        return self._encode([self.fields])
+
+    def batch(self, rows: List[Dict[str, Any]]) -> bytes:
+        return self._encode([[_text(_value(row, field)) for field in self.fields] for row in rows])
+
+    def footer(self) -> bytes:
+        return b""
+
+    @staticmethod
+    def _encode(lines) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(lines)
+        return buffer.getvalue().encode()
+
+
+class NdjsonEncoder:
+    media_type = "application/x-ndjson"
+    extension = "ndjson"
+
+    def __init__(self, fields: Dict[str, str]):
+        self.fields = list(fields)
+
+    def header(self) -> bytes:
+        return b""
+
+    def batch(self, rows: List[Dict[str, Any]]) -> bytes:
+        return "".join(
+            json.dumps({field: _value(row, field) for field in self.fields}, default=_json_value) + "\n" for row in rows
+        ).encode()
+
+    def footer(self) -> bytes:
+        return b""
+
+
+class _Chunks:
+    """Write-only file collecting what the Arrow writer emits until it is taken"""
+
+    closed = False
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+class ArrowEncoder:
+    """Arrow IPC stream: one record batch per export batch"""
+
+    media_type = "application/vnd.apache.arrow.stream"
+    extension = "arrows"
+
+    def __init__(self, fields: Dict[str, str]):
+        # Optional dependency, only needed for columnar exports
+        import pyarrow as pa
+
+        types = {"str": pa.string(), "int": pa.int64(), "float": pa.float64(), "bool": pa.bool_(),
+                 "datetime": pa.timestamp("ms")}
+        self._pa = pa
+        self.fields = list(fields)
+        self.schema = pa.schema([(field, types[kind]) for field, kind in fields.items()])
+        self._kinds = list(fields.values())
+        self._chunks = _Chunks()
+        self._writer = pa.ipc.new_stream(pa.PythonFile(self._chunks, mode="w"), self.schema)
+
+    def header(self) -> bytes:
+        # The schema message
+        return self._chunks.take()
+
+    def batch(self, rows: List[Dict[str, Any]]) -> bytes:
+        columns = []
+        for field, kind in zip(self.fields, self._kinds):
+            values = [_value(row, field) for row in rows]
+            if kind == "str":
+                values = [None if value is None else str(value) for value in values]
+            elif kind == "datetime":
+                values = [datetime.fromisoformat(value) if isinstance(value, str) else value for value in values]
+            columns.append(values)
+        self._writer.write_batch(self._pa.record_batch(columns, schema=self.schema))
+        return self._chunks.take()
+
+    def footer(self) -> bytes:
+        self._writer.close()
+        return self._chunks.take()
+
+
+ENCODERS: Dict[str, Callable[[Dict[str, str]], Any]] = {
+    "csv": CsvEncoder,
+    "ndjson": NdjsonEncoder,
+    "arrow": ArrowEncoder
+}
+
+
+def build_query(dataset: str, route: Optional[str] = None,
+                start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict[str, Any]:
+    query: Dict[str, Any] = {}
+    if route:
+        query["route"] = route
+    time_field = DATASETS[dataset]["time_field"]
+    if start or end:
+        query[time_field] = {}
+        if start:
+            query[time_field]["$gte"] = start
+        if end:
+            query[time_field]["$lt"] = end
+    return query
+
+
+def anonymize_batch(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Anonymize one batch of passenger records, pseudonymizing the passenger ID too"""
+    privacy = _compliance()
+    anonymized = []
+    for row in rows:
+        record = privacy.anonymize_passenger_data(row)
+        if record.get("passenger_id"):
+            record["passenger_id"] = privacy.hash_personal_data(str(record["passenger_id"]))
+        anonymized.append(record)
+    return anonymized
+
+
+class ExportStream:
+    """One export: iterate it for response chunks, then read rows/completed"""
+
+    def __init__(self, db, dataset: str, encoder, query: Dict[str, Any],
+                 anonymize: bool = True, batch_size: int = BATCH_SIZE):
+        self.db = db
+        self.dataset = dataset
+        self.encoder = encoder
+        self.query = query
+        self.anonymize = anonymize
+        self.batch_size = batch_size
+        self.personal = DATASETS[dataset]["personal"]
+        self.rows = 0
+        self.excluded = 0
+        self.completed = False
+
+    async def _prepare(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not self.personal:
+            return batch
+        if self.anonymize:
+            return await asyncio.to_thread(anonymize_batch, batch)
+        # Raw personal data only for passengers who consented; a fresh store
+        # per batch keeps the consent cache from growing with the export
+        consents = await ConsentStore(self.db.consents).check_consents(
+            (row.get("passenger_id") for row in batch), EXPORT_PURPOSE
+        )
+        allowed = [row for row in batch if consents.get(row.get("passenger_id"))]
+        self.excluded += len(batch) - len(allowed)
+        return allowed
+
+    async def _encode(self, batch: List[Dict[str, Any]]) -> bytes:
+        rows = await self._prepare(batch)
+        self.rows += len(rows)
+        return await asyncio.to_thread(self.encoder.batch, rows)
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        collection = self.db[DATASETS[self.dataset]["collection"]]
+        header = self.encoder.header()
+        if header:
+            yield header
+        batch = []
+        async for document in collection.find(self.query, {"_id": 0}, batch_size=self.batch_size):
+            batch.append(document)
+            if len(batch) >= self.batch_size:
+                yield await self._encode(batch)
+                batch = []
+        if batch:
+            yield await self._encode(batch)
+        footer = self.encoder.footer()
+        if footer:
+            yield footer
+        self.completed = True
@@ -0,0 +1,221 @@
+"""
+Bus Clustering
+This module keeps buses pre-aggregated into map clusters for every zoom level
+so map views far out receive cluster counts instead of every bus
+
+Each zoom level is a grid of Web Mercator cells CELL_PIXELS wide on screen.
+Every cell holds a running count, coordinate sums for the centroid and a
+status breakdown. Moving a bus adjusts its cell at each level in place
+instead of re-clustering the fleet.
+
+Bounding boxes are (west, south, east, north); a box with west > east
+crosses the antimeridian and is searched as its two halves.
+"""
+
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Cluster radius on screen, in pixels of a 256 px tile
+CELL_PIXELS = 64
+
+# Deepest clustered zoom; closer views get individual buses
+MAX_CLUSTER_ZOOM = 14
+
+MAX_LATITUDE = 85.05112878
+
+
+def _mercator(lat: float, lng: float) -> Tuple[float, float]:
+    """Normalised Web Mercator coordinates in [0, 1)"""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = (lng + 180.0) / 360.0
+    sin_lat = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return x, y
+
+
+class _Cell:
+    __slots__ = ("count", "lat_sum", "lng_sum", "statuses")
+
+    def __init__(self):
+        self.count = 0
+        self.lat_sum = 0.0
+        self.lng_sum = 0.0
+        self.statuses: Dict[str, int] = {}
+
+
+class ClusterIndex:
+    def __init__(self, max_zoom: int = MAX_CLUSTER_ZOOM):
+        self.max_zoom = max_zoom
+        # Cells per axis at each zoom level; powers of two, so a cell's parent
+        # at the next zoom out is its key shifted right by one bit
+        self._cells_per_axis = [(256 << zoom) // CELL_PIXELS for zoom in range(max_zoom + 1)]
+        self._levels: List[Dict[Tuple[int, int], _Cell]] = [{} for _ in range(max_zoom + 1)]
+
+        # Current (lat, lng, status, cells by level) per bus
+        self._buses: Dict[str, Tuple[float, float, str, List[Tuple[int, int]]]] = {}
+
+        # Bus IDs per cell at the deepest level, for close-zoom lookups
+        self._members: Dict[Tuple[int, int], set] = {}
+
+    def __len__(self) -> int:
+        return len(self._buses)
+
+    def _cells_for(self, lat: float, lng: float) -> List[Tuple[int, int]]:
+        x, y = _mercator(lat, lng)
+        n = self._cells_per_axis[-1]
+        cx, cy = min(int(x * n), n - 1), min(int(y * n), n - 1)
+        return [(cx >> shift, cy >> shift) for shift in range(self.max_zoom, -1, -1)]
+
+    def update(self, bus_id: str, lat: float, lng: float, status: str) -> None:
+        """Insert or move a bus, adjusting its cell at every zoom level"""
+        previous = self._buses.get(bus_id)
+        if previous is None:
+            cells = self._cells_for(lat, lng)
+            for level, cell_key in zip(self._levels, cells):
+                self._add_to_cell(level, cell_key, lat, lng, status)
+            self._members.setdefault(cells[-1], set()).add(bus_id)
+            self._buses[bus_id] = (lat, lng, status, cells)
+            return
+
+        old_lat, old_lng, old_status, old_cells = previous
+        if (old_lat, old_lng, old_status) == (lat, lng, status):
+            return
+        cells = self._cells_for(lat, lng)
+        for level, cell_key, old_key in zip(self._levels, cells, old_cells):
+            if cell_key == old_key:
+                # Same cell: shift the centroid sums and the status breakdown in place
+                cell = level[cell_key]
+                cell.lat_sum += lat - old_lat
+                cell.lng_sum += lng - old_lng
+                if status != old_status:
+                    self._decrement_status(cell, old_status)
+                    cell.statuses[status] = cell.statuses.get(status, 0) + 1
+            else:
+                self._remove_from_cell(level, old_key, old_lat, old_lng, old_status)
+                self._add_to_cell(level, cell_key, lat, lng, status)
+        if cells[-1] != old_cells[-1]:
+            self._discard_member(old_cells[-1], bus_id)
+            self._members.setdefault(cells[-1], set()).add(bus_id)
+        self._buses[bus_id] = (lat, lng, status, cells)
+
+    @staticmethod
+    def _add_to_cell(level, cell_key, lat: float, lng: float, status: str) -> None:
+        cell = level.get(cell_key)
+        if cell is None:
+            cell = level[cell_key] = _Cell()
+        cell.count += 1
+        cell.lat_sum += lat
+        cell.lng_sum += lng
+        cell.statuses[status] = cell.statuses.get(status, 0) + 1
+
+    @staticmethod
+    def _remove_from_cell(level, cell_key, lat: float, lng: float, status: str) -> None:
+        cell = level[cell_key]
+        cell.count -= 1
+        if cell.count == 0:
+            del level[cell_key]
+            return
+        cell.lat_sum -= lat
+        cell.lng_sum -= lng
+        ClusterIndex._decrement_status(cell, status)
+
+    @staticmethod
+    def _decrement_status(cell: _Cell, status: str) -> None:
+        remaining = cell.statuses[status] - 1
+        if remaining:
+            cell.statuses[status] = remaining
+        else:
+            del cell.statuses[status]
+
+    def remove(self, bus_id: str) -> None:
+        """Remove a bus that left the fleet"""
+        previous = self._buses.pop(bus_id, None)
+        if previous is not None:
+            lat, lng, status, cells = previous
+            for level, cell_key in zip(self._levels, cells):
+                self._remove_from_cell(level, cell_key, lat, lng, status)
+            self._discard_member(cells[-1], bus_id)
+
+    def retain(self, bus_ids) -> int:
+        """Remove every bus not in bus_ids (any container of IDs); returns how many were removed"""
+        departed = [bus_id for bus_id in self._buses if bus_id not in bus_ids]
+        for bus_id in departed:
+            self.remove(bus_id)
+        return len(departed)
+
+    def _discard_member(self, cell_key: Tuple[int, int], bus_id: str) -> None:
+        members = self._members.get(cell_key)
+        if members is not None:
+            members.discard(bus_id)
+            if not members:
+                del self._members[cell_key]
+
+    def _keys_in(self, cells, n: int, bbox: Optional[Tuple[float, float, float, float]]) -> List[Tuple[int, int]]:
+        """Occupied cell keys of a level inside a bounding box"""
+        if bbox is None:
+            return list(cells)
+        west, south, east, north = bbox
+        if west > east:
+            return self._keys_in(cells, n, (west, south, 180.0, north)) + \
+                self._keys_in(cells, n, (-180.0, south, east, north))
+        x0, y0 = _mercator(north, west)
+        x1, y1 = _mercator(south, east)
+        cx0, cy0 = int(x0 * n), int(y0 * n)
+        cx1, cy1 = min(int(x1 * n), n - 1), min(int(y1 * n), n - 1)
+        span = (cx1 - cx0 + 1) * (cy1 - cy0 + 1)
+        # Probe the box cell by cell when it is smaller than the occupied set
+        if span <= len(cells):
+            return [(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1) if (cx, cy) in cells]
+        return [key for key in cells if cx0 <= key[0] <= cx1 and cy0 <= key[1] <= cy1]
+
+    def cells(self, zoom: int, bbox: Optional[Tuple[float, float, float, float]] = None) -> List[tuple]:
+        """Raw (cell key, count, lat sum, lng sum, statuses) at a zoom level, for merging across indexes"""
+        zoom = max(0, min(int(zoom), self.max_zoom))
+        level = self._levels[zoom]
+        return [
+            (key, level[key].count, level[key].lat_sum, level[key].lng_sum, dict(level[key].statuses))
+            for key in self._keys_in(level, self._cells_per_axis[zoom], bbox)
+        ]
+
+    def clusters(self, zoom: int, bbox: Optional[Tuple[float, float, float, float]] = None) -> List[dict]:
+        """Clusters at a zoom level, optionally limited to (west, south, east, north)"""
+        return merge_cells([self.cells(zoom, bbox)])
+
+    def bus_ids_in(self, bbox: Tuple[float, float, float, float]) -> List[str]:
+        """IDs of the buses inside (west, south, east, north)"""
+        west, south, east, north = bbox
+        wraps = west > east
+        bus_ids = []
+        for key in self._keys_in(self._members, self._cells_per_axis[-1], bbox):
+            for bus_id in self._members[key]:
+                lat, lng = self._buses[bus_id][:2]
+                inside_lng = (lng >= west or lng <= east) if wraps else west <= lng <= east
+                if south <= lat <= north and inside_lng:
+                    bus_ids.append(bus_id)
+        return bus_ids
+
+
+def merge_cells(cell_lists: Iterable[List[tuple]]) -> List[dict]:
+    """Clusters from the cells of one or more indexes over disjoint sets of buses"""
+    merged: Dict[tuple, list] = {}
+    for cells in cell_lists:
+        for key, count, lat_sum, lng_sum, statuses in cells:
+            key = tuple(key)
+            total = merged.get(key)
+            if total is None:
+                merged[key] = [count, lat_sum, lng_sum, dict(statuses)]
+                continue
+            total[0] += count
+            total[1] += lat_sum
+            total[2] += lng_sum
+            for status, n in statuses.items():
+                total[3][status] = total[3].get(status, 0) + n
+    return [
+        {
+            "lat": round(lat_sum / count, 6),
+            "lng": round(lng_sum / count, 6),
+            "count": count,
+            "statuses": statuses
+        }
+        for count, lat_sum, lng_sum, statuses in merged.values()
+    ]
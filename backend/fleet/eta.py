@@ -0,0 +1,295 @@
+"""
+ETA Engine
+This module snaps bus positions onto their route geometry and derives the
+next stop, distance to it and ETAs for every bus and stop once per tick
+
+Each route is precomputed into planar segment arrays with cumulative
+distances and padded bounding boxes. A bus that was matched before is only
+tested against the segments around its last position (found by binary
+search on the cumulative distances), and all buses on a route are projected
+together with numpy. A bus whose windowed match is off-route (a new trip
+starting over, a GPS jump) is matched again against the whole route before
+it is reported off-route.
+"""
+
+import math
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+# Assumed speed on segments nobody has driven yet (about 20 km/h)
+DEFAULT_SPEED_MPS = 5.5
+
+# Weight of the newest observation in the per-segment speed average
+SPEED_SMOOTHING = 0.2
+
+# Buses projected per batch
+SNAP_CHUNK = 2048
+
+# Upcoming arrivals kept per stop
+MAX_STOP_ARRIVALS = 5
+
+# Positions further than this from the route are reported as off-route
+OFF_ROUTE_M = 150.0
+
+# Search window around the previous match: how far a bus may have reversed
+# (GPS jitter) and travelled forward since the last tick
+WINDOW_BACK_M = 100.0
+WINDOW_AHEAD_M = 2000.0
+
+
+class RouteGeometry:
+    def __init__(self, name: str, points: Sequence[Sequence[float]],
+                 stops: Sequence[Tuple[str, str, float, float]]):
+        self.name = name
+        coords = np.asarray(points, dtype=float)
+        # Equirectangular projection around the route's centre, in metres
+        self.origin_lat = float(coords[:, 0].mean())
+        self.origin_lng = float(coords[:, 1].mean())
+        self._lng_scale = math.cos(math.radians(self.origin_lat))
+        xy = self.project(coords[:, 0], coords[:, 1])
+
+        self.starts = xy[:-1]
+        self.vectors = xy[1:] - xy[:-1]
+        self.lengths = np.hypot(self.vectors[:, 0], self.vectors[:, 1])
+        self.lengths_sq = np.maximum(self.lengths ** 2, 1e-9)
+        self.cumulative = np.concatenate(([0.0], np.cumsum(self.lengths)))
+        self.total_length = float(self.cumulative[-1])
+
+        # Segment bounding boxes padded by the off-route tolerance
+        lo = np.minimum(xy[:-1], xy[1:]) - OFF_ROUTE_M
+        hi = np.maximum(xy[:-1], xy[1:]) + OFF_ROUTE_M
+        self.bbox_min = lo
+        self.bbox_max = hi
+
+        # Smoothed observed speed per segment
+        self.segment_speeds = np.full(len(self.lengths), DEFAULT_SPEED_MPS)
+
+        # Stops ordered by their distance along the route
+        self.stop_ids: List[str] = []
+        self.stop_names: List[str] = []
+        chainages = []
+        if stops:
+            stop_xy = self.project(np.array([s[2] for s in stops]), np.array([s[3] for s in stops]))
+            stop_chainages, _, _ = self._snap(stop_xy, np.zeros(len(stops), dtype=int),
+                                              np.full(len(stops), len(self.lengths)))
+            for order in np.argsort(stop_chainages, kind="stable"):
+                self.stop_ids.append(stops[order][0])
+                self.stop_names.append(stops[order][1])
+                chainages.append(stop_chainages[order])
+        self.stop_chainages = np.asarray(chainages, dtype=float)
+
+    def project(self, lat, lng) -> np.ndarray:
+        """Project latitude/longitude arrays to planar metres"""
+        x = np.radians(np.asarray(lng) - self.origin_lng) * EARTH_RADIUS_M * self._lng_scale
+        y = np.radians(np.asarray(lat) - self.origin_lat) * EARTH_RADIUS_M
+        return np.column_stack((x, y))
+
+    def candidate_windows(self, previous: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Segment index ranges to search, narrowed by each bus's previous chainage"""
+        count = len(self.lengths)
+        lo = np.zeros(len(previous), dtype=int)
+        hi = np.full(len(previous), count)
+        known = ~np.isnan(previous)
+        if known.any():
+            lo[known] = np.clip(np.searchsorted(self.cumulative, previous[known] - WINDOW_BACK_M, "right") - 1,
+                                0, count - 1)
+            hi[known] = np.clip(np.searchsorted(self.cumulative, previous[known] + WINDOW_AHEAD_M, "left"),
+                                lo[known] + 1, count)
+        return lo, hi
+
+    def _snap(self, xy: np.ndarray, lo: np.ndarray, hi: np.ndarray):
+        """Project points onto the segments in [lo, hi) and keep the nearest"""
+        width = int((hi - lo).max()) if len(xy) else 0
+        index = lo[:, None] + np.arange(width)[None, :]
+        valid = index < hi[:, None]
+        index = np.minimum(index, len(self.lengths) - 1)
+
+        points = xy[:, None, :]
+        # Skip segments whose padded bounding box does not contain the point,
+        # unless that would leave a bus with no candidates at all
+        inside = ((points >= self.bbox_min[index]) & (points <= self.bbox_max[index])).all(axis=2) & valid
+        mask = np.where(inside.any(axis=1)[:, None], inside, valid)
+
+        relative = points - self.starts[index]
+        t = np.clip((relative * self.vectors[index]).sum(axis=2) / self.lengths_sq[index], 0.0, 1.0)
+        nearest = self.starts[index] + t[..., None] * self.vectors[index]
+        dist_sq = ((points - nearest) ** 2).sum(axis=2)
+        dist_sq = np.where(mask, dist_sq, np.inf)
+
+        best = dist_sq.argmin(axis=1)
+        rows = np.arange(len(xy))
+        segment = index[rows, best]
+        chainage = self.cumulative[segment] + t[rows, best] * self.lengths[segment]
+        return chainage, segment, np.sqrt(dist_sq[rows, best])
+
+    def snap(self, lat: np.ndarray, lng: np.ndarray, previous: np.ndarray):
+        """Return chainage, segment and offset in metres for a batch of positions"""
+        lo, hi = self.candidate_windows(previous)
+        xy = self.project(lat, lng)
+        chainage, segment, offset = self._snap_chunked(xy, lo, hi)
+        # The bus left its window (new trip, GPS jump): search the whole route again
+        lost = np.flatnonzero(~np.isnan(previous) & (offset > OFF_ROUTE_M))
+        if len(lost):
+            chainage[lost], segment[lost], offset[lost] = self._snap_chunked(
+                xy[lost], np.zeros(len(lost), dtype=int), np.full(len(lost), len(self.lengths)))
+        return chainage, segment, offset
+
+    def _snap_chunked(self, xy: np.ndarray, lo: np.ndarray, hi: np.ndarray):
+        if len(xy) <= SNAP_CHUNK:
+            return self._snap(xy, lo, hi)
+        # Bound the candidate matrix when many buses are matched from scratch
+        parts = [self._snap(xy[i:i + SNAP_CHUNK], lo[i:i + SNAP_CHUNK], hi[i:i + SNAP_CHUNK])
+                 for i in range(0, len(xy), SNAP_CHUNK)]
+        return tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+    def observe_speeds(self, segment: np.ndarray, speed: np.ndarray) -> None:
+        """Fold this tick's mean observed speed (m/s) per segment into the averages"""
+        count = len(self.lengths)
+        hits = np.bincount(segment, minlength=count)
+        totals = np.bincount(segment, weights=speed, minlength=count)
+        seen = hits > 0
+        self.segment_speeds[seen] += SPEED_SMOOTHING * (totals[seen] / hits[seen] - self.segment_speeds[seen])
+
+    def travel_times(self) -> np.ndarray:
+        """Cumulative travel time in seconds at each route vertex"""
+        return np.concatenate(([0.0], np.cumsum(self.lengths / np.maximum(self.segment_speeds, 0.5))))
+
+
+class EtaEngine:
+    def __init__(self):
+        self.routes: Dict[str, RouteGeometry] = {}
+
+        # Last match per bus: (route, chainage, timestamp)
+        self._last: Dict[str, Tuple[str, float, float]] = {}
+
+        # Latest results
+        self.bus_etas: Dict[str, dict] = {}
+        self.stop_etas: Dict[str, List[dict]] = {}
+
+    def add_route(self, name: str, points: Sequence[Sequence[float]],
+                  stops: Sequence[Tuple[str, str, float, float]] = ()) -> None:
+        """Precompute a route's geometry; stops are (stop_id, name, lat, lng)"""
+        if len(points) >= 2:
+            self.routes[name] = RouteGeometry(name, points, stops)
+
+    def update(self, positions: Iterable[Tuple[str, str, float, float, float]]) -> Dict[str, dict]:
+        """Process one tick of (bus_id, route, lat, lng, timestamp) positions"""
+        by_route: Dict[str, List[Tuple[str, float, float, float]]] = {}
+        for bus_id, route, lat, lng, timestamp in positions:
+            if route in self.routes:
+                by_route.setdefault(route, []).append((bus_id, lat, lng, timestamp))
+
+        bus_etas: Dict[str, dict] = {}
+        stop_etas: Dict[str, List[dict]] = {}
+        for route_name, buses in by_route.items():
+            self._update_route(self.routes[route_name], buses, bus_etas, stop_etas)
+
+        for stop_id, arrivals in stop_etas.items():
+            arrivals.sort(key=lambda arrival: arrival["eta_seconds"])
+            del arrivals[MAX_STOP_ARRIVALS:]
+        self.bus_etas = bus_etas
+        self.stop_etas = stop_etas
+        return bus_etas
+
+    def _update_route(self, geometry: RouteGeometry, buses, bus_etas, stop_etas) -> None:
+        bus_ids = [bus[0] for bus in buses]
+        lat = np.array([bus[1] for bus in buses])
+        lng = np.array([bus[2] for bus in buses])
+        now = np.array([bus[3] for bus in buses])
+
+        previous = np.full(len(buses), np.nan)
+        previous_time = np.full(len(buses), np.nan)
+        for i, bus_id in enumerate(bus_ids):
+            last = self._last.get(bus_id)
+            if last is not None and last[0] == geometry.name:
+                previous[i] = last[1]
+                previous_time[i] = last[2]
+
+        chainage, segment, offset = geometry.snap(lat, lng, previous)
+
+        # Speeds from progress along the route since the last tick
+        elapsed = now - previous_time
+        moved = chainage - previous
+        # Jumps found by re-matching the whole route are not progress
+        observed = (~np.isnan(moved) & (elapsed > 0) & (moved >= 0) & (moved <= WINDOW_AHEAD_M)
+                    & (offset <= OFF_ROUTE_M))
+        if observed.any():
+            geometry.observe_speeds(segment[observed], moved[observed] / elapsed[observed])
+
+        for bus_id, c, t in zip(bus_ids, chainage.tolist(), now.tolist()):
+            self._last[bus_id] = (geometry.name, c, t)
+
+        travel = geometry.travel_times()
+        bus_time = np.interp(chainage, geometry.cumulative, travel)
+        stop_count = len(geometry.stop_chainages)
+        next_index = np.searchsorted(geometry.stop_chainages, chainage, "left") if stop_count else None
+
+        for i, bus_id in enumerate(bus_ids):
+            result = {
+                "route": geometry.name,
+                "chainage": round(float(chainage[i]), 1),
+                "off_route": bool(offset[i] > OFF_ROUTE_M),
+                "next_stop": None,
+                "next_stop_id": None,
+                "distance_to_next_stop": None,
+                "eta_seconds": None
+            }
+            if stop_count and next_index[i] < stop_count:
+                k = int(next_index[i])
+                result["next_stop"] = geometry.stop_names[k]
+                result["next_stop_id"] = geometry.stop_ids[k]
+                result["distance_to_next_stop"] = round(float(geometry.stop_chainages[k] - chainage[i]), 1)
+            bus_etas[bus_id] = result
+
+        if not stop_count:
+            return
+
+        # ETA of every bus to every stop still ahead of it, as one matrix
+        stop_time = np.interp(geometry.stop_chainages, geometry.cumulative, travel)
+        etas = stop_time[None, :] - bus_time[:, None]
+        ahead = geometry.stop_chainages[None, :] >= chainage[:, None]
+        for i, bus_id in enumerate(bus_ids):
+            if bus_etas[bus_id]["next_stop_id"] is not None:
+                bus_etas[bus_id]["eta_seconds"] = round(float(etas[i, next_index[i]]), 1)
+
+        # Keep only the soonest arrivals per stop
+        etas = np.where(ahead, etas, np.inf)
+        keep = min(MAX_STOP_ARRIVALS, len(bus_ids))
+        soonest = np.argpartition(etas, keep - 1, axis=0)[:keep] if keep < len(bus_ids) else \
+            np.broadcast_to(np.arange(len(bus_ids))[:, None], etas.shape)
+        for k, stop_id in enumerate(geometry.stop_ids):
+            arrivals = stop_etas.setdefault(stop_id, [])
+            for i in soonest[:, k].tolist():
+                if etas[i, k] != np.inf:
+                    arrivals.append({"bus_id": bus_ids[i], "route": geometry.name,
+                                     "eta_seconds": round(float(etas[i, k]), 1)})
+
+    def stop_travel_minutes(self, route: str) -> List[float]:
+        """Current running time in minutes between consecutive stops of a route"""
+        geometry = self.routes[route]
+        if len(geometry.stop_chainages) < 2:
+            return []
+        at_stops = np.interp(geometry.stop_chainages, geometry.cumulative, geometry.travel_times())
+        return [round(float(minutes), 2) for minutes in np.diff(at_stops) / 60]
+
+    def forget(self, bus_ids: Iterable[str]) -> None:
+        """Drop state for buses that left the fleet"""
+        for bus_id in bus_ids:
+            self._last.pop(bus_id, None)
+
+
+def build_engine(routes, stops) -> EtaEngine:
+    """Build an engine from the API Route and Stop models"""
+    stops_by_id = {stop.id: stop for stop in stops}
+    engine = EtaEngine()
+    for route in routes:
+        route_stops = [
+            (stop.id, stop.name, stop.location.lat, stop.location.lng)
+            for stop in (stops_by_id.get(stop_id) for stop_id in route.stops)
+            if stop is not None
+        ]
+        engine.add_route(route.name, route.points, route_stops)
+    return engine
@@ -0,0 +1,170 @@
+"""
+Stop Geofencing
+This module detects buses arriving at and departing from stops and keeps
+running dwell-time statistics per driver, stop and route
+
+Stops are bucketed into a uniform lat/lng grid so each position update only
+tests the handful of stops in its own cell. A bus arrives when it comes
+within a stop's radius and departs once it is further than the radius plus
+a hysteresis margin, so GPS jitter at the edge does not produce bursts of
+events.
+"""
+
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Grid cell size in degrees (about 550 m of latitude)
+CELL_DEGREES = 0.005
+
+DEFAULT_RADIUS_M = 50.0
+
+# Extra distance a bus must clear before it counts as departed
+EXIT_MARGIN = 0.5
+
+METRES_PER_DEGREE = 111320.0
+
+
+def _distance_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Equirectangular distance, accurate to well under a metre at stop scale"""
+    x = (lng2 - lng1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = lat2 - lat1
+    return math.hypot(x, y) * METRES_PER_DEGREE
+
+
+class _Stop:
+    __slots__ = ("stop_id", "lat", "lng", "radius")
+
+    def __init__(self, stop_id: str, lat: float, lng: float, radius: float):
+        self.stop_id = stop_id
+        self.lat = lat
+        self.lng = lng
+        self.radius = radius
+
+
+class DwellStats:
+    """Running count, mean and variance (Welford) per (kind, key)"""
+
+    def __init__(self):
+        self._stats: Dict[Tuple[str, str], List[float]] = {}
+
+    def seed(self, kind: str, key: str, mean: float, count: int) -> None:
+        """Start a series from a previously computed mean"""
+        if count > 0:
+            self._stats[(kind, key)] = [float(count), float(mean), 0.0]
+
+    def add(self, kind: str, key: str, value: float) -> None:
+        stats = self._stats.get((kind, key))
+        if stats is None:
+            stats = self._stats[(kind, key)] = [0.0, 0.0, 0.0]
+        stats[0] += 1
+        delta = value - stats[1]
+        stats[1] += delta / stats[0]
+        stats[2] += delta * (value - stats[1])
+
+    def get(self, kind: str, key: str) -> Optional[Dict[str, float]]:
+        stats = self._stats.get((kind, key))
+        if stats is None:
+            return None
+        count, mean, m2 = stats
+        return {
+            "count": int(count),
+            "mean": round(mean, 1),
+            "stddev": round(math.sqrt(m2 / count), 1) if count > 1 else 0.0
+        }
+
+    def all(self, kind: str) -> Dict[str, Dict[str, float]]:
+        return {key: self.get(k, key) for (k, key) in list(self._stats) if k == kind}
+
+    def dump(self) -> List[list]:
+        return [[kind, key, *stats] for (kind, key), stats in self._stats.items()]
+
+    def restore(self, rows: List[list]) -> None:
+        self._stats = {(kind, key): [count, mean, m2] for kind, key, count, mean, m2 in rows}
+
+
+class StopGeofencer:
+    def __init__(self, cell_degrees: float = CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self._grid: Dict[Tuple[int, int], List[_Stop]] = {}
+
+        # Stop each bus is currently inside, with its arrival time
+        self._inside: Dict[str, Tuple[_Stop, float]] = {}
+
+        self.dwell = DwellStats()
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lng / self.cell_degrees))
+
+    def add_stop(self, stop_id: str, lat: float, lng: float, radius: float = DEFAULT_RADIUS_M) -> None:
+        """Index a stop in every grid cell its exit circle overlaps"""
+        stop = _Stop(stop_id, lat, lng, radius)
+        reach = radius * (1 + EXIT_MARGIN)
+        dlat = reach / METRES_PER_DEGREE
+        dlng = dlat / max(math.cos(math.radians(lat)), 0.01)
+        lat_lo, lng_lo = self._cell(lat - dlat, lng - dlng)
+        lat_hi, lng_hi = self._cell(lat + dlat, lng + dlng)
+        for i in range(lat_lo, lat_hi + 1):
+            for j in range(lng_lo, lng_hi + 1):
+                self._grid.setdefault((i, j), []).append(stop)
+
+    def process(self, updates: Iterable[Tuple[str, str, Optional[str], float, float, float]]) -> List[dict]:
+        """Test one batch of (bus_id, route, driver, lat, lng, timestamp) updates"""
+        events = []
+        grid = self._grid
+        cell_degrees = self.cell_degrees
+        for bus_id, route, driver, lat, lng, timestamp in updates:
+            current = self._inside.get(bus_id)
+            if current is not None:
+                stop, arrived = current
+                if _distance_m(lat, lng, stop.lat, stop.lng) <= stop.radius * (1 + EXIT_MARGIN):
+                    continue
+                del self._inside[bus_id]
+                dwell = max(0.0, timestamp - arrived)
+                self.dwell.add("stop", stop.stop_id, dwell)
+                self.dwell.add("route", route, dwell)
+                if driver:
+                    self.dwell.add("driver", driver, dwell)
+                events.append(self._event("departure", bus_id, route, driver, stop, timestamp, dwell))
+
+            candidates = grid.get((int(math.floor(lat / cell_degrees)), int(math.floor(lng / cell_degrees))))
+            if not candidates:
+                continue
+            for stop in candidates:
+                if _distance_m(lat, lng, stop.lat, stop.lng) <= stop.radius:
+                    self._inside[bus_id] = (stop, timestamp)
+                    events.append(self._event("arrival", bus_id, route, driver, stop, timestamp))
+                    break
+        return events
+
+    @staticmethod
+    def _event(kind: str, bus_id: str, route: str, driver: Optional[str], stop: _Stop,
+               timestamp: float, dwell: Optional[float] = None) -> dict:
+        event = {
+            "type": kind,
+            "bus_id": bus_id,
+            "route": route,
+            "driver": driver,
+            "stop_id": stop.stop_id,
+            "timestamp": timestamp
+        }
+        if dwell is not None:
+            event["dwell_seconds"] = round(dwell, 1)
+        return event
+
+    def at_stop(self, bus_id: str) -> Optional[str]:
+        """Stop a bus is currently dwelling at"""
+        current = self._inside.get(bus_id)
+        return current[0].stop_id if current else None
+
+    def forget(self, bus_ids: Iterable[str]) -> None:
+        """Drop state for buses that left the fleet"""
+        for bus_id in bus_ids:
+            self._inside.pop(bus_id, None)
+
+
+def build_geofencer(stops) -> StopGeofencer:
+    """Build a geofencer from the API Stop models"""
+    geofencer = StopGeofencer()
+    for stop in stops:
+        geofencer.add_stop(stop.id, stop.location.lat, stop.location.lng)
+    return geofencer
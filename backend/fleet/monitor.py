@@ -0,0 +1,102 @@
+"""
+Fleet Monitoring
+This module checks live buses for occupancy anomalies and computes the fleet
+totals behind the live KPIs
+
+Totals are plain counts and sums, so totals computed over separate parts of
+the fleet merge into the totals of the whole fleet.
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from analytics.rollups import ON_TIME_MINUTES
+
+# Occupancy percentages that raise an anomaly
+OVERCROWDED_THRESHOLD = 85
+UNDERUTILIZED_THRESHOLD = 20
+
+# Distance past a threshold that makes an anomaly high severity
+SEVERE_MARGIN = 10
+
+MITIGATIONS = {"overcrowded": "Add vehicle", "underutilized": "Reduce frequency"}
+
+
+class OccupancyMonitor:
+    """Raises one anomaly per episode of a bus above or below the occupancy thresholds"""
+
+    def __init__(self, high: int = OVERCROWDED_THRESHOLD, low: int = UNDERUTILIZED_THRESHOLD):
+        self.high = high
+        self.low = low
+        # Bus ID -> anomaly status it is currently flagged with
+        self._flagged: Dict[str, str] = {}
+
+    def seed(self, bus_id: str, status: str) -> None:
+        """Mark a bus as already flagged, e.g. from stored unresolved anomalies"""
+        self._flagged[bus_id] = status
+
+    def forget(self, bus_ids: Iterable[str]) -> None:
+        for bus_id in bus_ids:
+            self._flagged.pop(bus_id, None)
+
+    def _status(self, bus) -> Optional[str]:
+        if bus.occupancy >= self.high:
+            return "overcrowded"
+        # Parked and out-of-service buses are empty by design
+        if bus.occupancy <= self.low and bus.status in ("active", "delayed"):
+            return "underutilized"
+        return None
+
+    def check(self, buses, now: float) -> List[dict]:
+        """Anomalies for buses that newly crossed a threshold"""
+        anomalies = []
+        for bus in buses:
+            status = self._status(bus)
+            if status == self._flagged.get(bus.bus_id):
+                continue
+            if status is None:
+                del self._flagged[bus.bus_id]
+                continue
+            self._flagged[bus.bus_id] = status
+            threshold = self.high if status == "overcrowded" else self.low
+            anomalies.append({
+                "id": f"ANOM-{bus.bus_id}-{int(now)}",
+                "bus_id": bus.bus_id,
+                "route": bus.route,
+                "status": status,
+                "severity": "high" if abs(bus.occupancy - threshold) >= SEVERE_MARGIN else "medium",
+                "occupancy": bus.occupancy,
+                "threshold": threshold,
+                "location": bus.address or bus.next_stop or bus.route,
+                "timestamp": datetime.fromtimestamp(now),
+                "mitigation": MITIGATIONS[status],
+                "reported_by": "System",
+                "resolved": False
+            })
+        return anomalies
+
+
+def fleet_totals(buses) -> dict:
+    """Counts and sums over live buses for the fleet KPIs"""
+    count = on_time = occupancy = 0
+    delayed_routes = set()
+    for bus in buses:
+        count += 1
+        occupancy += bus.occupancy
+        if bus.delay <= ON_TIME_MINUTES:
+            on_time += 1
+        else:
+            delayed_routes.add(bus.route)
+    return {"buses": count, "on_time": on_time, "occupancy": occupancy, "delayed_routes": sorted(delayed_routes)}
+
+
+def merge_totals(parts: Iterable[dict]) -> dict:
+    """Totals of the whole fleet from totals over disjoint parts of it"""
+    merged = {"buses": 0, "on_time": 0, "occupancy": 0, "delayed_routes": set()}
+    for part in parts:
+        merged["buses"] += part["buses"]
+        merged["on_time"] += part["on_time"]
+        merged["occupancy"] += part["occupancy"]
+        merged["delayed_routes"].update(part["delayed_routes"])
+    merged["delayed_routes"] = sorted(merged["delayed_routes"])
+    return merged
@@ -0,0 +1,211 @@
+"""
+Live Fleet State
+This module holds the live fleet as fixed-slot records instead of Pydantic
+models or nested dicts, so the per-tick update path reads and writes plain
+attributes and a large fleet stays small in memory
+
+Route, driver, status, stop and address strings repeat across thousands of
+buses and are interned, so every bus on a route shares one string object.
+Positions are flat floats and update times are epoch seconds. API models
+and feed dictionaries are built from the records only when a response or a
+frame is produced.
+"""
+
+import sys
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+
+def _text(value: Any) -> Optional[str]:
+    return None if value is None else sys.intern(str(value))
+
+
+def _epoch(value: Any) -> float:
+    """Epoch seconds from a timestamp, a datetime or an ISO string (naive values are UTC, as in the feed and PyMongo)"""
+    if value is None:
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        # datetime.timestamp() would read a naive value as local time
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _optional_float(value: Any) -> Optional[float]:
+    return None if value is None else float(value)
+
+
+@lru_cache(maxsize=4096)
+def _iso(timestamp: float) -> str:
+    # Most of a tick's buses share one update time, so formatting is cached
+    return datetime.utcfromtimestamp(timestamp).isoformat()
+
+
+# Slot -> (feed field path, coercion, value when the field is removed)
+FIELDS: Dict[str, tuple] = {
+    "bus_id": ("bus_id", str, None),
+    "route": ("route", _text, None),
+    "driver": ("driver", _text, None),
+    "status": ("status", _text, "active"),
+    "next_stop": ("next_stop", _text, None),
+    "address": ("location.address", _text, None),
+    "lat": ("location.lat", float, 0.0),
+    "lng": ("location.lng", float, 0.0),
+    "occupancy": ("occupancy", int, 0),
+    "delay": ("delay", int, 0),
+    "speed": ("speed", float, 0.0),
+    "direction": ("direction", int, 0),
+    "updated_at": ("last_update", _epoch, None),
+    "distance_to_next_stop": ("distance_to_next_stop", _optional_float, None),
+    "eta_seconds": ("eta_seconds", _optional_float, None),
+}
+
+# Feed field path -> slot
+SLOTS_BY_PATH = {path: slot for slot, (path, _, _) in FIELDS.items()}
+
+
+def _flatten(document: Dict[str, Any], prefix: str = "") -> Iterator[tuple]:
+    for key, value in document.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+        else:
+            yield f"{prefix}{key}", value
+
+
+class BusState:
+    __slots__ = tuple(FIELDS)
+
+    def __init__(self, bus_id: str, route: str, lat: float, lng: float, status: str = "active",
+                 occupancy: int = 0, driver: Optional[str] = None, next_stop: Optional[str] = None,
+                 address: Optional[str] = None, delay: int = 0, speed: float = 0.0, direction: int = 0,
+                 updated_at: Any = None, distance_to_next_stop: Optional[float] = None,
+                 eta_seconds: Optional[float] = None):
+        self.bus_id = str(bus_id)
+        self.route = _text(route)
+        self.driver = _text(driver)
+        self.status = _text(status)
+        self.next_stop = _text(next_stop)
+        self.address = _text(address)
+        self.lat = float(lat)
+        self.lng = float(lng)
+        self.occupancy = int(occupancy)
+        self.delay = int(delay)
+        self.speed = float(speed)
+        self.direction = int(direction)
+        self.updated_at = _epoch(updated_at)
+        self.distance_to_next_stop = distance_to_next_stop
+        self.eta_seconds = eta_seconds
+
+    @classmethod
+    def from_message(cls, message: Dict[str, Any]) -> "BusState":
+        """Build a bus from a feed dictionary (bus_id, route, nested location, last_update, ...)"""
+        location = message.get("location") or {}
+        bus = cls(message["bus_id"], message.get("route"), location.get("lat", 0.0), location.get("lng", 0.0))
+        bus.update(message)
+        return bus
+
+    def set(self, path: str, value: Any) -> bool:
+        """Set one feed field (dotted paths such as location.lat); unknown fields are ignored"""
+        slot = SLOTS_BY_PATH.get(path)
+        if slot is None:
+            return False
+        _, coerce, default = FIELDS[slot]
+        setattr(self, slot, default if value is None and slot != "updated_at" else coerce(value))
+        return True
+
+    def clear(self, path: str) -> None:
+        """Reset a removed feed field to its default"""
+        slot = SLOTS_BY_PATH.get(path)
+        if slot is not None and slot not in ("bus_id", "updated_at"):
+            setattr(self, slot, FIELDS[slot][2])
+
+    def update(self, message: Dict[str, Any]) -> None:
+        """Merge the known fields of a feed dictionary"""
+        for path, value in _flatten(message):
+            self.set(path, value)
+
+    def to_message(self) -> Dict[str, Any]:
+        """Feed dictionary for WebSocket frames"""
+        return {
+            "bus_id": self.bus_id,
+            "route": self.route,
+            "driver": self.driver,
+            "location": {"lat": self.lat, "lng": self.lng, "address": self.address},
+            "status": self.status,
+            "occupancy": self.occupancy,
+            "delay": self.delay,
+            "speed": self.speed,
+            "direction": self.direction,
+            "next_stop": self.next_stop,
+            "distance_to_next_stop": self.distance_to_next_stop,
+            "eta_seconds": self.eta_seconds,
+            "last_update": _iso(self.updated_at)
+        }
+
+    def to_row(self) -> list:
+        return [getattr(self, slot) for slot in FIELDS]
+
+    @classmethod
+    def from_row(cls, row: List[Any]) -> "BusState":
+        bus = cls.__new__(cls)
+        for slot, value in zip(FIELDS, row):
+            setattr(bus, slot, _text(value) if FIELDS[slot][1] is _text else value)
+        return bus
+
+
+class FleetState:
+    """Live buses by ID, in the order they were first seen"""
+
+    def __init__(self, buses: Iterable[BusState] = ()):
+        self._buses: Dict[str, BusState] = {}
+        self.replace(buses)
+
+    def __len__(self) -> int:
+        return len(self._buses)
+
+    def __iter__(self) -> Iterator[BusState]:
+        return iter(self._buses.values())
+
+    def __contains__(self, bus_id: str) -> bool:
+        return bus_id in self._buses
+
+    def get(self, bus_id: str) -> Optional[BusState]:
+        return self._buses.get(bus_id)
+
+    def add(self, bus: BusState) -> None:
+        self._buses[bus.bus_id] = bus
+
+    def remove(self, bus_id: str) -> bool:
+        return self._buses.pop(bus_id, None) is not None
+
+    def replace(self, buses: Iterable[BusState]) -> None:
+        self._buses = {bus.bus_id: bus for bus in buses}
+
+    def apply(self, message: Dict[str, Any]) -> BusState:
+        """Merge a feed dictionary into its bus, adding the bus when it is new"""
+        bus = self._buses.get(message["bus_id"])
+        if bus is None:
+            bus = self._buses[message["bus_id"]] = BusState.from_message(message)
+        else:
+            bus.update(message)
+        return bus
+
+    def select(self, predicate: Callable[[BusState], bool]) -> List[BusState]:
+        return [bus for bus in self._buses.values() if predicate(bus)]
+
+    def messages(self) -> List[Dict[str, Any]]:
+        return [bus.to_message() for bus in self._buses.values()]
+
+    def dump(self) -> Dict[str, Any]:
+        """Column names and one row per bus, for checkpoints"""
+        return {"fields": list(FIELDS), "rows": [bus.to_row() for bus in self._buses.values()]}
+
+    def restore(self, data: Dict[str, Any]) -> None:
+        if data["fields"] != list(FIELDS):
+            raise ValueError(f"fleet checkpoint has fields {data['fields']}")
+        self.replace(BusState.from_row(row) for row in data["rows"])
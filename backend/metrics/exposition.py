@@ -0,0 +1,38 @@
+"""
+Metrics Exposition Server
+This module serves /metrics over plain HTTP for processes without a web
+framework, such as the WebSocket feed server
+"""
+
+import asyncio
+
+from metrics.registry import REGISTRY, CONTENT_TYPE
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        # Drain the request headers
+        while (await reader.readline()).strip():
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[1].split("?")[0] == "/metrics":
+            body = REGISTRY.render().encode()
+            status = "200 OK"
+            content_type = CONTENT_TYPE
+        else:
+            body = b"Not Found"
+            status = "404 Not Found"
+            content_type = "text/plain"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str = "0.0.0.0", port: int = 9108):
+    """Serve the process-wide registry on http://host:port/metrics"""
+    return await asyncio.start_server(_handle, host, port)
@@ -0,0 +1,63 @@
+"""
+HTTP Metrics Middleware
+This module records per-route latency and request/response sizes for the
+FastAPI app
+"""
+
+import time
+
+from metrics.registry import REGISTRY, SIZE_BUCKETS
+
+http_request_duration = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+http_request_size = REGISTRY.histogram(
+    "http_request_size_bytes", "HTTP request body size by route", ("method", "route"), SIZE_BUCKETS)
+http_response_size = REGISTRY.histogram(
+    "http_response_size_bytes", "HTTP response body size by route", ("method", "route"), SIZE_BUCKETS)
+
+
+def _content_length(headers) -> int:
+    """Declared request body size; a missing or malformed header counts as empty"""
+    for name, value in headers:
+        if name == b"content-length":
+            try:
+                return max(0, int(value))
+            except ValueError:
+                return 0
+    return 0
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware so streaming responses are not buffered"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        response_bytes = 0
+
+        async def send_wrapper(message):
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Label by route template rather than raw path to bound cardinality
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            request_bytes = _content_length(scope["headers"])
+            http_request_duration.labels(method, route_path, status).observe(time.perf_counter() - started)
+            http_request_size.labels(method, route_path).observe(request_bytes)
+            http_response_size.labels(method, route_path).observe(response_bytes)
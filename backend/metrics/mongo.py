@@ -0,0 +1,24 @@
+"""
+MongoDB Metrics
+This module times every MongoDB command through PyMongo's command monitoring
+"""
+
+from pymongo import monitoring
+
+from metrics.registry import REGISTRY
+
+mongo_command_duration = REGISTRY.histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ("command", "outcome"))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Pass to MongoClient/AsyncIOMotorClient via event_listeners"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_command_duration.labels(event.command_name, "success").observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        mongo_command_duration.labels(event.command_name, "failure").observe(event.duration_micros / 1e6)
@@ -7,9 +7,11 @@ from cryptography.fernet import Fernet
 import hashlib
 import base64
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, Union
+
+from privacy.consent import ConsentStore
 
 class PrivacyCompliance:
     def __init__(self):
@@ -90,22 +92,32 @@ class PrivacyCompliance:
     
     def generate_consent_record(self, user_id: str, purpose: str) -> Dict[str, Any]:
         """Generate a consent record for data processing"""
+        timestamp = datetime.now(timezone.utc).isoformat()
         return {
             "user_id": user_id,
             "purpose": purpose,
             "consent_given": True,
-            "timestamp": datetime.now().isoformat(),
-            "consent_id": self.hash_personal_data(f"{user_id}_{purpose}_{datetime.now().isoformat()}")
+            "timestamp": timestamp,
+            "consent_id": self.hash_personal_data(f"{user_id}_{purpose}_{timestamp}")
         }
     
-    def check_consent(self, user_id: str, purpose: str, consent_records: list) -> bool:
-        """Check if user has given consent for a specific purpose"""
-        for record in consent_records:
-            if (record.get("user_id") == user_id and 
-                record.get("purpose") == purpose and 
-                record.get("consent_given") == True):
-                return True
-        return False
+    def generate_revocation_record(self, user_id: str, purpose: str) -> Dict[str, Any]:
+        """Generate a record withdrawing consent for data processing"""
+        record = self.generate_consent_record(user_id, purpose)
+        record["consent_given"] = False
+        return record
+    
+    def check_consent(self, user_id: str, purpose: str, consent_records: Union[list, ConsentStore]) -> bool:
+        """Check if user has given consent for a specific purpose (latest record wins)"""
+        # A plain list is indexed per call; callers checking many users hold a ConsentStore
+        # and add() records to it as they change
+        if not isinstance(consent_records, ConsentStore):
+            consent_records = ConsentStore.from_records(consent_records)
+        return consent_records.has_consent(user_id, purpose)
+    
+    async def check_consents(self, user_ids: Iterable[str], purpose: str, consent_store: ConsentStore) -> Dict[str, bool]:
+        """Check consent for a batch of users against an indexed consent store"""
+        return await consent_store.check_consents(user_ids, purpose)
     
     def generate_privacy_report(self) -> Dict[str, Any]:
         """Generate a privacy compliance report"""
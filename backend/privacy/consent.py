@@ -0,0 +1,150 @@
+"""
+Consent Store
+This module keeps passenger consent records indexed by (user_id, purpose) so
+that consent gating stays O(1) per check instead of scanning every record
+
+For a store backed by a collection the index is a bounded cache: the least
+recently used keys are evicted past MAX_CACHED, and records loaded from the
+database stop counting after CACHE_TTL seconds, so a withdrawal or erasure
+made by another process is picked up. Batch checks always re-read the
+database for the users they check.
+"""
+
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Compound index backing the consents collection; the descending timestamp lets
+# the latest record for a (user_id, purpose) pair be read straight off the index
+CONSENT_INDEX = [("user_id", 1), ("purpose", 1), ("timestamp", -1)]
+
+# Keys cached per store backed by a collection
+MAX_CACHED = 100_000
+
+# Seconds a record read from the collection is trusted without re-reading it
+CACHE_TTL = 300.0
+
+_EPOCH = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def _record_time(record: Dict[str, Any]) -> datetime:
+    """Return the timestamp of a consent record as an aware UTC datetime (naive times are UTC)"""
+    timestamp = record.get("timestamp")
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if not isinstance(timestamp, datetime):
+        return _EPOCH
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+
+class ConsentStore:
+    def __init__(self, collection=None, max_cached: int = MAX_CACHED, ttl: float = CACHE_TTL):
+        # Optional Motor collection holding the persisted consent records
+        self.collection = collection
+        self.max_cached = max_cached
+        self.ttl = ttl
+
+        # Latest consent record per (user_id, purpose), with the time it was cached
+        self._index: "OrderedDict[Tuple[str, str], Tuple[Dict[str, Any], float]]" = OrderedDict()
+
+    @classmethod
+    def from_records(cls, consent_records: Iterable[Dict[str, Any]]) -> "ConsentStore":
+        """Build an in-memory store from a list of consent records"""
+        store = cls()
+        for record in consent_records:
+            store.add(record)
+        return store
+
+    def _cached(self, key: Tuple[str, str]) -> Optional[Dict[str, Any]]:
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        record, cached_at = entry
+        if self.collection is not None and time.monotonic() - cached_at > self.ttl:
+            del self._index[key]
+            return None
+        self._index.move_to_end(key)
+        return record
+
+    def add(self, record: Dict[str, Any]) -> None:
+        """Add a consent or revocation record, keeping only the latest per key"""
+        key = (record.get("user_id"), record.get("purpose"))
+        current = self._cached(key)
+        if current is None or _record_time(record) >= _record_time(current):
+            self._index[key] = (record, time.monotonic())
+            self._index.move_to_end(key)
+            if self.collection is not None and len(self._index) > self.max_cached:
+                self._index.popitem(last=False)
+
+    def has_consent(self, user_id: str, purpose: str) -> bool:
+        """Check the in-memory index for a user's consent to a purpose"""
+        record = self._cached((user_id, purpose))
+        return bool(record and record.get("consent_given") is True)
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop every cached record of a user"""
+        for key in [key for key in self._index if key[0] == user_id]:
+            del self._index[key]
+
+    async def erase(self, user_id: str) -> int:
+        """Delete a user's consent records (right to erasure); returns the records deleted"""
+        self.invalidate(user_id)
+        if self.collection is None:
+            return 0
+        result = await self.collection.delete_many({"user_id": user_id})
+        return result.deleted_count
+
+    async def ensure_indexes(self) -> None:
+        """Create the compound (user_id, purpose, timestamp) index"""
+        if self.collection is not None:
+            await self.collection.create_index(CONSENT_INDEX)
+
+    async def save(self, record: Dict[str, Any]) -> None:
+        """Persist a consent or revocation record and update the index"""
+        self.add(record)
+        if self.collection is not None:
+            await self.collection.insert_one(dict(record))
+
+    async def load(self, purpose: Optional[str] = None) -> int:
+        """Load the latest consent record per key from the database"""
+        if self.collection is None:
+            return 0
+        match = {"purpose": purpose} if purpose else {}
+        count = 0
+        async for record in self.collection.aggregate(self._latest_pipeline(match)):
+            self.add(record)
+            count += 1
+        return count
+
+    async def check_consents(self, user_ids: Iterable[str], purpose: str) -> Dict[str, bool]:
+        """Resolve consent for a whole batch of users in a single query"""
+        user_ids = list(dict.fromkeys(user_ids))
+        if self.collection is None or not user_ids:
+            return {user_id: self.has_consent(user_id, purpose) for user_id in user_ids}
+        # The database is the authority: users with no records left must not keep cached consent
+        for user_id in user_ids:
+            self._index.pop((user_id, purpose), None)
+        latest: Dict[str, Dict[str, Any]] = {}
+        match = {"user_id": {"$in": user_ids}, "purpose": purpose}
+        async for record in self.collection.aggregate(self._latest_pipeline(match)):
+            self.add(record)
+            latest[record["user_id"]] = record
+        # Answered from the rows read, since a batch larger than the cache evicts its own records
+        return {user_id: user_id in latest and latest[user_id].get("consent_given") is True for user_id in user_ids}
+
+    @staticmethod
+    def _latest_pipeline(match: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Aggregation returning the latest record per (user_id, purpose)"""
+        return [
+            {"$match": match},
+            {"$sort": {"user_id": 1, "purpose": 1, "timestamp": -1}},
+            {"$group": {
+                "_id": {"user_id": "$user_id", "purpose": "$purpose"},
+                "record": {"$first": "$$ROOT"}
+            }},
+            {"$replaceRoot": {"newRoot": "$record"}},
+            {"$project": {"_id": 0}}
+        ]
@@ -0,0 +1,69 @@
+"""
+Statistical Stack Sampler
+This module samples the Python stacks of every thread for a fixed window and
+produces collapsed stacks (the input format of flamegraph.pl and speedscope)
+"""
+
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+
+def frame_name(frame) -> str:
+    """Render one frame as module:function:line"""
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", code.co_filename)
+    return f"{module}:{code.co_name}:{frame.f_lineno}"
+
+
+def collapse_frame(frame) -> str:
+    """Collapse a frame and its callers into root;...;leaf"""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def render_collapsed(stacks: Counter) -> str:
+    """Render stack counts as collapsed-stack text"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class StackSampler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def sample(self, seconds: float, interval: float = 0.005,
+               thread_id: Optional[int] = None) -> Counter:
+        """Sample stacks for a window; blocks the calling thread (run it off the event loop)"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profiling session is already running")
+        self._running = True
+        stacks: Counter = Counter()
+        own_thread = threading.get_ident()
+        try:
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_thread or (thread_id is not None and ident != thread_id):
+                        continue
+                    name = thread_names.get(ident, ident)
+                    stacks[f"thread:{name};{collapse_frame(frame)}"] += 1
+                time.sleep(interval)
+        finally:
+            self._running = False
+            self._lock.release()
+        return stacks
+
+
+# Shared sampler; only one session runs at a time
+sampler = StackSampler()
@@ -0,0 +1,186 @@
+"""
+Slow Request Capture
+This module records call stacks and a per-function time breakdown for
+requests and feed ticks that run longer than a latency threshold
+
+Nothing runs until a threshold is configured. Once enabled, tracking an
+operation costs a dict insert and pop; a watchdog thread samples the event
+loop only while some operation is already over the threshold.
+
+A sample of the loop's stack is only attributed to the operation whose task
+the loop is running at that moment. Other overdue operations on the loop
+count the sample as waiting while another task runs, or as idle while the
+loop has no task running (the operation is awaiting I/O), so their breakdown
+shows how long they were held up rather than another request's stack.
+"""
+
+import asyncio
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import count
+from typing import Any, Dict, List, Optional
+
+from profiling.sampler import collapse_frame, frame_name, render_collapsed
+
+# Sample label for an operation whose loop was running another task
+WAITING = "(waiting for the event loop)"
+
+# Sample label for an operation whose loop was running no task at all
+IDLE = "(idle / awaiting I/O)"
+
+
+class _InFlight:
+    __slots__ = ("name", "started", "thread_id", "task", "loop", "samples", "await_stack", "await_scheduled")
+
+    def __init__(self, name: str, started: float, thread_id: int, task, loop):
+        self.name = name
+        self.started = started
+        self.thread_id = thread_id
+        self.task = task
+        self.loop = loop
+        self.samples: Counter = Counter()
+        self.await_stack: Optional[str] = None
+        # The await stack capture is queued on the loop once per operation
+        self.await_scheduled = False
+
+
+class SlowCapture:
+    def __init__(self, threshold_ms: Optional[float] = None, sample_interval: float = 0.005,
+                 max_records: int = 50):
+        self.threshold: Optional[float] = None
+        self.sample_interval = sample_interval
+        self.records: deque = deque(maxlen=max_records)
+        self._in_flight: Dict[int, _InFlight] = {}
+        self._ids = count()
+        self._watchdog: Optional[threading.Thread] = None
+        if threshold_ms:
+            self.enable(threshold_ms)
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold is not None
+
+    def enable(self, threshold_ms: float) -> None:
+        """Start capturing operations slower than threshold_ms"""
+        self.threshold = threshold_ms / 1000
+        if self._watchdog is None or not self._watchdog.is_alive():
+            self._watchdog = threading.Thread(target=self._watch, name="slow-capture", daemon=True)
+            self._watchdog.start()
+
+    def disable(self) -> None:
+        """Stop capturing; the watchdog exits on its next wakeup"""
+        self.threshold = None
+        self._watchdog = None
+
+    @contextmanager
+    def track(self, name: str):
+        """Track one request or tick running on the event loop"""
+        if self.threshold is None:
+            yield
+            return
+        try:
+            task = asyncio.current_task()
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            task, loop = None, None
+        token = next(self._ids)
+        entry = _InFlight(name, time.perf_counter(), threading.get_ident(), task, loop)
+        self._in_flight[token] = entry
+        try:
+            yield
+        finally:
+            self._in_flight.pop(token, None)
+            duration = time.perf_counter() - entry.started
+            if self.threshold is not None and duration >= self.threshold:
+                self._store(entry, duration)
+
+    def _store(self, entry: _InFlight, duration: float) -> None:
+        total = sum(entry.samples.values())
+        leaves: Counter = Counter()
+        for stack, hits in entry.samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += hits
+        self.records.append({
+            "name": entry.name,
+            "duration_ms": round(duration * 1000, 2),
+            "started_at": datetime.utcnow().isoformat(),
+            "samples": total,
+            # Share of the blocked time attributed to each leaf function
+            "breakdown": {
+                leaf: round(hits / total * duration * 1000, 2)
+                for leaf, hits in leaves.most_common(10)
+            } if total else {},
+            "stacks": render_collapsed(entry.samples),
+            "await_stack": entry.await_stack
+        })
+
+    def _watch(self) -> None:
+        """Sample the event loop thread for operations over the threshold"""
+        me = threading.current_thread()
+        while self._watchdog is me and self.threshold is not None:
+            threshold = self.threshold
+            now = time.perf_counter()
+            overdue = [e for e in list(self._in_flight.values()) if now - e.started >= threshold]
+            if not overdue:
+                time.sleep(min(threshold / 2, 0.05))
+                continue
+            running = {entry.loop: asyncio.current_task(entry.loop) for entry in overdue if entry.loop is not None}
+            frames = sys._current_frames()
+            for entry in overdue:
+                if entry.task is not None and running[entry.loop] is None:
+                    entry.samples[IDLE] += 1
+                elif entry.task is not None and running[entry.loop] is not entry.task:
+                    entry.samples[WAITING] += 1
+                else:
+                    frame = frames.get(entry.thread_id)
+                    if frame is not None:
+                        entry.samples[collapse_frame(frame)] += 1
+                if not entry.await_scheduled and entry.task is not None:
+                    # Read the coroutine chain on the loop thread once it is free
+                    entry.await_scheduled = True
+                    try:
+                        entry.loop.call_soon_threadsafe(self._capture_await_stack, entry)
+                    except RuntimeError:
+                        # The loop closed while its operation was still tracked
+                        pass
+            time.sleep(self.sample_interval)
+
+    @staticmethod
+    def _capture_await_stack(entry: _InFlight) -> None:
+        if entry.task.done():
+            return
+        names = []
+        coro = entry.task.get_coro()
+        # Follow the await chain from the task's coroutine down to the innermost awaitable
+        while coro is not None:
+            frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+            if frame is not None:
+                names.append(frame_name(frame))
+            coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+        entry.await_stack = ";".join(names)
+
+    def recent(self) -> List[Dict[str, Any]]:
+        """Return captured slow operations, newest first"""
+        return list(reversed(self.records))
+
+
+class SlowRequestMiddleware:
+    """ASGI middleware tracking HTTP requests; a single flag check while disabled"""
+
+    def __init__(self, app, capture: SlowCapture):
+        self.app = app
+        self.capture = capture
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.capture.enabled:
+            await self.app(scope, receive, send)
+            return
+        with self.capture.track(f"{scope['method']} {scope['path']}"):
+            await self.app(scope, receive, send)
+
+
+# Shared capture for the process; enabled from SLOW_REQUEST_MS or the admin API
+slow_operations = SlowCapture()
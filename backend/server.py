@@ -1,33 +1,125 @@
-from fastapi import FastAPI, APIRouter
+from contextlib import asynccontextmanager
+import asyncio
+import inspect
+from fastapi import FastAPI, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import time
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List
-import uuid
-from datetime import datetime
-import uvicorn
 
 # Import the new routes
 from api import routes
+from admission.middleware import AdmissionMiddleware
+from analytics.rollups import rollups
+from audit.writer import audit_log
+from simulation.runner import simulation_runner
+from metrics.middleware import MetricsMiddleware
+from metrics.registry import REGISTRY, CONTENT_TYPE
+from profiling.slow import SlowRequestMiddleware, slow_operations
+from sharding.pool import PartitionError
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Seconds between live state refreshes
+LIVE_REFRESH_INTERVAL = 2.0
+
+async def refresh_live_state_periodically():
+    """Keep ETAs, stop events, anomalies, KPIs and map clusters current between requests"""
+    while True:
+        try:
+            await routes.refresh_live_state()
+        except PartitionError as e:
+            logger.error(f"Live state refresh failed: {e}")
+        except Exception:
+            # A bad tick must not stop ETAs, stop events, KPIs and clusters for good
+            logger.exception("Live state refresh failed")
+        await asyncio.sleep(LIVE_REFRESH_INTERVAL)
+
+async def stop_step(name: str, stop) -> None:
+    """Run one shutdown step, logging rather than raising its failure"""
+    try:
+        result = stop()
+        if inspect.isawaitable(result):
+            await result
+    except Exception:
+        logger.exception(f"Stopping {name} failed")
+
+async def bootstrap_indexes(db) -> None:
+    """Create or migrate indexes in the background, so an unreachable MongoDB never holds up startup"""
+    from db.schema import ensure_indexes
+    try:
+        created = await ensure_indexes(db)
+        if created:
+            logger.info(f"Created or rebuilt {len(created)} indexes: {', '.join(created)}")
+    except Exception as e:
+        logger.warning(f"Index bootstrap skipped: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Connect to MongoDB, start the index bootstrap and background writers"""
+    started = time.perf_counter()
+
+    # Serve the last known fleet straight away instead of waiting for feeds
+    restored = routes.start_live_state()
+    if restored:
+        logger.info(f"Restored {', '.join(restored)} from checkpoint in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    # Motor is only loaded once the app starts; pymongo, numpy and the live
+    # pipeline are already loaded with api.routes
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from metrics.mongo import MongoCommandMetrics
+
+    # MongoDB connection
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], event_listeners=[MongoCommandMetrics()])
+    db = client[os.environ['DB_NAME']]
+    app.state.mongo_client = client
+    app.state.db = db
+
+    index_task = asyncio.create_task(bootstrap_indexes(db))
+
+    # Partition the live pipeline across worker processes
+    workers = int(os.environ.get('FLEET_WORKERS', 0))
+    if workers > 0:
+        await routes.start_partitions(workers)
+
+    audit_log.start(db.audit_logs)
+    routes.checkpointer.start()
+    rollups.start(db.rollups)
+    live_task = asyncio.create_task(refresh_live_state_periodically())
+    logger.info(f"Startup completed in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    yield
+
+    live_task.cancel()
+    index_task.cancel()
+    # Each step is stopped on its own, so one failing never skips the audit flush after it
+    await stop_step("simulation workers", simulation_runner.shutdown)
+    await stop_step("rollups", lambda: rollups.stop(db.rollups))
+    await stop_step("checkpointer", routes.checkpointer.stop)
+    await stop_step("partition workers", routes.stop_partitions)
+    await stop_step("audit log", audit_log.stop)
+    client.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Include the API routes
 app.include_router(routes.router)
 
+# Rate limits, request coalescing and concurrency limits; inside CORS so
+# rejections still carry CORS headers
+app.add_middleware(AdmissionMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -37,16 +129,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+# Record per-route latency and payload sizes
+app.add_middleware(MetricsMiddleware)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+# Capture stacks of slow requests once a threshold is configured
+app.add_middleware(SlowRequestMiddleware, capture=slow_operations)
+if os.environ.get('SLOW_REQUEST_MS'):
+    slow_operations.enable(float(os.environ['SLOW_REQUEST_MS']))
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics"""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,165 @@
+"""
+Fleet Partitions
+This module runs the live pipeline for one partition of the fleet inside a
+worker process: merging position updates, snapping buses onto their routes
+for ETAs, stop geofencing, occupancy anomaly checks and KPI totals
+
+After every tick the worker publishes the partition's bus lists (already
+encoded as API JSON), its checkpoint rows and its KPI totals to its shared
+memory snapshot. What the API process folds into its own state (stop
+events, new anomalies, stop ETAs) comes back as the reply to the tick.
+"""
+
+import json
+import random
+import signal
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from fleet.clustering import ClusterIndex
+from fleet.eta import build_engine
+from fleet.geofence import build_geofencer
+from fleet.monitor import OccupancyMonitor, fleet_totals
+from fleet.state import BusState, FleetState
+from sharding.snapshot import SnapshotWriter
+
+# Commands the API process may send to a worker
+COMMANDS = {"load", "take", "tick", "lookup", "buses_in", "cells"}
+
+# Commands after which the worker publishes a new snapshot
+PUBLISHING = {"load", "take", "tick"}
+
+
+class Partition:
+    def __init__(self, index: int, routes, stops, encode: Callable[[Iterable[BusState]], bytes]):
+        self.index = index
+        self.encode = encode
+        self.buses = FleetState()
+        self.eta_engine = build_engine(routes, stops)
+        self.geofencer = build_geofencer(stops)
+        self.monitor = OccupancyMonitor()
+        self.clusters = ClusterIndex()
+        self._random = random.Random(index)
+
+    def load(self, rows: List[list], flagged: Dict[str, str]) -> int:
+        """Take over buses (as checkpoint rows) and their open anomalies"""
+        for row in rows:
+            bus = BusState.from_row(row)
+            self.buses.add(bus)
+            self.clusters.update(bus.bus_id, bus.lat, bus.lng, bus.status)
+        for bus_id, status in flagged.items():
+            self.monitor.seed(bus_id, status)
+        return len(self.buses)
+
+    def take(self, bus_ids: List[str]) -> List[list]:
+        """Hand buses over to another partition, as checkpoint rows"""
+        rows = []
+        for bus_id in bus_ids:
+            bus = self.buses.get(bus_id)
+            if bus is None:
+                continue
+            rows.append(bus.to_row())
+            self.buses.remove(bus_id)
+            self.clusters.remove(bus_id)
+        self.eta_engine.forget(bus_ids)
+        self.geofencer.forget(bus_ids)
+        self.monitor.forget(bus_ids)
+        return rows
+
+    def _jitter(self, amount: float, now: float) -> None:
+        """Synthetic movement, like the mock GPS feed, for load tests"""
+        uniform = self._random.uniform
+        randint = self._random.randint
+        for bus in self.buses:
+            bus.lat += uniform(-amount, amount)
+            bus.lng += uniform(-amount, amount)
+            bus.occupancy = max(0, min(100, bus.occupancy + randint(-5, 5)))
+            bus.speed = max(0.0, bus.speed + uniform(-2, 2))
+            bus.updated_at = now
+
+    def tick(self, rows: List[list], updates: List[dict], now: float, jitter: float = 0.0) -> Dict[str, Any]:
+        """Merge updates, then run ETAs, geofences and anomaly checks over the partition"""
+        if rows:
+            self.load(rows, {})
+        for update in updates:
+            self.buses.apply(update)
+        if jitter:
+            self._jitter(jitter, now)
+
+        results = self.eta_engine.update((bus.bus_id, bus.route, bus.lat, bus.lng, now) for bus in self.buses)
+        for bus in self.buses:
+            result = results.get(bus.bus_id)
+            if result is not None:
+                if result["next_stop"] is not None:
+                    bus.next_stop = result["next_stop"]
+                bus.distance_to_next_stop = result["distance_to_next_stop"]
+                bus.eta_seconds = result["eta_seconds"]
+            self.clusters.update(bus.bus_id, bus.lat, bus.lng, bus.status)
+
+        events = self.geofencer.process(
+            (bus.bus_id, bus.route, bus.driver, bus.lat, bus.lng, now) for bus in self.buses
+        )
+        for event in events:
+            if event["type"] == "arrival":
+                bus = self.buses.get(event["bus_id"])
+                event["delay"] = bus.delay
+                event["occupancy"] = bus.occupancy
+
+        return {
+            "buses": len(self.buses),
+            "stop_events": events,
+            "anomalies": self.monitor.check(self.buses, now),
+            "stop_etas": self.eta_engine.stop_etas
+        }
+
+    def lookup(self, bus_id: str) -> Optional[bytes]:
+        """API JSON for one bus"""
+        bus = self.buses.get(bus_id)
+        return None if bus is None else self.encode([bus])[1:-1]
+
+    def buses_in(self, bbox) -> bytes:
+        """API JSON list items for the buses inside (west, south, east, north)"""
+        return self.encode([self.buses.get(bus_id) for bus_id in self.clusters.bus_ids_in(bbox)])[1:-1]
+
+    def cells(self, zoom: int, bbox) -> List[tuple]:
+        return self.clusters.cells(zoom, bbox)
+
+    def sections(self) -> Dict[str, bytes]:
+        """Snapshot sections: bus list items per status, checkpoint rows and KPI totals"""
+        by_status: Dict[str, List[BusState]] = {}
+        for bus in self.buses:
+            by_status.setdefault(bus.status, []).append(bus)
+        sections = {f"buses:{status}": self.encode(buses)[1:-1] for status, buses in by_status.items()}
+        sections["rows"] = json.dumps([bus.to_row() for bus in self.buses], separators=(",", ":")).encode()[1:-1]
+        sections["totals"] = json.dumps(fleet_totals(self.buses)).encode()
+        return sections
+
+
+def serve(index: int, connection, snapshot_name: str, routes, stops) -> None:
+    """Worker process main loop: run commands from the API process until told to stop"""
+    # The API process shuts workers down; Ctrl-C in the terminal reaches them too
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Imported here so the API module is not imported by the module the API imports
+    from api.routes import bus_list, bus_model
+
+    partition = Partition(index, routes, stops, lambda buses: bus_list.dump_json([bus_model(bus) for bus in buses]))
+    snapshot = SnapshotWriter(snapshot_name)
+    try:
+        while True:
+            try:
+                command, args = connection.recv()
+            except EOFError:
+                break
+            if command == "stop":
+                break
+            try:
+                if command not in COMMANDS:
+                    raise ValueError(f"unknown command {command}")
+                result = getattr(partition, command)(*args)
+                if command in PUBLISHING:
+                    snapshot.write(partition.sections())
+                connection.send((True, result))
+            except Exception as e:
+                connection.send((False, f"{type(e).__name__}: {e}"))
+    finally:
+        snapshot.close()
+        connection.close()
@@ -0,0 +1,274 @@
+"""
+Sharded Fleet
+This module spreads the live pipeline over worker processes, one partition
+of the fleet each, with routes assigned to partitions by consistent hashing
+
+Every partition runs its tick in its own process, so a tick takes as long
+as the largest partition rather than the whole fleet. Fleet-wide reads are
+scatter-gather: bus lists, KPI totals and checkpoint rows are copied out of
+each partition's shared memory snapshot and joined without a round trip to
+the workers; lookups that need a partition's indexes (single buses, map
+clusters) are sent to the workers in parallel.
+
+A worker that dies is replaced at the start of the next tick: the new
+process takes over the same routes, loaded from the last consistent rows
+in the partition's snapshot. Until it has, fleet-wide reads are served
+from that snapshot and the fleet reports itself stale; lookups that need
+the dead worker raise PartitionError (the API answers 503).
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from fleet.clustering import merge_cells
+from fleet.eta import MAX_STOP_ARRIVALS
+from fleet.monitor import merge_totals
+from fleet.state import FIELDS, BusState
+from metrics.registry import REGISTRY
+from sharding.partition import serve
+from sharding.ring import HashRing
+from sharding.snapshot import DEFAULT_SIZE, SnapshotReader
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a worker to exit before terminating it
+STOP_TIMEOUT = 5.0
+
+shard_tick_duration = REGISTRY.histogram("shard_tick_duration_seconds", "Time for every partition to finish a tick")
+shard_buses = REGISTRY.gauge("shard_buses", "Buses owned by each partition", ["partition"])
+shard_restarts = REGISTRY.counter("shard_restarts_total", "Partition workers restarted after exiting", ["partition"])
+
+
+class PartitionError(Exception):
+    """A partition worker failed a command or is gone"""
+
+
+class ShardedFleet:
+    def __init__(self, workers: int, routes, stops, snapshot_size: int = DEFAULT_SIZE,
+                 flagged: Optional[Callable[[], Dict[str, str]]] = None):
+        self.ring = HashRing(workers)
+        self.workers = workers
+        self.routes = routes
+        self.stops = stops
+        self.snapshot_size = snapshot_size
+        # Open anomalies by bus, re-seeded into a restarted worker
+        self.flagged = flagged
+        # Partitions whose replacement worker is still taking over
+        self._recovering: Set[int] = set()
+        # Partition of every bus, so updates without a route still find their bus
+        self._owners: Dict[str, int] = {}
+        self._processes: List[multiprocessing.Process] = []
+        self._connections = []
+        self._pipe_locks: List[threading.Lock] = []
+        self._snapshots: List[SnapshotReader] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def partition_of(self, bus_id: str, route: Optional[str]) -> int:
+        if route:
+            return self.ring.partition(route)
+        owner = self._owners.get(bus_id)
+        return owner if owner is not None else self.ring.partition(bus_id)
+
+    async def start(self, buses: Iterable[BusState], flagged: Optional[Dict[str, str]] = None) -> None:
+        """Start the workers and hand each its share of the fleet and of the open anomalies"""
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="partition")
+        for index in range(self.workers):
+            self._snapshots.append(SnapshotReader(self.snapshot_size))
+            self._pipe_locks.append(threading.Lock())
+            process, connection = self._spawn(index)
+            self._processes.append(process)
+            self._connections.append(connection)
+
+        rows: List[List[list]] = [[] for _ in range(self.workers)]
+        for bus in buses:
+            partition = self._owners[bus.bus_id] = self.partition_of(bus.bus_id, bus.route)
+            rows[partition].append(bus.to_row())
+        flags: List[Dict[str, str]] = [{} for _ in range(self.workers)]
+        for bus_id, status in (flagged or {}).items():
+            if bus_id in self._owners:
+                flags[self._owners[bus_id]][bus_id] = status
+        try:
+            counts = await self._scatter("load", [(rows[i], flags[i]) for i in range(self.workers)])
+        except PartitionError:
+            await self.stop()
+            raise
+        for index, count in enumerate(counts):
+            shard_buses.labels(str(index)).set(count)
+        logger.info(f"Started {self.workers} fleet partitions: {counts} buses")
+
+    def _spawn(self, index: int) -> Tuple[multiprocessing.Process, Any]:
+        """Start the worker process of a partition, attached to the partition's snapshot"""
+        # Spawned rather than forked: the API process runs an event loop and driver threads
+        context = multiprocessing.get_context("spawn")
+        connection, worker_connection = context.Pipe()
+        process = context.Process(target=serve, name=f"fleet-partition-{index}", daemon=True,
+                                  args=(index, worker_connection, self._snapshots[index].name, self.routes, self.stops))
+        process.start()
+        worker_connection.close()
+        return process, connection
+
+    @property
+    def stale(self) -> bool:
+        """Some partition is served from the snapshot of a worker that died"""
+        return bool(self._recovering) or any(not process.is_alive() for process in self._processes)
+
+    async def _recover(self) -> None:
+        """Replace workers that exited, handing each replacement its partition's buses"""
+        for index, process in enumerate(self._processes):
+            if process.is_alive() or index in self._recovering:
+                continue
+            self._recovering.add(index)
+            try:
+                await self._respawn(index)
+            finally:
+                self._recovering.discard(index)
+
+    async def _respawn(self, index: int) -> None:
+        logger.error(f"{self._processes[index].name} exited with code {self._processes[index].exitcode}, restarting it")
+        shard_restarts.labels(str(index)).inc()
+        snapshot = self._snapshots[index]
+        try:
+            rows = json.loads(b"[" + snapshot.read(names=["rows"]).get("rows", b"") + b"]")
+        except TimeoutError:
+            # Died while publishing: its buses come back with their next updates
+            logger.warning(f"Partition {index} snapshot is torn, restarting it empty")
+            snapshot.reset()
+            rows = []
+        flags = {bus_id: status for bus_id, status in (self.flagged() if self.flagged else {}).items()
+                 if self._owners.get(bus_id) == index}
+
+        with self._pipe_locks[index]:
+            self._connections[index].close()
+        await asyncio.to_thread(self._processes[index].join, 0)
+        self._processes[index], self._connections[index] = self._spawn(index)
+        try:
+            count = await self._call(index, "load", rows, flags)
+        except PartitionError:
+            # Leave it dead so the next tick tries again
+            self._processes[index].terminate()
+            raise
+        shard_buses.labels(str(index)).set(count)
+        logger.info(f"Partition {index} restarted with {count} buses")
+
+    def _roundtrip(self, partition: int, command: str, args: tuple) -> Tuple[bool, Any]:
+        # One request in flight per pipe, even when the awaiting request was cancelled
+        with self._pipe_locks[partition]:
+            connection = self._connections[partition]
+            try:
+                connection.send((command, args))
+                return connection.recv()
+            except (EOFError, OSError) as e:
+                return False, f"worker unavailable: {e}"
+
+    async def _call(self, partition: int, command: str, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        ok, result = await loop.run_in_executor(self._executor, self._roundtrip, partition, command, args)
+        if not ok:
+            raise PartitionError(f"partition {partition} {command}: {result}")
+        return result
+
+    async def _scatter(self, command: str, args: List[tuple]) -> List[Any]:
+        """Run a command on every partition at once, with per-partition arguments"""
+        return await asyncio.gather(*(self._call(i, command, *args[i]) for i in range(self.workers)))
+
+    async def tick(self, updates: Iterable[dict] = (), jitter: float = 0.0) -> Dict[str, Any]:
+        """One pass of the live pipeline on every partition; returns the merged stop events, anomalies and stop ETAs"""
+        started = time.perf_counter()
+        await self._recover()
+        batches: List[List[dict]] = [[] for _ in range(self.workers)]
+        moves: Dict[int, Dict[int, List[str]]] = {}
+        for update in updates:
+            bus_id = update["bus_id"]
+            partition = self.partition_of(bus_id, update.get("route"))
+            owner = self._owners.get(bus_id)
+            if owner is not None and owner != partition:
+                # Route changed to one on another partition: the bus moves with its state
+                moves.setdefault(owner, {}).setdefault(partition, []).append(bus_id)
+            self._owners[bus_id] = partition
+            batches[partition].append(update)
+
+        rows: List[List[list]] = [[] for _ in range(self.workers)]
+        for owner, targets in moves.items():
+            for partition, bus_ids in targets.items():
+                rows[partition].extend(await self._call(owner, "take", bus_ids))
+
+        now = time.time()
+        replies = await self._scatter("tick", [(rows[i], batches[i], now, jitter) for i in range(self.workers)])
+
+        stop_etas: Dict[str, List[dict]] = {}
+        for index, reply in enumerate(replies):
+            shard_buses.labels(str(index)).set(reply["buses"])
+            for stop_id, arrivals in reply["stop_etas"].items():
+                stop_etas.setdefault(stop_id, []).extend(arrivals)
+        for stop_id, arrivals in stop_etas.items():
+            arrivals.sort(key=lambda arrival: arrival["eta_seconds"])
+            del arrivals[MAX_STOP_ARRIVALS:]
+        shard_tick_duration.observe(time.perf_counter() - started)
+        return {
+            "stop_events": [event for reply in replies for event in reply["stop_events"]],
+            "anomalies": [anomaly for reply in replies for anomaly in reply["anomalies"]],
+            "stop_etas": stop_etas
+        }
+
+    def _gather(self, names: Optional[List[str]] = None, prefix: Optional[str] = None) -> List[bytes]:
+        """Non-empty sections from every partition's latest snapshot"""
+        sections = []
+        for snapshot in self._snapshots:
+            sections.extend(data for data in snapshot.read(names, prefix).values() if data)
+        return sections
+
+    def buses_json(self, status: Optional[str] = None) -> bytes:
+        """API JSON list of every bus, or of the buses with a status"""
+        if status:
+            return b"[" + b",".join(self._gather(names=[f"buses:{status}"])) + b"]"
+        return b"[" + b",".join(self._gather(prefix="buses:")) + b"]"
+
+    def totals(self) -> dict:
+        """KPI totals of the whole fleet"""
+        return merge_totals(json.loads(data) for data in self._gather(names=["totals"]))
+
+    def rows_json(self) -> bytes:
+        """The fleet in the checkpoint format of FleetState.dump"""
+        return b'{"fields":%s,"rows":[%s]}' % (json.dumps(list(FIELDS)).encode(),
+                                                 b",".join(self._gather(names=["rows"])))
+
+    async def bus_json(self, bus_id: str) -> Optional[bytes]:
+        partition = self._owners.get(bus_id)
+        if partition is None:
+            return None
+        return await self._call(partition, "lookup", bus_id)
+
+    async def buses_in_json(self, bbox: Tuple[float, float, float, float]) -> bytes:
+        """API JSON list of the buses inside (west, south, east, north)"""
+        parts = await self._scatter("buses_in", [(bbox,)] * self.workers)
+        return b"[" + b",".join(part for part in parts if part) + b"]"
+
+    async def clusters(self, zoom: int, bbox: Optional[Tuple[float, float, float, float]] = None) -> List[dict]:
+        return merge_cells(await self._scatter("cells", [(zoom, bbox)] * self.workers))
+
+    async def stop(self) -> None:
+        """Stop the workers and release their snapshots"""
+        for index, process in enumerate(self._processes):
+            with self._pipe_locks[index]:
+                try:
+                    self._connections[index].send(("stop", ()))
+                except OSError:
+                    pass
+        for process in self._processes:
+            await asyncio.to_thread(process.join, STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning(f"{process.name} did not stop, terminating it")
+                process.terminate()
+        for connection in self._connections:
+            connection.close()
+        for snapshot in self._snapshots:
+            snapshot.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._processes, self._connections, self._pipe_locks, self._snapshots = [], [], [], []
@@ -0,0 +1,44 @@
+"""
+Consistent Hash Ring
+This module assigns partition keys (routes) to partitions so that changing
+the number of partitions only moves the keys of the partitions added or
+removed
+
+Each partition owns many virtual points on a 64-bit ring; a key belongs to
+the first point at or after its own hash, wrapping around.
+"""
+
+import hashlib
+from bisect import bisect_left
+from typing import Dict, List
+
+# Virtual points per partition; more points even out the share of keys
+VIRTUAL_NODES = 128
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, partitions: int, virtual_nodes: int = VIRTUAL_NODES):
+        if partitions < 1:
+            raise ValueError("a ring needs at least one partition")
+        self.partitions = partitions
+        points = sorted(
+            (_hash(f"partition-{partition}:{replica}"), partition)
+            for partition in range(partitions)
+            for replica in range(virtual_nodes)
+        )
+        self._hashes: List[int] = [point for point, _ in points]
+        self._owners: List[int] = [partition for _, partition in points]
+        # Routes repeat across thousands of buses
+        self._cache: Dict[str, int] = {}
+
+    def partition(self, key: str) -> int:
+        """Partition owning a key"""
+        partition = self._cache.get(key)
+        if partition is None:
+            index = bisect_left(self._hashes, _hash(key))
+            partition = self._cache[key] = self._owners[index % len(self._owners)]
+        return partition
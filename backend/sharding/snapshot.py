@@ -0,0 +1,121 @@
+"""
+Shared-Memory Snapshots
+This module publishes a partition's latest state from its worker process to
+the API process through a shared memory segment, so reads never wait on the
+worker
+
+A snapshot is a set of named byte sections. The segment starts with a
+sequence number and the payload length; the writer makes the sequence odd
+while it writes and even again when done, and a reader retries whenever the
+sequence was odd or changed during its copy (a seqlock). Payload layout:
+length of a JSON index of {section: [offset, length]}, the index, then the
+section bytes.
+"""
+
+import json
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, Optional
+
+SEQUENCE = struct.Struct("<Q")
+LENGTH = struct.Struct("<Q")
+HEADER_SIZE = SEQUENCE.size + LENGTH.size
+INDEX_LENGTH = struct.Struct("<I")
+
+# Bytes reserved per partition segment; pages are only backed once written
+DEFAULT_SIZE = 64 * 2 ** 20
+
+# Attempts before a reader gives up on a snapshot being rewritten under it
+READ_ATTEMPTS = 100
+
+
+class SnapshotTooLarge(Exception):
+    """A snapshot does not fit in its shared memory segment"""
+
+
+class SnapshotWriter:
+    """Worker side: attaches to a segment created by the API process"""
+
+    def __init__(self, name: str):
+        self._memory = shared_memory.SharedMemory(name=name)
+        self._sequence = SEQUENCE.unpack_from(self._memory.buf)[0]
+
+    def write(self, sections: Dict[str, bytes]) -> int:
+        index = {}
+        offset = 0
+        for name, data in sections.items():
+            index[name] = [offset, len(data)]
+            offset += len(data)
+        encoded_index = json.dumps(index).encode()
+        length = INDEX_LENGTH.size + len(encoded_index) + offset
+        buf = self._memory.buf
+        if HEADER_SIZE + length > len(buf):
+            raise SnapshotTooLarge(f"{length} bytes exceed the {len(buf) - HEADER_SIZE} byte segment")
+
+        self._sequence += 1
+        SEQUENCE.pack_into(buf, 0, self._sequence)
+        position = HEADER_SIZE
+        INDEX_LENGTH.pack_into(buf, position, len(encoded_index))
+        position += INDEX_LENGTH.size
+        buf[position:position + len(encoded_index)] = encoded_index
+        position += len(encoded_index)
+        for data in sections.values():
+            buf[position:position + len(data)] = data
+            position += len(data)
+        LENGTH.pack_into(buf, SEQUENCE.size, length)
+        self._sequence += 1
+        SEQUENCE.pack_into(buf, 0, self._sequence)
+        return length
+
+    def close(self) -> None:
+        self._memory.close()
+
+
+class SnapshotReader:
+    """API side: owns the segment and reads consistent copies of sections"""
+
+    def __init__(self, size: int = DEFAULT_SIZE):
+        self._memory = shared_memory.SharedMemory(create=True, size=size)
+        self._memory.buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+    def reset(self) -> None:
+        """Empty the segment, e.g. after its writer died midway through a write"""
+        self._memory.buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+
+    def read(self, names: Optional[Iterable[str]] = None, prefix: Optional[str] = None) -> Dict[str, bytes]:
+        """Copy the named sections (or those starting with prefix, or all) of the latest snapshot"""
+        buf = self._memory.buf
+        for _ in range(READ_ATTEMPTS):
+            sequence = SEQUENCE.unpack_from(buf)[0]
+            if sequence % 2:
+                time.sleep(0)
+                continue
+            length = LENGTH.unpack_from(buf, SEQUENCE.size)[0]
+            if length == 0:
+                return {}
+            try:
+                position = HEADER_SIZE
+                index_length = INDEX_LENGTH.unpack_from(buf, position)[0]
+                position += INDEX_LENGTH.size
+                index = json.loads(bytes(buf[position:position + index_length]))
+                body = position + index_length
+                wanted = index if names is None else [name for name in names if name in index]
+                sections = {
+                    name: bytes(buf[body + index[name][0]:body + index[name][0] + index[name][1]])
+                    for name in wanted if prefix is None or name.startswith(prefix)
+                }
+            except (ValueError, KeyError, TypeError, IndexError, struct.error):
+                # Read while the writer was midway; the sequence check below would reject it anyway
+                continue
+            if SEQUENCE.unpack_from(buf)[0] == sequence:
+                return sections
+        raise TimeoutError("snapshot kept changing while being read")
+
+    def close(self) -> None:
+        self._memory.close()
+        self._memory.unlink()
@@ -0,0 +1,227 @@
+"""
+What-If Simulation Engine
+This module replays a day of service on one route as a discrete-event
+simulation and measures OTP, delay and occupancy under a proposed change
+
+A route profile is plain data (so it can be sent to worker processes):
+
+    {
+        "route": "Route 12",
+        "stops": ["Benz Circle", "Governorpet", "MG Road"],
+        "segment_minutes": [6.5, 4.0],        # nominal running time between stops
+        "demand": [[960, 990, 120], ...],     # [start minute, end minute, boardings per hour]
+        "headway_minutes": 15,
+        "capacity": 60,
+        "service_start": 300,                 # minutes after midnight
+        "service_end": 1380
+    }
+
+A scenario adds buses and/or changes the headway inside an optional window:
+
+    {"add_buses": 1, "start": "17:00", "end": "19:00", "headway_minutes": 10}
+"""
+
+import heapq
+import math
+import random
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+# Stop arrivals within this many minutes of schedule count as on time
+ON_TIME_MINUTES = 5.0
+
+# Dwell model: fixed door time plus per-passenger boarding/alighting (seconds)
+DWELL_BASE_SECONDS = 10.0
+DWELL_PER_PASSENGER_SECONDS = 2.0
+
+# Nominal dwell assumed by the timetable (seconds)
+SCHEDULED_DWELL_SECONDS = 20.0
+
+# Terminal layover between directions (minutes)
+LAYOVER_MINUTES = 5.0
+
+# Shortest headway a profile or scenario may ask for (minutes)
+MIN_HEADWAY_MINUTES = 1.0
+
+# Travel time multiplier by hour of day (peaks are slower)
+CONGESTION = {7: 1.2, 8: 1.35, 9: 1.2, 17: 1.3, 18: 1.4, 19: 1.2}
+
+# Log-normal spread of segment running times
+TRAVEL_TIME_SIGMA = 0.15
+
+
+def parse_clock(value: Optional[str], default: float) -> float:
+    """Convert HH:MM to minutes after midnight"""
+    if not value:
+        return default
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def demand_rate(profile: Dict[str, Any], minute: float) -> float:
+    """Route-wide boardings per minute at a time of day"""
+    for start, end, per_hour in profile["demand"]:
+        if start <= minute < end:
+            return per_hour / 60.0
+    return profile.get("base_demand_per_hour", 30) / 60.0
+
+
+def departure_times(profile: Dict[str, Any], scenario: Dict[str, Any]) -> List[float]:
+    """Terminal departures for the day under a scenario"""
+    service_start = profile.get("service_start", 300)
+    service_end = profile.get("service_end", 1380)
+    window_start = parse_clock(scenario.get("start"), service_start)
+    window_end = parse_clock(scenario.get("end"), service_end)
+
+    base_headway = profile["headway_minutes"]
+    window_headway = scenario.get("headway_minutes") or base_headway
+    add_buses = scenario.get("add_buses", 0)
+    # The API validates scenarios; this only keeps the loop below finite for any caller
+    if base_headway < MIN_HEADWAY_MINUTES or window_headway < MIN_HEADWAY_MINUTES or add_buses < 0:
+        raise ValueError(f"headways must be at least {MIN_HEADWAY_MINUTES} minute and add_buses not negative")
+    if add_buses:
+        # Extra vehicles on the same cycle shorten the headway proportionally
+        cycle = 2 * (sum(profile["segment_minutes"]) + LAYOVER_MINUTES)
+        fleet = max(1, math.ceil(cycle / window_headway))
+        window_headway = window_headway * fleet / (fleet + add_buses)
+
+    departures = []
+    minute = float(service_start)
+    while minute < service_end:
+        departures.append(minute)
+        minute += window_headway if window_start <= minute < window_end else base_headway
+    return departures
+
+
+def passenger_arrivals(profile: Dict[str, Any], stop: int, stop_count: int, seed: int) -> List[float]:
+    """Arrival minutes of passengers at a stop over the service day
+
+    Drawn from the seed alone, so baseline and scenario runs see exactly the
+    same passengers (common random numbers) and differences come from the change.
+    """
+    rng = random.Random(f"{seed}:arrivals:{stop}")
+    share = 1.0 / max(1, stop_count - 1)
+    peak = max([per_hour for _, _, per_hour in profile["demand"]] +
+               [profile.get("base_demand_per_hour", 30)]) / 60.0 * share
+    arrivals = []
+    minute = float(profile.get("service_start", 300)) - profile["headway_minutes"]
+    end = profile.get("service_end", 1380)
+    # Thinning: draw at the peak rate, keep in proportion to the rate at that time
+    while peak > 0:
+        minute += rng.expovariate(peak)
+        if minute >= end:
+            break
+        if rng.random() * peak <= demand_rate(profile, minute) * share:
+            arrivals.append(minute)
+    return arrivals
+
+
+def running_time(segment_minutes: float, stop: int, minute: float, seed: int) -> float:
+    """Running time for a segment, with noise fixed per stop and five-minute slot"""
+    rng = random.Random(f"{seed}:travel:{stop}:{int(minute // 5)}")
+    congestion = CONGESTION.get(int(minute // 60) % 24, 1.0)
+    return segment_minutes * congestion * rng.lognormvariate(0, TRAVEL_TIME_SIGMA)
+
+
+def simulate(profile: Dict[str, Any], scenario: Dict[str, Any], seed: int = 7) -> Dict[str, float]:
+    """Run one simulated service day and return KPIs over the scenario window"""
+    stops = profile["stops"]
+    segments = profile["segment_minutes"]
+    capacity = profile["capacity"]
+    stop_count = len(stops)
+    # The API only simulates routes with stops; this keeps the trip model defined for any caller
+    if stop_count < 2 or len(segments) != stop_count - 1:
+        raise ValueError("a route needs at least 2 stops and a running time between each pair")
+    window_start = parse_clock(scenario.get("start"), profile.get("service_start", 300))
+    window_end = parse_clock(scenario.get("end"), profile.get("service_end", 1380))
+
+    # Event queue of (minute, sequence, trip, stop index)
+    events: List[Tuple[float, int, int, int]] = []
+    trips = []
+    for trip, departure in enumerate(departure_times(profile, scenario)):
+        scheduled = [departure]
+        for segment in segments:
+            scheduled.append(scheduled[-1] + segment + SCHEDULED_DWELL_SECONDS / 60)
+        trips.append({"load": 0, "scheduled": scheduled})
+        heapq.heappush(events, (departure, trip, trip, 0))
+
+    # Passengers per stop, boarded first come first served
+    arrivals = [passenger_arrivals(profile, stop, stop_count, seed) for stop in range(stop_count - 1)]
+    next_arrival = [0] * len(arrivals)
+    queues: List[deque] = [deque() for _ in arrivals]
+
+    delays: List[float] = []
+    occupancies: List[float] = []
+    waits: List[float] = []
+    left_behind = 0
+    sequence = len(trips)
+
+    while events:
+        minute, _, trip, stop = heapq.heappop(events)
+        state = trips[trip]
+        remaining_stops = stop_count - 1 - stop
+
+        # Alight a share of the load, then board up to capacity
+        alighting = state["load"] if remaining_stops == 0 else round(state["load"] / (remaining_stops + 1))
+        state["load"] -= alighting
+        boarding = 0
+        if remaining_stops:
+            stop_arrivals = arrivals[stop]
+            queue = queues[stop]
+            index = next_arrival[stop]
+            while index < len(stop_arrivals) and stop_arrivals[index] <= minute:
+                queue.append(stop_arrivals[index])
+                index += 1
+            next_arrival[stop] = index
+            while queue and state["load"] < capacity:
+                arrived = queue.popleft()
+                state["load"] += 1
+                boarding += 1
+                if window_start <= arrived < window_end:
+                    waits.append(minute - arrived)
+        dwell = (DWELL_BASE_SECONDS + DWELL_PER_PASSENGER_SECONDS * (boarding + alighting)) / 60
+
+        if window_start <= minute < window_end:
+            delays.append(minute - state["scheduled"][stop])
+            if remaining_stops:
+                occupancies.append(state["load"] / capacity * 100)
+                left_behind += len(queues[stop])
+
+        if remaining_stops:
+            sequence += 1
+            arrival = minute + dwell + running_time(segments[stop], stop, minute, seed)
+            heapq.heappush(events, (arrival, sequence, trip, stop + 1))
+
+    on_time = sum(1 for delay in delays if delay <= ON_TIME_MINUTES)
+    return {
+        "otp": round(on_time / len(delays) * 100, 1) if delays else 100.0,
+        "delay": round(sum(max(0.0, d) for d in delays) / len(delays), 2) if delays else 0.0,
+        "occupancy": round(sum(occupancies) / len(occupancies), 1) if occupancies else 0.0,
+        "avg_wait": round(sum(waits) / len(waits), 2) if waits else 0.0,
+        "left_behind": left_behind,
+        "trips": len(trips)
+    }
+
+
+def compare(profile: Dict[str, Any], scenario: Dict[str, Any], replications: int = 5) -> Dict[str, Any]:
+    """Simulate baseline and scenario with common random numbers and report the KPI impact"""
+    window = {key: scenario[key] for key in ("start", "end") if key in scenario}
+    baseline_runs = [simulate(profile, window, seed) for seed in range(replications)]
+    scenario_runs = [simulate(profile, scenario, seed) for seed in range(replications)]
+    baseline = _mean_metrics(baseline_runs)
+    projected = _mean_metrics(scenario_runs)
+    return {
+        "route": profile["route"],
+        "scenario": scenario,
+        "baseline": baseline,
+        "projected": projected,
+        "kpi_impact": {
+            "otp": f"{projected['otp'] - baseline['otp']:+.1f}%",
+            "delay": f"{projected['delay'] - baseline['delay']:+.1f} min",
+            "occupancy": f"{projected['occupancy'] - baseline['occupancy']:+.1f}%"
+        }
+    }
+
+
+def _mean_metrics(runs: List[Dict[str, float]]) -> Dict[str, float]:
+    return {key: round(sum(run[key] for run in runs) / len(runs), 2) for key in runs[0]}
@@ -0,0 +1,87 @@
+"""
+Simulation Runner
+This module runs what-if simulations in a process pool and caches results
+keyed on (route, scenario, data version) so repeated comparisons are free
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional, Tuple
+
+from simulation.engine import compare
+
+# Completed results kept in memory
+CACHE_SIZE = 512
+
+
+def data_version(profile: Dict[str, Any]) -> str:
+    """Fingerprint of the demand and travel-time inputs behind a profile"""
+    return hashlib.sha1(json.dumps(profile, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def scenario_key(scenario: Dict[str, Any]) -> str:
+    return json.dumps(scenario, sort_keys=True)
+
+
+def _copy(result: Dict[str, Any], version: str) -> Dict[str, Any]:
+    """A caller's copy of a shared result, stamped with the data version it came from"""
+    result = copy.deepcopy(result)
+    result["data_version"] = version
+    return result
+
+
+class SimulationRunner:
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._cache: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+        self._pending: Dict[Tuple[str, str, str], asyncio.Future] = {}
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # Started on first use so workers that never simulate pay nothing; spawned
+        # rather than forked from a process running an event loop and driver threads
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=get_context("spawn"))
+        return self._pool
+
+    async def run(self, profile: Dict[str, Any], scenario: Dict[str, Any]) -> Dict[str, Any]:
+        """Simulate one scenario, reusing cached or in-flight results; every caller gets its own copy"""
+        key = (profile["route"], scenario_key(scenario), data_version(profile))
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return _copy(cached, key[2])
+        pending = self._pending.get(key)
+        if pending is not None:
+            return _copy(await asyncio.shield(pending), key[2])
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor(), compare, profile, scenario)
+        self._pending[key] = future
+        try:
+            result = await asyncio.shield(future)
+        finally:
+            self._pending.pop(key, None)
+        self._cache[key] = result
+        if len(self._cache) > CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return _copy(result, key[2])
+
+    async def run_many(self, profile: Dict[str, Any], scenarios: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Simulate several scenarios for a route in parallel"""
+        return await asyncio.gather(*(self.run(profile, scenario) for scenario in scenarios))
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Shared runner used by the API routes
+simulation_runner = SimulationRunner()
@@ -0,0 +1,204 @@
+"""
+Telemetry Log Format
+This module defines the fixed-width binary log used to record and replay the
+live bus update stream
+
+A log is a 16-byte header followed by 64-byte records in timestamp order:
+
+    timestamp  f64   seconds since the epoch
+    bus_id     16s   UTF-8, NUL padded
+    route      16s   UTF-8, NUL padded
+    lat, lng   f64
+    speed      f32
+    direction  i16
+    occupancy  u8
+    status     u8    index into STATUSES
+
+IDs and routes longer than 16 bytes are cut at the last whole UTF-8
+character that fits. Directions are wrapped to 0-359 degrees and occupancy
+is clamped to 0-255; a bus whose fields still cannot be packed is logged
+and left out of its tick.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+MAGIC = b"APTL"
+VERSION = 1
+HEADER = struct.Struct("<4sHH8x")
+RECORD = struct.Struct("<d16s16sddfhBB")
+
+STATUSES = ["active", "delayed", "emergency", "inactive"]
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+logger = logging.getLogger(__name__)
+
+
+def _fixed(text: str) -> bytes:
+    """UTF-8 for a 16-byte field, cut on a character boundary"""
+    encoded = text.encode()
+    if len(encoded) <= 16:
+        return encoded
+    return encoded[:16].decode(errors="ignore").encode()
+
+
+def _encode(bus: Dict[str, Any], timestamp: float) -> bytes:
+    """One record for a bus message, with direction and occupancy brought into their field ranges"""
+    return RECORD.pack(
+        timestamp,
+        _fixed(bus["bus_id"]),
+        _fixed(bus["route"]),
+        bus["location"]["lat"],
+        bus["location"]["lng"],
+        bus["speed"],
+        int(bus["direction"]) % 360,
+        max(0, min(255, int(bus["occupancy"]))),
+        STATUS_CODES.get(bus["status"], 0)
+    )
+
+
+class TelemetryRecorder:
+    """Append-only writer for bus update ticks; safe to call from a worker thread"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "ab")
+        try:
+            self._prepare_for_append()
+        except BaseException:
+            self._file.close()
+            raise
+        self._lock = threading.Lock()
+        self.records = 0
+
+    def _prepare_for_append(self) -> None:
+        """Write the header of a new log, or check an existing one and cut a torn trailing record"""
+        size = os.fstat(self._file.fileno()).st_size
+        if size < HEADER.size:
+            # New, or the header itself was torn: nothing recorded yet
+            self._file.truncate(0)
+            self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            self._file.flush()
+            return
+        with open(self.path, "rb") as existing:
+            magic, version, record_size = HEADER.unpack(existing.read(HEADER.size))
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError(f"{self.path} is not a version {VERSION} telemetry log; not appending to it")
+        # Appending after a partial record would misalign every record that follows
+        whole = HEADER.size + (size - HEADER.size) // RECORD.size * RECORD.size
+        if whole != size:
+            self._file.truncate(whole)
+
+    def record_tick(self, buses: List[Dict[str, Any]], timestamp: Optional[float] = None) -> None:
+        """Append one record per bus, all stamped with the tick time"""
+        if timestamp is None:
+            timestamp = time.time()
+        records = []
+        for bus in buses:
+            try:
+                records.append(_encode(bus, timestamp))
+            except (KeyError, TypeError, ValueError, OverflowError, struct.error) as e:
+                # One malformed bus must not stop the recording of the rest
+                logger.warning(f"Telemetry record for bus {bus.get('bus_id')!r} skipped: {e!r}")
+        data = b"".join(records)
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(data)
+            self._file.flush()
+            self.records += len(records)
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class _Timestamps:
+    """Sequence view over record timestamps so bisect can search the mapping"""
+
+    def __init__(self, log: "TelemetryLog"):
+        self._log = log
+
+    def __len__(self) -> int:
+        return len(self._log)
+
+    def __getitem__(self, index: int) -> float:
+        return self._log.timestamp(index)
+
+
+class TelemetryLog:
+    """Read-only, memory-mapped view of a telemetry log"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._timestamps = _Timestamps(self)
+        self._map: Optional[mmap.mmap] = None
+        self._count = 0
+        # Empty, or the recorder stopped before its header reached the disk: no records
+        if os.fstat(self._file.fileno()).st_size < HEADER.size:
+            return
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.close()
+            raise ValueError(f"{path} is not a version {VERSION} telemetry log")
+        # A torn trailing record from a crash mid-write is ignored
+        self._count = (len(self._map) - HEADER.size) // RECORD.size
+
+    def __len__(self) -> int:
+        return self._count
+
+    def timestamp(self, index: int) -> float:
+        return struct.unpack_from("<d", self._map, HEADER.size + index * RECORD.size)[0]
+
+    def record(self, index: int) -> Dict[str, Any]:
+        """Decode one record into the bus update shape used by the feed"""
+        (timestamp, bus_id, route, lat, lng, speed, direction, occupancy,
+         status) = RECORD.unpack_from(self._map, HEADER.size + index * RECORD.size)
+        return {
+            "bus_id": bus_id.rstrip(b"\0").decode(),
+            "route": route.rstrip(b"\0").decode(),
+            "location": {"lat": lat, "lng": lng},
+            "status": STATUSES[status] if status < len(STATUSES) else "active",
+            "occupancy": occupancy,
+            "speed": speed,
+            "direction": direction,
+            "last_update": datetime.utcfromtimestamp(timestamp).isoformat()
+        }
+
+    @property
+    def start(self) -> Optional[float]:
+        return self.timestamp(0) if self._count else None
+
+    @property
+    def end(self) -> Optional[float]:
+        return self.timestamp(self._count - 1) if self._count else None
+
+    def seek(self, timestamp: float) -> int:
+        """Index of the first record at or after timestamp, in O(log n)"""
+        return bisect_left(self._timestamps, timestamp)
+
+    def ticks(self, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[tuple]:
+        """Yield (timestamp, [records]) for each recorded tick in a time range"""
+        index = self.seek(start) if start is not None else 0
+        stop = self.seek(end) if end is not None else self._count
+        while index < stop:
+            timestamp = self.timestamp(index)
+            tick_end = index
+            while tick_end < stop and self.timestamp(tick_end) == timestamp:
+                tick_end += 1
+            yield timestamp, [self.record(i) for i in range(index, tick_end)]
+            index = tick_end
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
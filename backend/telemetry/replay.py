@@ -0,0 +1,78 @@
+"""
+Telemetry Replay
+This module drives the WebSocket feed from a recorded telemetry log at a
+chosen speed
+
+Usage (from the backend directory):
+    python -m telemetry.replay peak_hour.aptl --speed 10
+    python -m telemetry.replay peak_hour.aptl --start 2025-10-15T17:00:00 --speed 60
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from telemetry.log import TelemetryLog
+
+# Replay speed multipliers accepted
+MIN_SPEED = 1.0
+MAX_SPEED = 100.0
+
+
+class Replayer:
+    def __init__(self, log: TelemetryLog, speed: float = 1.0,
+                 start: Optional[float] = None, end: Optional[float] = None):
+        if not MIN_SPEED <= speed <= MAX_SPEED:
+            raise ValueError(f"speed must be between {MIN_SPEED:g} and {MAX_SPEED:g}")
+        self.log = log
+        self.speed = speed
+        self.start = start
+        self.end = end
+
+    async def play(self) -> AsyncIterator[Tuple[float, List[Dict]]]:
+        """Yield recorded ticks paced by their original spacing divided by speed"""
+        wall_start = time.monotonic()
+        log_start = None
+        for timestamp, updates in self.log.ticks(self.start, self.end):
+            if log_start is None:
+                log_start = timestamp
+            # Pace against the first tick so sleep jitter does not accumulate
+            delay = (timestamp - log_start) / self.speed - (time.monotonic() - wall_start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield timestamp, updates
+
+
+def _parse_time(value: Optional[str]) -> Optional[float]:
+    """Parse an ISO timestamp, treating naive times as UTC like the feed does"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def main():
+    from websocket import server as ws_server
+
+    parser = argparse.ArgumentParser(description="Replay a telemetry log through the WebSocket feed")
+    parser.add_argument("path", help="telemetry log to replay")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier (1-100)")
+    parser.add_argument("--start", help="ISO timestamp to start from")
+    parser.add_argument("--end", help="ISO timestamp to stop at")
+    args = parser.parse_args()
+
+    log = TelemetryLog(args.path)
+    try:
+        replayer = Replayer(log, args.speed, _parse_time(args.start), _parse_time(args.end))
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Replaying {len(log)} records from {args.path} at {args.speed}x")
+    asyncio.run(ws_server.serve_forever(replayer))
+
+
+if __name__ == "__main__":
+    main()
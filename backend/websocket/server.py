@@ -5,119 +5,294 @@ This module handles real-time updates for the APSRTC Admin Dashboard
 
 import asyncio
 import json
+import os
 import websockets
-import threading
 import time
 from datetime import datetime
 import random
-from typing import Dict, Set
+from typing import Dict, List, Optional, Set
+from urllib.parse import parse_qs, urlsplit
+
+from metrics.registry import REGISTRY, DEPTH_BUCKETS
+from metrics.exposition import start_metrics_server
+from profiling.slow import slow_operations
+from telemetry.log import TelemetryRecorder
+from fleet.eta import build_engine
+from fleet.geofence import build_geofencer
+from api.routes import routes_data, stops_data
+from changefeed.feed import (MAX_RETRY_SECONDS, RETRY_SECONDS, ChangeBuffer, HttpChangeFeed, LocalChangeFeed,
+                             MongoChangeFeed, ResumeTokenExpired)
+from checkpoint.store import Checkpointer
+from fleet.state import BusState, FleetState
 
 # Store connected clients
 connected_clients: Set[websockets.WebSocketServerProtocol] = set()
 
-# Mock data that would be updated from actual GPS feeds
-mock_bus_data = [
-    {
-        "bus_id": "APSRTC001",
-        "route": "Route 12",
-        "location": {"lat": 16.5062, "lng": 80.6480},
-        "status": "active",
-        "occupancy": 67,
-        "speed": 25.0,
-        "direction": 45,
-        "last_update": datetime.utcnow().isoformat()
-    },
-    {
-        "bus_id": "APSRTC002",
-        "route": "Route 15",
-        "location": {"lat": 16.5119, "lng": 80.6332},
-        "status": "delayed",
-        "occupancy": 85,
-        "speed": 15.0,
-        "direction": 120,
-        "last_update": datetime.utcnow().isoformat()
+# Outbound frame queue per client; a slow client drops its oldest frames
+# instead of stalling the broadcast for everyone else
+client_queues: Dict[websockets.WebSocketServerProtocol, asyncio.Queue] = {}
+CLIENT_QUEUE_SIZE = 8
+
+# Seconds between feed ticks
+TICK_INTERVAL = 2.0
+
+# Records every published tick when TELEMETRY_RECORD is set
+telemetry_recorder: Optional[TelemetryRecorder] = None
+
+# Route geometry for live ETAs, precomputed once
+eta_engine = build_engine(routes_data, stops_data)
+
+# Stop geofences for arrival/departure events
+geofencer = build_geofencer(stops_data)
+
+# Collection writes pushed to clients; serve_forever follows the API's writes,
+# or Mongo change streams when CHANGE_STREAMS is set
+change_feed = LocalChangeFeed()
+
+# Recent change events, so reconnecting clients resume instead of reloading a snapshot
+recent_changes = ChangeBuffer()
+
+# Feed metrics
+ws_connected_clients = REGISTRY.gauge("ws_connected_clients", "Connected WebSocket clients")
+ws_tick_duration = REGISTRY.histogram("ws_tick_duration_seconds", "Time to compute and enqueue one feed tick")
+ws_fanout_lag = REGISTRY.histogram("ws_fanout_lag_seconds", "Delay between enqueueing a frame and sending it")
+ws_queue_depth = REGISTRY.histogram("ws_client_queue_depth", "Per-client queue depth at enqueue time",
+                                    buckets=DEPTH_BUCKETS)
+ws_dropped_frames = REGISTRY.counter("ws_dropped_frames_total", "Frames dropped for slow clients")
+ws_frame_bytes = REGISTRY.counter("ws_broadcast_bytes_total", "Bytes serialized for broadcast frames")
+ws_change_events = REGISTRY.counter("ws_change_events_total", "Change events pushed to clients", ["collection"])
+ws_resumes = REGISTRY.counter("ws_resumes_total", "Client reconnects by outcome", ["outcome"])
+
+# Mock data that would be updated from actual GPS feeds, held as compact
+# records and turned into dictionaries only when a frame is built
+live_buses = FleetState([
+    BusState(bus_id="APSRTC001", route="Route 12", lat=16.5062, lng=80.6480, status="active",
+             occupancy=67, speed=25.0, direction=45),
+    BusState(bus_id="APSRTC002", route="Route 15", lat=16.5119, lng=80.6332, status="delayed",
+             occupancy=85, speed=15.0, direction=120)
+])
+
+def snapshot_message() -> dict:
+    """Full fleet snapshot with the token of the latest change it includes"""
+    return {
+        "type": "initial_data",
+        "buses": live_buses.messages(),
+        "resume_token": recent_changes.last_token,
+        "timestamp": datetime.utcnow().isoformat()
     }
-]
 
-async def register_client(websocket: websockets.WebSocketServerProtocol):
+def resume_message(resume_token: Optional[str]) -> Optional[dict]:
+    """Changes a client missed since its last token, or None when it needs a full snapshot"""
+    if not resume_token:
+        return None
+    changes = recent_changes.since(resume_token)
+    if changes is None:
+        ws_resumes.labels("snapshot").inc()
+        return None
+    ws_resumes.labels("resumed").inc()
+    return {
+        "type": "resume",
+        "changes": changes,
+        "resume_token": recent_changes.last_token,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+def _resume_token(websocket, path: Optional[str]) -> Optional[str]:
+    """resume_token query parameter of the connection URL"""
+    path = path or getattr(getattr(websocket, "request", None), "path", None) or ""
+    return parse_qs(urlsplit(path).query).get("resume_token", [None])[0]
+
+# Fleet and recent changes saved across restarts; sockets reconnect and resume
+checkpointer = Checkpointer("feed_state.ckpt")
+checkpointer.register("buses", live_buses.dump, live_buses.restore)
+checkpointer.register("changes", lambda: recent_changes.dump(), lambda events: recent_changes.restore(events))
+
+async def register_client(websocket: websockets.WebSocketServerProtocol, resume_token: Optional[str] = None):
     """Register a new client connection"""
     connected_clients.add(websocket)
+    client_queues[websocket] = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+    ws_connected_clients.set(len(connected_clients))
     print(f"Client connected. Total clients: {len(connected_clients)}")
     
-    # Send initial data to the newly connected client
+    # Resume from the client's last change if we still have it, otherwise
+    # send initial data. Both are built before the next await, so changes
+    # broadcast from here on land in the client's queue exactly once.
+    message = resume_message(resume_token) or snapshot_message()
     try:
-        initial_data = {
-            "type": "initial_data",
-            "buses": mock_bus_data,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        await websocket.send(json.dumps(initial_data))
+        await websocket.send(json.dumps(message))
     except websockets.exceptions.ConnectionClosed:
         pass
 
 async def unregister_client(websocket: websockets.WebSocketServerProtocol):
     """Unregister a client connection"""
     connected_clients.discard(websocket)
+    client_queues.pop(websocket, None)
+    ws_connected_clients.set(len(connected_clients))
     print(f"Client disconnected. Total clients: {len(connected_clients)}")
 
 async def broadcast_data(data: dict):
     """Broadcast data to all connected clients"""
     if connected_clients:
         message = json.dumps(data)
-        # Create a copy of the set to avoid modification during iteration
-        clients_copy = connected_clients.copy()
-        for client in clients_copy:
-            try:
-                await client.send(message)
-            except websockets.exceptions.ConnectionClosed:
-                await unregister_client(client)
-
-async def handle_client(websocket: websockets.WebSocketServerProtocol, path: str):
+        ws_frame_bytes.inc(len(message))
+        enqueued_at = time.perf_counter()
+        # Create a copy of the dict to avoid modification during iteration
+        for queue in list(client_queues.values()):
+            ws_queue_depth.observe(queue.qsize())
+            if queue.full():
+                queue.get_nowait()
+                ws_dropped_frames.inc()
+            queue.put_nowait((enqueued_at, message))
+
+async def send_queued(websocket: websockets.WebSocketServerProtocol, queue: asyncio.Queue):
+    """Drain a client's queue onto its socket"""
+    try:
+        while True:
+            enqueued_at, message = await queue.get()
+            await websocket.send(message)
+            ws_fanout_lag.observe(time.perf_counter() - enqueued_at)
+    except websockets.exceptions.ConnectionClosed:
+        pass
+
+async def handle_client(websocket: websockets.WebSocketServerProtocol, path: str = None):
     """Handle individual client connections"""
-    await register_client(websocket)
+    await register_client(websocket, _resume_token(websocket, path))
+    sender = asyncio.create_task(send_queued(websocket, client_queues[websocket]))
     try:
         async for message in websocket:
             # Handle incoming messages from clients if needed
             data = json.loads(message)
+            if data.get("type") == "resume":
+                reply = resume_message(data.get("resume_token")) or snapshot_message()
+                await websocket.send(json.dumps(reply))
+                continue
             print(f"Received from client: {data}")
     except websockets.exceptions.ConnectionClosed:
         pass
     finally:
+        sender.cancel()
         await unregister_client(websocket)
 
-def update_mock_data():
-    """Update mock data periodically to simulate real-time updates"""
-    while True:
-        # Update bus locations and statuses
-        for bus in mock_bus_data:
-            # Simulate movement
-            bus["location"]["lat"] += random.uniform(-0.0001, 0.0001)
-            bus["location"]["lng"] += random.uniform(-0.0001, 0.0001)
-            
-            # Simulate changing occupancy
-            bus["occupancy"] = max(0, min(100, bus["occupancy"] + random.randint(-5, 5)))
-            
-            # Simulate changing speed
-            bus["speed"] = max(0, bus["speed"] + random.uniform(-2, 2))
-            
-            # Update timestamp
-            bus["last_update"] = datetime.utcnow().isoformat()
+def step_mock_data():
+    """Advance the mock fleet by one tick"""
+    now = time.time()
+    # Update bus locations and statuses
+    for bus in live_buses:
+        # Simulate movement
+        bus.lat += random.uniform(-0.0001, 0.0001)
+        bus.lng += random.uniform(-0.0001, 0.0001)
         
-        # Prepare update message
-        update_message = {
-            "type": "bus_updates",
-            "buses": mock_bus_data,
-            "timestamp": datetime.utcnow().isoformat()
-        }
+        # Simulate changing occupancy
+        bus.occupancy = max(0, min(100, bus.occupancy + random.randint(-5, 5)))
         
-        # Broadcast in a separate thread to avoid blocking
-        asyncio.run_coroutine_threadsafe(
-            broadcast_data(update_message),
-            asyncio.get_event_loop()
-        )
+        # Simulate changing speed
+        bus.speed = max(0, bus.speed + random.uniform(-2, 2))
+        
+        # Update timestamp
+        bus.updated_at = now
+
+def apply_bus_updates(updates: List[dict]):
+    """Merge bus updates from an external feed into the live fleet"""
+    for update in updates:
+        live_buses.apply(update)
+
+def fleet_message(timestamp: Optional[float] = None) -> dict:
+    """Bus update message for the current state of the live fleet"""
+    tick_time = datetime.utcfromtimestamp(timestamp) if timestamp is not None else datetime.utcnow()
+    return {
+        "type": "bus_updates",
+        "buses": live_buses.messages(),
+        "timestamp": tick_time.isoformat()
+    }
+
+def update_etas(now: float) -> dict:
+    """Refresh next stop, distance and ETA of every bus at a tick time; returns upcoming arrivals per stop"""
+    results = eta_engine.update((bus.bus_id, bus.route, bus.lat, bus.lng, now) for bus in live_buses)
+    for bus in live_buses:
+        result = results.get(bus.bus_id)
+        if result is not None:
+            bus.next_stop = result["next_stop"]
+            bus.distance_to_next_stop = result["distance_to_next_stop"]
+            bus.eta_seconds = result["eta_seconds"]
+    return {stop_id: arrivals[:3] for stop_id, arrivals in eta_engine.stop_etas.items()}
+
+def stop_events(now: float) -> List[dict]:
+    """The tick's stop arrival and departure events"""
+    return geofencer.process((bus.bus_id, bus.route, bus.driver, bus.lat, bus.lng, now) for bus in live_buses)
+
+async def publish_tick(timestamp: Optional[float] = None):
+    """Compute, record and broadcast one tick of bus updates; timestamp is the recorded tick time in replays"""
+    started = time.perf_counter()
+    now = time.time() if timestamp is None else timestamp
+    with slow_operations.track("tick"):
+        stop_etas = update_etas(now)
+        events = stop_events(now)
+        update_message = fleet_message(now)
+        update_message["stop_etas"] = stop_etas
+        update_message["stop_events"] = events
+        await broadcast_data(update_message)
+    ws_tick_duration.observe(time.perf_counter() - started)
+    if telemetry_recorder is not None:
+        # Written and flushed off the event loop; ticks are published one at a time, so in order
+        await asyncio.to_thread(telemetry_recorder.record_tick, update_message["buses"], now)
+
+def apply_bus_change(event: dict):
+    """Merge a change to the buses collection into the live fleet"""
+    if event["event"] == "bus_removed":
+        live_buses.remove(event["id"])
+        eta_engine.forget([event["id"]])
+        geofencer.forget([event["id"]])
+        return
+    document = event.get("document")
+    if document is not None:
+        live_buses.apply(document)
+        return
+    bus = live_buses.get(event["id"])
+    if bus is not None:
+        for path, value in event.get("updated_fields", {}).items():
+            bus.set(path, value)
+        for path in event.get("removed_fields", []):
+            bus.clear(path)
+
+async def forward_changes(feed):
+    """Push collection writes to clients as they happen, resuming after the last one seen"""
+    global recent_changes
+    delay = RETRY_SECONDS
+    while True:
+        try:
+            async for event in feed.watch(resume_after=recent_changes.last_token):
+                if event["collection"] == "buses":
+                    apply_bus_change(event)
+                recent_changes.append(event)
+                ws_change_events.labels(event["collection"]).inc()
+                await broadcast_data(event)
+                delay = RETRY_SECONDS
+            return
+        except ResumeTokenExpired:
+            # Clients holding older tokens now fall back to a snapshot
+            print("Change feed history lost, continuing from the current position")
+            recent_changes = ChangeBuffer()
+        except Exception as e:
+            # Any other failure (e.g. a change stream OperationFailure): resume after the last event later
+            print(f"Change feed failed, retrying in {delay:.0f}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_SECONDS)
+
+async def update_mock_data():
+    """Update mock data periodically to simulate real-time updates"""
+    while True:
+        step_mock_data()
+        await publish_tick()
         
         # Wait before next update
-        time.sleep(2)  # Update every 2 seconds
+        await asyncio.sleep(TICK_INTERVAL)
+
+async def replay_telemetry(replayer):
+    """Drive the feed from a recorded telemetry log instead of the mock data"""
+    async for timestamp, updates in replayer.play():
+        apply_bus_updates(updates)
+        await publish_tick(timestamp)
+    print("Telemetry replay finished")
 
 async def start_websocket_server():
     """Start the WebSocket server"""
@@ -125,14 +300,50 @@ async def start_websocket_server():
     print("WebSocket server started on ws://localhost:8765")
     return server
 
+async def serve_forever(replayer=None):
+    """Run the WebSocket server, the metrics endpoint, the change feed and the update loop"""
+    global telemetry_recorder, change_feed
+    if os.environ.get('SLOW_TICK_MS'):
+        slow_operations.enable(float(os.environ['SLOW_TICK_MS']))
+    if os.environ.get('TELEMETRY_RECORD'):
+        telemetry_recorder = TelemetryRecorder(os.environ['TELEMETRY_RECORD'])
+        print(f"Recording telemetry to {os.environ['TELEMETRY_RECORD']}")
+    mongo_client = None
+    if os.environ.get('CHANGE_STREAMS'):
+        from motor.motor_asyncio import AsyncIOMotorClient
+        mongo_client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        change_feed = MongoChangeFeed(mongo_client[os.environ['DB_NAME']])
+        print("Pushing MongoDB change streams to clients")
+    else:
+        change_feed = HttpChangeFeed(os.environ.get('API_CHANGES_URL', 'http://localhost:8000/api/changes'))
+        print(f"Pushing API writes from {change_feed.url} to clients")
+    restored = checkpointer.restore()
+    if restored:
+        print(f"Restored {', '.join(restored)} from checkpoint")
+    server = await start_websocket_server()
+    metrics_port = int(os.environ.get('WS_METRICS_PORT', 9108))
+    metrics_server = await start_metrics_server(port=metrics_port)
+    print(f"Metrics available on http://localhost:{metrics_port}/metrics")
+    changes_task = asyncio.create_task(forward_changes(change_feed))
+    checkpointer.start()
+    try:
+        if replayer is not None:
+            await replay_telemetry(replayer)
+        else:
+            await update_mock_data()
+    finally:
+        changes_task.cancel()
+        await checkpointer.stop()
+        if mongo_client is not None:
+            mongo_client.close()
+        if telemetry_recorder is not None:
+            telemetry_recorder.close()
+        metrics_server.close()
+        server.close()
+
 def run_websocket_server():
-    """Run the WebSocket server in a separate thread"""
-    # Start the data update thread
-    update_thread = threading.Thread(target=update_mock_data, daemon=True)
-    update_thread.start()
-    
-    # Run the WebSocket server
-    asyncio.run(start_websocket_server())
+    """Run the WebSocket server"""
+    asyncio.run(serve_forever())
 
 if __name__ == "__main__":
-    run_websocket_server()
\ No newline at end of file
+    run_websocket_server()
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# Backend modules import each other from the backend root, as the servers run them
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture(autouse=True)
+def checkpoint_dir(tmp_path, monkeypatch):
+    """Keep checkpoints written while testing out of the source tree"""
+    monkeypatch.setenv("CHECKPOINT_DIR", str(tmp_path))
+    monkeypatch.delenv("CHECKPOINT_INSTANCE", raising=False)
+    return tmp_path
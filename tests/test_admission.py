@@ -0,0 +1,143 @@
+import asyncio
+
+import httpx
+from starlette.middleware.cors import CORSMiddleware
+
+from admission.limits import ConcurrencyLimit
+from admission.middleware import AdmissionMiddleware, _client_key
+
+ORIGINS = ["http://dashboard-a.test", "http://dashboard-b.test", "http://dashboard-c.test"]
+
+
+class SlowRoute:
+    """ASGI app answering after a pause, so identical requests overlap and coalesce"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, scope, receive, send):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", b"2")]})
+        await send({"type": "http.response.body", "body": b"[]"})
+
+
+def request(scope_headers, client=("10.0.0.1", 5000)):
+    return {"type": "http", "path": "/api/buses", "client": client,
+            "headers": [(name.lower().encode(), value.encode()) for name, value in scope_headers.items()]}
+
+
+def test_coalesced_waiters_get_their_own_headers():
+    route = SlowRoute()
+    admission = AdmissionMiddleware(route, rate=1000, burst=1000)
+    app = CORSMiddleware(admission, allow_origins=ORIGINS)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(client.get("/api/buses", headers={"Origin": origin}) for origin in ORIGINS))
+
+    responses = asyncio.run(scenario())
+    assert route.calls == 1
+    for origin, response in zip(ORIGINS, responses):
+        assert response.status_code == 200
+        assert response.headers.get_list("access-control-allow-origin") == [origin]
+        assert response.headers["vary"] == "Origin"
+
+
+def test_rate_limit_keys_on_the_forwarded_admin_user():
+    proxy = ("10.0.0.1", 5000)
+    assert _client_key(request({"X-Admin-User": "ops"}, proxy), {"10.0.0.1"}) == "user:ops"
+    assert _client_key(request({}, proxy)) == "ip:10.0.0.1"
+    # Forwarded headers only count when the peer is a trusted proxy
+    assert _client_key(request({"X-Admin-User": "ops"}, proxy)) == "ip:10.0.0.1"
+    forwarded = request({"X-Forwarded-For": "203.0.113.7, 198.51.100.2"}, proxy)
+    assert _client_key(forwarded) == "ip:10.0.0.1"
+    assert _client_key(forwarded, {"10.0.0.1"}) == "ip:198.51.100.2"
+
+
+def test_users_behind_one_proxy_have_separate_buckets():
+    admission = AdmissionMiddleware(SlowRoute(), rate=0.001, burst=1, limits={}, trusted_proxies={"127.0.0.1"})
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=admission)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = await client.get("/api/alerts", headers={"X-Admin-User": "ops"})
+            again = await client.get("/api/alerts", headers={"X-Admin-User": "ops"})
+            other = await client.get("/api/alerts", headers={"X-Admin-User": "planner"})
+            return first.status_code, again.status_code, other.status_code
+
+    assert asyncio.run(scenario()) == (200, 429, 200)
+
+
+def test_untrusted_clients_cannot_pick_a_fresh_bucket():
+    admission = AdmissionMiddleware(SlowRoute(), rate=0.001, burst=1, limits={})
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=admission)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = await client.get("/api/alerts", headers={"X-Admin-User": "ops"})
+            other = await client.get("/api/alerts", headers={"X-Admin-User": "planner"})
+            return first.status_code, other.status_code
+
+    assert asyncio.run(scenario()) == (200, 429)
+
+
+def test_rate_limiting_is_off_unless_configured(monkeypatch, caplog):
+    monkeypatch.delenv("RATE_LIMIT_PER_SECOND", raising=False)
+    assert AdmissionMiddleware(SlowRoute()).rate_limiter is None
+    monkeypatch.setenv("RATE_LIMIT_PER_SECOND", "20")
+    with caplog.at_level("WARNING", logger="admission.middleware"):
+        assert AdmissionMiddleware(SlowRoute(), trusted_proxies=set()).rate_limiter is not None
+    assert "TRUSTED_PROXIES" in caplog.text
+
+
+def test_timed_out_waits_do_not_leak_slots():
+    async def scenario():
+        limit = ConcurrencyLimit(1, 10, 0.01)
+        assert await limit.acquire()
+        # Every waiter times out while the only slot is held
+        results = await asyncio.gather(*(limit.acquire() for _ in range(5)))
+        limit.release()
+        assert await limit.acquire()
+        limit.release()
+        return results, limit._semaphore._value, limit.waiting
+
+    assert asyncio.run(scenario()) == ([False] * 5, 1, 0)
+
+
+def test_slot_granted_as_the_wait_times_out_is_returned():
+    async def scenario():
+        limit = ConcurrencyLimit(1, 10, 0.05)
+        assert await limit.acquire()
+        waiter = asyncio.ensure_future(limit.acquire())
+        await asyncio.sleep(0.05)
+        # Released in the same loop iteration as the waiter's timeout
+        limit.release()
+        granted = await waiter
+        if granted:
+            limit.release()
+        await asyncio.sleep(0)
+        return limit._semaphore._value, limit.active
+
+    assert asyncio.run(scenario()) == (1, 0)
+
+
+def test_cancelled_wait_does_not_leak_its_slot():
+    async def scenario():
+        limit = ConcurrencyLimit(1, 10, 5.0)
+        assert await limit.acquire()
+        waiter = asyncio.ensure_future(limit.acquire())
+        await asyncio.sleep(0)
+        limit.release()
+        # Cancelled after the slot was handed to it but before it resumed
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        await asyncio.sleep(0)
+        return limit._semaphore._value, limit.waiting
+
+    assert asyncio.run(scenario()) == (1, 0)
@@ -0,0 +1,237 @@
+import asyncio
+import json
+
+import httpx
+from fastapi import FastAPI
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from api import routes
+from audit.writer import MAX_ATTEMPTS, AuditLogWriter, audit_log
+
+
+class FlakyCollection:
+    """Delegates to a mongomock collection, failing the next inserts on demand"""
+
+    def __init__(self, collection, failures=0, fail_after=None):
+        self.collection = collection
+        self.failures = failures
+        self.fail_after = fail_after
+        self.inserts = 0
+
+    async def insert_many(self, documents, ordered=True):
+        self.inserts += 1
+        if self.fail_after is not None and self.inserts > self.fail_after:
+            raise AutoReconnect("connection lost")
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect("connection refused")
+        return await self.collection.insert_many(documents, ordered=ordered)
+
+
+class SlowCollection:
+    """Delegates to a mongomock collection after a pause, so a write can be in flight"""
+
+    def __init__(self, collection, delay=0.05):
+        self.collection = collection
+        self.delay = delay
+        self.started = asyncio.Event()
+
+    async def insert_many(self, documents, ordered=True):
+        self.started.set()
+        await asyncio.sleep(self.delay)
+        return await self.collection.insert_many(documents, ordered=ordered)
+
+
+class RejectingCollection:
+    """Delegates to a mongomock collection, rejecting entries for one resource as invalid"""
+
+    def __init__(self, collection, rejected):
+        self.collection = collection
+        self.rejected = rejected
+
+    async def insert_many(self, documents, ordered=True):
+        accepted = [document for document in documents if document["resource"] != self.rejected]
+        if accepted:
+            await self.collection.insert_many(accepted, ordered=ordered)
+        errors = [{"index": i, "code": 121, "errmsg": "Document failed validation"}
+                  for i, document in enumerate(documents) if document["resource"] == self.rejected]
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+
+def new_collection():
+    return AsyncMongoMockClient()["test"]["audit_logs"]
+
+
+def record(writer, count):
+    for i in range(count):
+        writer.record("admin", "Viewed", f"bus {i}", "127.0.0.1")
+
+
+def test_failed_write_is_spilled_and_replayed(tmp_path):
+    async def scenario():
+        collection = new_collection()
+        writer = AuditLogWriter(FlakyCollection(collection, failures=1), batch_size=10,
+                                spill_path=str(tmp_path / "spill.ndjson"))
+        record(writer, 5)
+        assert await writer.flush() == 0
+        assert writer.stats()["spilled"] == 5
+        record(writer, 3)
+        assert await writer.flush() == 3
+        return collection, writer
+
+    collection, writer = asyncio.run(scenario())
+    assert asyncio.run(collection.count_documents({})) == 8
+    assert writer.stats() == {"buffered": 0, "written": 8, "spilled": 0, "dropped": 0, "dead_lettered": 0}
+    assert not list(tmp_path.iterdir())
+
+
+def test_partial_insert_does_not_duplicate_entries(tmp_path):
+    async def scenario():
+        collection = new_collection()
+        writer = AuditLogWriter(collection, batch_size=10, spill_path=str(tmp_path / "spill.ndjson"))
+        record(writer, 4)
+        batch = list(writer._buffer)
+        # Half the batch reached the database before the connection dropped
+        await collection.insert_many(batch[:2])
+        writer._spill(batch)
+        writer._buffer.clear()
+        record(writer, 1)
+        await writer.flush()
+        return await collection.count_documents({})
+
+    assert asyncio.run(scenario()) == 5
+
+
+def test_replay_streams_batches_and_keeps_the_rest_on_failure(tmp_path):
+    spill_path = tmp_path / "spill.ndjson"
+
+    async def scenario():
+        collection = new_collection()
+        flaky = FlakyCollection(collection)
+        writer = AuditLogWriter(flaky, batch_size=2, spill_path=str(spill_path))
+        record(writer, 7)
+        writer._spill(list(writer._buffer))
+        writer._buffer.clear()
+        # The first replayed batch is written, then the database goes away
+        flaky.fail_after = 1
+        record(writer, 1)
+        assert await writer.flush() == 0
+        stored = await collection.count_documents({})
+        flaky.fail_after = None
+        record(writer, 1)
+        await writer.flush()
+        return stored, await collection.count_documents({})
+
+    stored, total = asyncio.run(scenario())
+    assert stored == 2
+    assert total == 9
+    assert not spill_path.exists()
+
+
+def test_replay_assigns_ids_to_old_spill_entries(tmp_path):
+    spill_path = tmp_path / "spill.ndjson"
+    entry = {"user": "admin", "action": "Viewed", "resource": "bus 1", "timestamp": "2026-01-01T00:00:00",
+             "ip_address": None, "anonymized": False}
+    spill_path.write_text(json.dumps(entry) + "\n")
+
+    async def scenario():
+        collection = new_collection()
+        writer = AuditLogWriter(collection, spill_path=str(spill_path))
+        await writer._replay_spill()
+        return await collection.find_one({})
+
+    stored = asyncio.run(scenario())
+    assert stored["_id"] is not None
+    assert stored["timestamp"].year == 2026
+
+
+def test_spill_error_keeps_the_flush_task_running(tmp_path):
+    async def scenario():
+        writer = AuditLogWriter(batch_size=1, flush_interval=0.01, spill_path=str(tmp_path / "missing" / "spill"))
+        writer.start()
+        record(writer, 2)
+        await asyncio.sleep(0.05)
+        running = not writer._task.done()
+        await writer.stop()
+        return running, writer.stats()
+
+    running, stats = asyncio.run(scenario())
+    assert running
+    assert stats["dropped"] == 2
+
+
+def test_stop_lets_the_write_in_flight_finish(tmp_path):
+    async def scenario():
+        collection = new_collection()
+        slow = SlowCollection(collection)
+        writer = AuditLogWriter(slow, batch_size=3, flush_interval=0.01, spill_path=str(tmp_path / "spill.ndjson"))
+        writer.start()
+        record(writer, 5)
+        await slow.started.wait()
+        await writer.stop()
+        return await collection.count_documents({}), writer.stats()
+
+    count, stats = asyncio.run(scenario())
+    assert count == 5
+    assert stats["buffered"] == 0 and stats["spilled"] == 0
+
+
+def test_cancelled_flush_puts_its_batch_back(tmp_path):
+    async def scenario():
+        collection = new_collection()
+        slow = SlowCollection(collection, delay=1)
+        writer = AuditLogWriter(slow, batch_size=3, spill_path=str(tmp_path / "spill.ndjson"))
+        record(writer, 4)
+        flush = asyncio.ensure_future(writer.flush())
+        await slow.started.wait()
+        flush.cancel()
+        try:
+            await flush
+        except asyncio.CancelledError:
+            pass
+        return [entry["resource"] for entry in writer._buffer]
+
+    assert asyncio.run(scenario()) == ["bus 0", "bus 1", "bus 2", "bus 3"]
+
+
+def test_rejected_entries_are_dead_lettered(tmp_path):
+    spill_path = tmp_path / "spill.ndjson"
+
+    async def scenario():
+        collection = new_collection()
+        writer = AuditLogWriter(RejectingCollection(collection, "bus 1"), batch_size=10,
+                                spill_path=str(spill_path))
+        record(writer, 3)
+        await writer.flush()
+        for _ in range(MAX_ATTEMPTS):
+            record(writer, 1)
+            writer._buffer[-1]["resource"] = "bus 9"
+            await writer.flush()
+        return await collection.count_documents({}), writer.stats()
+
+    count, stats = asyncio.run(scenario())
+    assert count == 2 + MAX_ATTEMPTS
+    assert stats["dead_lettered"] == 1 and stats["spilled"] == 0
+    assert not spill_path.exists()
+    [dead] = (tmp_path / "spill.dead").read_text().splitlines()
+    assert json.loads(dead)["resource"] == "bus 1"
+
+
+def test_audit_user_is_only_taken_from_trusted_proxies(monkeypatch):
+    app = FastAPI()
+    app.include_router(routes.router)
+    alert_id = routes.alerts_data[0].id
+
+    async def acknowledge():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.put(f"/api/alerts/{alert_id}/acknowledge", headers={"X-Admin-User": "dpo"})
+            assert response.status_code == 200
+        return audit_log._buffer[-1]["user"]
+
+    monkeypatch.setattr(routes, "TRUSTED_PROXIES", set())
+    assert asyncio.run(acknowledge()) == "admin_user"
+    # httpx's ASGI transport connects from 127.0.0.1, standing in for the auth proxy
+    monkeypatch.setattr(routes, "TRUSTED_PROXIES", {"127.0.0.1"})
+    assert asyncio.run(acknowledge()) == "dpo"
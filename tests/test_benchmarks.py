@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+import pytest
+
+from benchmarks import run as bench
+
+
+@pytest.fixture
+def synthetic_fleet():
+    """Load a synthetic fleet into the REST and WebSocket stores, then put the mock fleet back"""
+    rest, alerts, ws = bench.routes.live_buses.dump(), list(bench.routes.alerts_data), bench.ws_server.live_buses.dump()
+    bench.load_fleet(20)
+    yield
+    bench.routes.live_buses.restore(rest)
+    bench.routes.alerts_data[:] = alerts
+    bench.ws_server.live_buses.restore(ws)
+
+
+def test_make_fleet_is_reproducible():
+    first, second = bench.make_fleet(50), bench.make_fleet(50)
+    assert [bus.to_row()[:-3] for bus in first] == [bus.to_row()[:-3] for bus in second]
+    assert len({bus.bus_id for bus in first}) == 50
+
+
+def test_percentile_nearest_rank():
+    samples = [float(i) for i in range(1, 101)]
+    assert bench.percentile(samples, 50) == 50.0
+    assert bench.percentile(samples, 99) == 99.0
+    assert bench.percentile([], 95) == 0.0
+
+
+def test_compare_flags_regressions_beyond_tolerance(tmp_path, monkeypatch):
+    monkeypatch.setattr(bench, "BASELINE_DIR", tmp_path)
+    result = bench.summarize("rest:/api/buses", [0.010] * 10, 1.0, 1000, 10, {"fleet": 100, "clients": 2})
+    assert bench.compare(result, 0.1) == []
+
+    baseline = dict(result, p95_ms=5.0, throughput_per_s=20.0)
+    bench.baseline_path(result).write_text(json.dumps(baseline))
+    regressions = bench.compare(result, 0.1)
+    assert any(regression.startswith("rest:/api/buses p95_ms") for regression in regressions)
+    assert any("throughput_per_s" in regression for regression in regressions)
+    assert bench.compare(result, 2.0) == []
+
+
+def test_rest_benchmark_runs_in_process(synthetic_fleet):
+    result = asyncio.run(bench.bench_rest("/api/buses", 20, clients=2, requests_per_client=2))
+    assert result["benchmark"] == "rest:/api/buses"
+    assert result["fleet"] == 20
+    assert result["bytes_per_op"] > 20 * 100
+
+
+def test_websocket_benchmark_measures_every_tick(synthetic_fleet):
+    result = asyncio.run(bench.bench_websocket(20, clients=2, ticks=3))
+    assert result["benchmark"] == "websocket:bus_updates"
+    assert result["p50_ms"] > 0
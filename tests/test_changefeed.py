@@ -0,0 +1,213 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from pymongo.errors import OperationFailure
+
+from api import routes
+from changefeed import feed as feed_module
+from changefeed.feed import ChangeBuffer, HttpChangeFeed, LocalChangeFeed, ResumeTokenExpired
+from websocket import server as ws_server
+
+
+async def take(feed, count, resume_after=None):
+    events = []
+    async for event in feed.watch(resume_after):
+        events.append(event)
+        if len(events) == count:
+            break
+    return events
+
+
+def alert(alert_id):
+    return {"id": alert_id, "status": "active"}
+
+
+def test_resume_continues_after_the_token():
+    async def scenario():
+        feed = LocalChangeFeed()
+        first = feed.publish("alerts", "insert", alert("A1"))
+        feed.publish("alerts", "insert", alert("A2"))
+        feed.publish("alerts", "update", key="A1", updated_fields={"status": "resolved"})
+        return await take(feed, 2, first["resume_token"])
+
+    events = asyncio.run(scenario())
+    assert [(event["id"], event["event"]) for event in events] == [("A2", "alert_created"), ("A1", "alert_updated")]
+
+
+def test_resume_then_live_events_without_gaps():
+    async def scenario():
+        feed = LocalChangeFeed()
+        first = feed.publish("alerts", "insert", alert("A1"))
+        feed.publish("alerts", "insert", alert("A2"))
+        watcher = asyncio.create_task(take(feed, 2, first["resume_token"]))
+        await asyncio.sleep(0)
+        feed.publish("alerts", "insert", alert("A3"))
+        return await watcher
+
+    assert [event["id"] for event in asyncio.run(scenario())] == ["A2", "A3"]
+
+
+def test_evicted_token_expires():
+    async def scenario():
+        feed = LocalChangeFeed(history=2)
+        first = feed.publish("alerts", "insert", alert("A1"))
+        for i in range(2, 5):
+            feed.publish("alerts", "insert", alert(f"A{i}"))
+        assert not feed.covers(first["resume_token"])
+        await take(feed, 1, first["resume_token"])
+
+    with pytest.raises(ResumeTokenExpired):
+        asyncio.run(scenario())
+
+
+def test_tokens_from_another_run_are_not_resumable():
+    before_restart = LocalChangeFeed()
+    for i in range(1, 6):
+        old = before_restart.publish("alerts", "insert", alert(f"A{i}"))
+    restarted = LocalChangeFeed()
+    restarted.publish("alerts", "insert", alert("B1"))
+    assert not restarted.covers(old["resume_token"])
+    # Same epoch but ahead of anything published
+    assert not before_restart.covers(f"{before_restart.epoch}-{99:016x}")
+
+
+def test_slow_subscriber_catches_up_from_the_history():
+    async def scenario():
+        feed = LocalChangeFeed(queue_size=2)
+        watcher = asyncio.create_task(take(feed, 5))
+        await asyncio.sleep(0)
+        # Published faster than the watcher runs: its queue overflows
+        for i in range(1, 6):
+            feed.publish("alerts", "insert", alert(f"A{i}"))
+        return await watcher
+
+    assert [event["id"] for event in asyncio.run(scenario())] == ["A1", "A2", "A3", "A4", "A5"]
+
+
+def test_subscriber_behind_the_history_expires():
+    async def scenario():
+        feed = LocalChangeFeed(history=2, queue_size=2)
+        watcher = asyncio.create_task(take(feed, 5))
+        await asyncio.sleep(0)
+        for i in range(1, 6):
+            feed.publish("alerts", "insert", alert(f"A{i}"))
+        await watcher
+
+    with pytest.raises(ResumeTokenExpired):
+        asyncio.run(scenario())
+
+
+def test_clients_fall_back_to_a_snapshot_after_history_is_lost(monkeypatch):
+    monkeypatch.setattr(ws_server, "recent_changes", ChangeBuffer())
+    monkeypatch.setattr(ws_server, "broadcast_data", lambda event: asyncio.sleep(0))
+
+    class Feed:
+        def __init__(self):
+            self.calls = []
+
+        async def watch(self, resume_after=None):
+            self.calls.append(resume_after)
+            if len(self.calls) == 1:
+                yield {"collection": "alerts", "resume_token": "0000000000000001"}
+                raise ResumeTokenExpired("0000000000000001")
+            yield {"collection": "alerts", "resume_token": "0000000000000009"}
+
+    feed = Feed()
+    asyncio.run(ws_server.forward_changes(feed))
+    # Restarted from the current position with a fresh buffer
+    assert feed.calls == [None, None]
+    assert ws_server.resume_message("0000000000000001") is None
+    assert ws_server.resume_message("0000000000000009")["changes"] == []
+
+
+def test_other_failures_are_retried_from_the_last_token(monkeypatch):
+    monkeypatch.setattr(ws_server, "recent_changes", ChangeBuffer())
+    monkeypatch.setattr(ws_server, "broadcast_data", lambda event: asyncio.sleep(0))
+    monkeypatch.setattr(ws_server, "RETRY_SECONDS", 0)
+
+    class Feed:
+        def __init__(self):
+            self.calls = []
+
+        async def watch(self, resume_after=None):
+            self.calls.append(resume_after)
+            if len(self.calls) == 1:
+                yield {"collection": "alerts", "resume_token": "0000000000000001"}
+                raise OperationFailure("not primary", code=10107)
+            yield {"collection": "alerts", "resume_token": "0000000000000002"}
+
+    feed = Feed()
+    asyncio.run(ws_server.forward_changes(feed))
+    assert feed.calls == [None, "0000000000000001"]
+    assert ws_server.recent_changes.last_token == "0000000000000002"
+
+
+def api_app():
+    app = FastAPI()
+    app.include_router(routes.router)
+    return app
+
+
+def test_rest_writes_are_published(monkeypatch):
+    monkeypatch.setattr(routes, "change_feed", LocalChangeFeed())
+
+    async def scenario():
+        watcher = asyncio.create_task(take(routes.change_feed, 2))
+        await asyncio.sleep(0)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api_app()), base_url="http://test") as client:
+            alert_id = routes.alerts_data[0].id
+            assert (await client.put(f"/api/alerts/{alert_id}/acknowledge")).status_code == 200
+            assert (await client.put(f"/api/alerts/{alert_id}/resolve")).status_code == 200
+        return alert_id, await watcher
+
+    alert_id, events = asyncio.run(scenario())
+    assert [(event["id"], event["updated_fields"]["status"]) for event in events] == [
+        (alert_id, "acknowledged"), (alert_id, "resolved")]
+
+
+def test_changes_endpoint_rejects_expired_and_invalid_tokens(monkeypatch):
+    feed = LocalChangeFeed(history=1)
+    first = feed.publish("alerts", "insert", alert("A1"))
+    feed.publish("alerts", "insert", alert("A2"))
+    feed.publish("alerts", "insert", alert("A3"))
+    monkeypatch.setattr(routes, "change_feed", feed)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api_app()), base_url="http://test") as client:
+            expired = await client.get("/api/changes", params={"resume_after": first["resume_token"]})
+            invalid = await client.get("/api/changes", params={"resume_after": "not-a-token"})
+            restarted = await client.get("/api/changes", params={"resume_after": f"0badc0de-{3:016x}"})
+            return expired.status_code, invalid.status_code, restarted.status_code
+
+    assert asyncio.run(scenario()) == (410, 400, 410)
+
+
+def test_http_feed_reconnects_after_the_last_token(monkeypatch):
+    requests = []
+    events = [{"collection": "alerts", "id": f"A{i}", "resume_token": f"{i:016x}"} for i in range(1, 4)]
+
+    def handler(request):
+        requests.append(request.url.params.get("resume_after"))
+        if len(requests) == 1:
+            body = "".join(json.dumps(event) + "\n" for event in events[:2])
+        elif len(requests) == 2:
+            return httpx.Response(503)
+        else:
+            body = json.dumps(events[2]) + "\n"
+        return httpx.Response(200, content=body.encode())
+
+    monkeypatch.setattr(feed_module, "RETRY_SECONDS", 0)
+    feed = HttpChangeFeed("http://api/api/changes", transport=httpx.MockTransport(handler))
+    received = asyncio.run(take(feed, 3))
+    assert [event["id"] for event in received] == ["A1", "A2", "A3"]
+    assert requests == [None, events[1]["resume_token"], events[1]["resume_token"]]
+
+
+def test_http_feed_reports_lost_history():
+    feed = HttpChangeFeed("http://api/api/changes",
+                          transport=httpx.MockTransport(lambda request: httpx.Response(410)))
+    with pytest.raises(ResumeTokenExpired):
+        asyncio.run(take(feed, 1, "0000000000000001"))
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+from pydantic import BaseModel
+
+from checkpoint.store import DEFAULT_DIR, HEADER, Checkpointer, CheckpointError
+from fleet.state import BusState, FleetState
+
+
+class Alert(BaseModel):
+    id: str
+    priority: str
+
+
+def fleet():
+    return FleetState([BusState("B1", "R1", 12.97, 77.59, occupancy=40, driver="Asha", updated_at=1000.0),
+                       BusState("B2", "R2", 12.91, 77.61, status="delayed", delay=12, updated_at=1000.0)])
+
+
+def checkpointer(buses, alerts, counters):
+    store = Checkpointer("state.ckpt")
+    store.register("buses", buses.dump, buses.restore)
+    store.register_list("alerts", alerts, Alert)
+    store.register_list("counters", counters)
+    return store
+
+
+def test_round_trip_restores_every_section(checkpoint_dir):
+    buses, alerts, counters = fleet(), [Alert(id="A1", priority="high")], [1, 2, 3]
+    writer = checkpointer(buses, alerts, counters)
+    assert writer.save() > HEADER.size
+    writer.release()
+
+    restored_buses, restored_alerts, restored_counters = FleetState(), [], []
+    reader = checkpointer(restored_buses, restored_alerts, restored_counters)
+    assert sorted(reader.restore()) == ["alerts", "buses", "counters"]
+    assert restored_buses.dump() == buses.dump()
+    assert restored_alerts == alerts
+    assert restored_counters == [1, 2, 3]
+
+
+def test_async_save_and_stop_write_the_latest_state(checkpoint_dir):
+    buses, alerts = fleet(), []
+
+    async def scenario():
+        store = checkpointer(buses, alerts, [])
+        await store.save_async()
+        alerts.append(Alert(id="A2", priority="low"))
+        store.start()
+        await store.stop()
+
+    asyncio.run(scenario())
+    restored = []
+    assert "alerts" in checkpointer(FleetState(), restored, []).restore()
+    assert restored == alerts
+
+
+def test_corrupt_checkpoint_is_ignored(checkpoint_dir):
+    (checkpoint_dir / "state.ckpt").write_bytes(b"APCK" + b"\0" * 20)
+    buses = fleet()
+    assert checkpointer(buses, [], []).restore() == []
+    assert len(buses) == 2
+
+
+def test_decode_rejects_a_flipped_byte():
+    data = bytearray(Checkpointer.encode(b'{"saved_at":1,"sections":{}}'))
+    data[-1] ^= 0xFF
+    with pytest.raises(CheckpointError):
+        Checkpointer.decode(bytes(data))
+
+
+def test_relative_checkpoint_dir_is_refused(monkeypatch):
+    monkeypatch.setenv("CHECKPOINT_DIR", "state")
+    with pytest.raises(CheckpointError):
+        Checkpointer("state.ckpt").restore()
+
+
+def test_instance_name_keeps_processes_apart(checkpoint_dir, monkeypatch):
+    monkeypatch.setenv("CHECKPOINT_INSTANCE", "api-2")
+    assert Checkpointer("state.ckpt").path == checkpoint_dir / "state-api-2.ckpt"
+
+
+def test_second_writer_of_a_file_gets_its_own(checkpoint_dir):
+    first, second = Checkpointer("state.ckpt"), Checkpointer("state.ckpt")
+    assert first.path == checkpoint_dir / "state.ckpt"
+    assert second.path == checkpoint_dir / "state-1.ckpt"
+    first.release()
+    second.release()
+    assert Checkpointer("state.ckpt").path == checkpoint_dir / "state.ckpt"
+
+
+def test_restarted_worker_reuses_and_restores_its_slot(checkpoint_dir):
+    owner = Checkpointer("state.ckpt")
+    assert owner.path == checkpoint_dir / "state.ckpt"
+    worker = checkpointer(fleet(), [Alert(id="A1", priority="high")], [])
+    worker.save()
+    worker.release()
+
+    restored = []
+    restarted = checkpointer(FleetState(), restored, [])
+    assert "alerts" in restarted.restore()
+    assert restarted.path == checkpoint_dir / "state-1.ckpt"
+    assert restored == [Alert(id="A1", priority="high")]
+    restarted.release()
+    owner.release()
+    assert sorted(path.name for path in checkpoint_dir.glob("*.ckpt")) == ["state-1.ckpt"]
+
+
+def test_failing_section_does_not_stop_checkpoints_or_shutdown(checkpoint_dir):
+    calls = []
+
+    def dump():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("dictionary changed size during iteration")
+        return {"ok": True}
+
+    async def scenario():
+        store = Checkpointer("state.ckpt", interval=0.01)
+        store.register("flaky", dump, lambda data: None)
+        store.start()
+        await asyncio.sleep(0.05)
+        alive = not store._task.done()
+        await store.stop()
+        return alive
+
+    assert asyncio.run(scenario())
+    assert len(calls) > 2
+
+
+def test_default_checkpoint_dir_does_not_depend_on_the_working_directory():
+    assert DEFAULT_DIR.is_absolute()
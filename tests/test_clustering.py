@@ -0,0 +1,80 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+from api import routes
+from fleet.clustering import ClusterIndex, merge_cells
+from fleet.state import BusState
+
+
+def index(*buses):
+    clusters = ClusterIndex()
+    for bus_id, lat, lng, status in buses:
+        clusters.update(bus_id, lat, lng, status)
+    return clusters
+
+
+def test_moves_keep_counts_centroids_and_statuses():
+    clusters = index(("A", 16.50, 80.60, "active"), ("B", 16.52, 80.62, "active"))
+    [cluster] = clusters.clusters(0)
+    assert cluster["count"] == 2
+    assert cluster["lat"] == 16.51
+    clusters.update("B", 16.54, 80.64, "delayed")
+    [cluster] = clusters.clusters(0)
+    assert cluster["lat"] == 16.52
+    assert cluster["statuses"] == {"active": 1, "delayed": 1}
+    # Far apart at street level
+    assert len(clusters.clusters(14)) == 2
+
+
+def test_retain_removes_departed_buses():
+    clusters = index(("A", 16.50, 80.60, "active"), ("B", 16.52, 80.62, "active"))
+    assert clusters.retain({"A"}) == 1
+    assert len(clusters) == 1
+    assert clusters.clusters(0)[0]["count"] == 1
+    assert clusters.bus_ids_in((80.0, 16.0, 81.0, 17.0)) == ["A"]
+
+
+def test_refresh_clusters_drops_buses_that_left_the_fleet(monkeypatch):
+    monkeypatch.setattr(routes, "bus_clusters", ClusterIndex())
+    saved = routes.live_buses.dump()
+    try:
+        routes.refresh_clusters()
+        gone = next(iter(routes.live_buses)).bus_id
+        routes.live_buses.remove(gone)
+        routes.refresh_clusters()
+        assert len(routes.bus_clusters) == len(routes.live_buses)
+        assert sum(cluster["count"] for cluster in routes.bus_clusters.clusters(0)) == len(routes.live_buses)
+    finally:
+        routes.live_buses.restore(saved)
+
+
+def test_bbox_across_the_antimeridian():
+    clusters = index(("FIJI", -17.7, 178.0, "active"), ("SAMOA", -13.8, -172.0, "active"),
+                     ("LONDON", 51.5, -0.1, "active"))
+    bbox = (170.0, -25.0, -165.0, -10.0)
+    assert sorted(clusters.bus_ids_in(bbox)) == ["FIJI", "SAMOA"]
+    assert sum(cluster["count"] for cluster in clusters.clusters(5, bbox)) == 2
+    assert clusters.bus_ids_in((-165.0, -25.0, 170.0, -10.0)) == []
+
+
+def test_merged_partitions_match_one_index():
+    buses = [BusState(f"B{i}", "Route 12", 16.5 + i * 0.001, 80.6 + i * 0.002, "active") for i in range(20)]
+    whole = index(*((bus.bus_id, bus.lat, bus.lng, bus.status) for bus in buses))
+    halves = [index(*((bus.bus_id, bus.lat, bus.lng, bus.status) for bus in buses[i::2])) for i in range(2)]
+    expected = sorted((c["count"], c["lat"], c["lng"]) for c in whole.clusters(12))
+    merged = sorted((c["count"], c["lat"], c["lng"]) for c in merge_cells(half.cells(12) for half in halves))
+    assert merged == expected
+
+
+def test_non_finite_bbox_is_a_bad_request():
+    app = FastAPI()
+    app.include_router(routes.router)
+
+    async def request(bbox):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return (await client.get("/api/buses/clusters", params={"zoom": 10, "bbox": bbox})).status_code
+
+    for bbox in ("nan,16,81,17", "80,16,inf,17", "80,-infinity,81,17"):
+        assert asyncio.run(request(bbox)) == 400
@@ -0,0 +1,104 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+
+from privacy.compliance import PrivacyCompliance
+from privacy.consent import ConsentStore
+
+
+def record(user_id, purpose, given, timestamp):
+    return {"user_id": user_id, "purpose": purpose, "consent_given": given, "timestamp": timestamp}
+
+
+def test_latest_record_wins_across_naive_and_aware_times():
+    base = datetime(2026, 1, 1, 12, 0)
+    store = ConsentStore.from_records([
+        record("u1", "analytics", True, base),
+        # Aware and later: withdraws the consent
+        record("u1", "analytics", False, (base + timedelta(hours=1)).replace(tzinfo=timezone.utc)),
+        record("u2", "analytics", True, "2026-01-01T12:00:00+05:30"),
+        record("u2", "analytics", False, "2026-01-01T06:00:00"),
+    ])
+    assert store.has_consent("u1", "analytics") is False
+    # 06:00 naive is UTC, which is before 06:30 UTC
+    assert store.has_consent("u2", "analytics") is True
+
+
+def test_cache_is_bounded():
+    collection = AsyncMongoMockClient()["test"]["consents"]
+    store = ConsentStore(collection, max_cached=2)
+    now = datetime.now(timezone.utc)
+    for user_id in ("u1", "u2", "u3"):
+        store.add(record(user_id, "export", True, now))
+    assert store.has_consent("u1", "export") is False
+    assert store.has_consent("u3", "export") is True
+
+
+def test_cached_records_expire(monkeypatch):
+    collection = AsyncMongoMockClient()["test"]["consents"]
+    store = ConsentStore(collection, ttl=10)
+    clock = [1000.0]
+    monkeypatch.setattr("privacy.consent.time.monotonic", lambda: clock[0])
+    store.add(record("u1", "export", True, datetime.now(timezone.utc)))
+    assert store.has_consent("u1", "export") is True
+    clock[0] += 11
+    assert store.has_consent("u1", "export") is False
+
+
+def test_batch_check_sees_erasure_by_another_process():
+    async def scenario():
+        collection = AsyncMongoMockClient()["test"]["consents"]
+        ours, theirs = ConsentStore(collection), ConsentStore(collection)
+        await ours.save(record("u1", "export", True, datetime.now(timezone.utc)))
+        assert await ours.check_consents(["u1"], "export") == {"u1": True}
+        assert await theirs.erase("u1") == 1
+        return await ours.check_consents(["u1"], "export")
+
+    assert asyncio.run(scenario()) == {"u1": False}
+
+
+def test_erase_invalidates_cache():
+    store = ConsentStore.from_records([record("u1", "export", True, datetime.now())])
+    asyncio.run(store.erase("u1"))
+    assert store.has_consent("u1", "export") is False
+
+
+def test_batch_larger_than_the_cache_keeps_every_consent():
+    async def scenario():
+        collection = AsyncMongoMockClient()["test"]["consents"]
+        now = datetime.now(timezone.utc)
+        await collection.insert_many([record(f"u{i}", "export", True, now) for i in range(5)])
+        store = ConsentStore(collection, max_cached=2)
+        return await store.check_consents([f"u{i}" for i in range(6)], "export")
+
+    result = asyncio.run(scenario())
+    assert [result[f"u{i}"] for i in range(6)] == [True] * 5 + [False]
+
+
+def test_check_consent_sees_changes_to_the_record_list(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    privacy = PrivacyCompliance()
+    records = [privacy.generate_consent_record("u0", "export")]
+    assert privacy.check_consent("u0", "export", records) is True
+    # Replaced in place, and a fresh list of the same length
+    records[0] = privacy.generate_revocation_record("u0", "export")
+    assert privacy.check_consent("u0", "export", records) is False
+    del records
+    revoked = [privacy.generate_revocation_record("u1", "export")]
+    assert privacy.check_consent("u1", "export", revoked) is False
+
+
+def test_check_consent_against_a_held_store(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    privacy = PrivacyCompliance()
+    store = ConsentStore.from_records([privacy.generate_consent_record(f"u{i}", "export") for i in range(50)])
+    assert all(privacy.check_consent(f"u{i}", "export", store) for i in range(50))
+    store.add(privacy.generate_revocation_record("u0", "export"))
+    assert privacy.check_consent("u0", "export", store) is False
+
+
+def test_generated_records_are_utc(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    timestamp = datetime.fromisoformat(PrivacyCompliance().generate_consent_record("u1", "export")["timestamp"])
+    assert timestamp.utcoffset() == timedelta(0)
@@ -0,0 +1,60 @@
+from api.routes import routes_data, stops_data
+from fleet.eta import DEFAULT_SPEED_MPS, MAX_STOP_ARRIVALS, EtaEngine, build_engine
+
+# An east-west line along the equator, stops about 1.1 km apart
+POINTS = [[0.0, 0.0], [0.0, 0.01], [0.0, 0.02]]
+STOPS = [("S1", "West", 0.0, 0.0), ("S2", "Middle", 0.0, 0.01), ("S3", "East", 0.0, 0.02)]
+
+
+def engine():
+    eta = EtaEngine()
+    eta.add_route("Line", POINTS, STOPS)
+    return eta
+
+
+def test_next_stop_distance_and_default_speed_eta():
+    result = engine().update([("B1", "Line", 0.0, 0.005, 0.0)])["B1"]
+    assert result["next_stop"] == "Middle"
+    assert abs(result["distance_to_next_stop"] - 556) < 5
+    assert abs(result["eta_seconds"] - result["distance_to_next_stop"] / DEFAULT_SPEED_MPS) < 2
+    assert result["off_route"] is False
+
+
+def test_far_positions_are_off_route_and_unknown_routes_skipped():
+    results = engine().update([("B1", "Line", 0.01, 0.005, 0.0), ("B2", "Route 99", 0.0, 0.005, 0.0)])
+    assert results["B1"]["off_route"] is True
+    assert "B2" not in results
+
+
+def test_observed_speed_shortens_etas():
+    eta = engine()
+    first = eta.update([("B1", "Line", 0.0, 0.002, 0.0)])["B1"]["eta_seconds"]
+    # About 222 m in 10 s, four times the default speed, folded into the segment average
+    second = eta.update([("B1", "Line", 0.0, 0.004, 10.0)])["B1"]
+    assert second["eta_seconds"] < first - 222 / DEFAULT_SPEED_MPS - 30
+
+
+def test_new_trip_starting_over_is_matched_at_the_route_start():
+    eta = engine()
+    eta.update([("B1", "Line", 0.0, 0.019, 0.0)])
+    # Back at the western terminus, far behind the search window around the last match
+    result = eta.update([("B1", "Line", 0.0, 0.0005, 60.0)])["B1"]
+    assert result["off_route"] is False
+    assert result["next_stop"] == "Middle"
+    assert result["chainage"] < 100
+
+
+def test_stop_arrivals_are_soonest_first_and_capped():
+    positions = [(f"B{i}", "Line", 0.0, 0.0001 * i, 0.0) for i in range(1, MAX_STOP_ARRIVALS + 3)]
+    eta = engine()
+    eta.update(positions)
+    arrivals = eta.stop_etas["S3"]
+    assert len(arrivals) == MAX_STOP_ARRIVALS
+    assert [arrival["eta_seconds"] for arrival in arrivals] == sorted(arrival["eta_seconds"] for arrival in arrivals)
+    assert arrivals[0]["bus_id"] == f"B{MAX_STOP_ARRIVALS + 2}"
+
+
+def test_stop_travel_minutes_and_catalog_engine():
+    assert [round(minutes) for minutes in engine().stop_travel_minutes("Line")] == [3, 3]
+    catalog = build_engine(routes_data, stops_data)
+    assert catalog.routes["Route 12"].stop_names == ["Benz Circle", "Governorpet", "MG Road"]
@@ -0,0 +1,102 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime
+
+import httpx
+from fastapi import FastAPI
+from mongomock_motor import AsyncMongoMockClient
+
+from api import routes
+from audit.writer import audit_log
+from exports.stream import CsvEncoder, NdjsonEncoder
+
+BOARDED = datetime(2026, 3, 2, 9, 30, 15)
+
+
+def api_app(db):
+    app = FastAPI()
+    app.include_router(routes.router)
+    app.state.db = db
+    return app
+
+
+def seeded_db():
+    db = AsyncMongoMockClient()["test"]
+
+    async def seed():
+        await db.passenger_trips.insert_many([
+            {"trip_id": "T1", "passenger_id": "P1", "name": "Asha Rao", "route": "R1", "timestamp": BOARDED},
+            {"trip_id": "T2", "passenger_id": "P2", "name": "Ravi Kumar", "route": "R1", "timestamp": BOARDED}
+        ])
+        await db.consents.insert_one({"user_id": "P1", "purpose": "data_export", "consent_given": True,
+                                      "timestamp": BOARDED})
+
+    asyncio.run(seed())
+    return db
+
+
+def export(db, headers=None, **params):
+    async def scenario():
+        transport = httpx.ASGITransport(app=api_app(db))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/api/exports/passengers", params=params, headers=headers or {})
+
+    return asyncio.run(scenario())
+
+
+def test_ndjson_datetimes_match_csv():
+    fields = {"trip_id": "str", "timestamp": "datetime"}
+    rows = [{"trip_id": "T1", "timestamp": BOARDED}]
+    [line] = NdjsonEncoder(fields).batch(rows).decode().splitlines()
+    [cell] = [row[1] for row in csv.reader(io.StringIO(CsvEncoder(fields).batch(rows).decode()))]
+    assert json.loads(line)["timestamp"] == cell == "2026-03-02T09:30:15"
+
+
+def trust_test_client(monkeypatch):
+    # httpx's ASGI transport connects from 127.0.0.1, standing in for the auth proxy
+    monkeypatch.setattr(routes, "TRUSTED_PROXIES", {"127.0.0.1"})
+
+
+def test_raw_export_needs_a_privileged_user(monkeypatch):
+    monkeypatch.setenv("PRIVILEGED_USERS", "dpo, ops_lead")
+    trust_test_client(monkeypatch)
+    db = seeded_db()
+    assert export(db, anonymize="false").status_code == 403
+    assert export(db, {"X-Admin-User": "analyst"}, anonymize="false").status_code == 403
+
+    response = export(db, {"X-Admin-User": "dpo"}, anonymize="false", format="ndjson")
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    # Only the passenger who consented is exported raw
+    assert [(row["passenger_id"], row["name"]) for row in rows] == [("P1", "Asha Rao")]
+
+
+def test_spoofed_user_from_an_untrusted_peer_is_refused(monkeypatch):
+    monkeypatch.setenv("PRIVILEGED_USERS", "dpo")
+    monkeypatch.setattr(routes, "TRUSTED_PROXIES", set())
+    response = export(seeded_db(), {"X-Admin-User": "dpo"}, anonymize="false")
+    assert response.status_code == 403
+    assert "Asha Rao" not in response.text
+
+
+def test_anonymized_export_needs_no_privilege(monkeypatch, tmp_path):
+    monkeypatch.delenv("PRIVILEGED_USERS", raising=False)
+    # Anonymization creates its key file in the working directory
+    monkeypatch.chdir(tmp_path)
+    response = export(seeded_db(), format="ndjson")
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 2
+    assert "Asha Rao" not in response.text
+
+
+def test_export_is_audited_with_its_row_count(monkeypatch):
+    monkeypatch.setenv("PRIVILEGED_USERS", "dpo")
+    trust_test_client(monkeypatch)
+    assert export(seeded_db(), {"X-Admin-User": "dpo"}, anonymize="false", route="R1").status_code == 200
+    entry = audit_log._buffer[-1]
+    assert (entry["user"], entry["action"]) == ("dpo", "Exported passenger data")
+    assert entry["resource"] == "R1 passenger manifest (csv, 1 rows)"
+    assert entry["anonymized"] is False
@@ -0,0 +1,68 @@
+from fleet.geofence import DEFAULT_RADIUS_M, METRES_PER_DEGREE, DwellStats, StopGeofencer
+
+STOP_LAT, STOP_LNG = 16.5062, 80.6480
+
+
+def north_of_stop(metres):
+    return STOP_LAT + metres / METRES_PER_DEGREE, STOP_LNG
+
+
+def geofencer():
+    fence = StopGeofencer()
+    fence.add_stop("STOP001", STOP_LAT, STOP_LNG)
+    return fence
+
+
+def move(fence, metres, timestamp):
+    lat, lng = north_of_stop(metres)
+    return fence.process([("B1", "Route 12", "Rajesh Kumar", lat, lng, timestamp)])
+
+
+def test_arrival_then_departure_with_dwell():
+    fence = geofencer()
+    assert move(fence, 200, 0.0) == []
+    [arrival] = move(fence, 10, 10.0)
+    assert (arrival["type"], arrival["stop_id"], arrival["timestamp"]) == ("arrival", "STOP001", 10.0)
+    assert fence.at_stop("B1") == "STOP001"
+    [departure] = move(fence, 200, 55.0)
+    assert departure["type"] == "departure"
+    assert departure["dwell_seconds"] == 45.0
+    assert fence.at_stop("B1") is None
+    for kind, key in (("stop", "STOP001"), ("route", "Route 12"), ("driver", "Rajesh Kumar")):
+        assert fence.dwell.get(kind, key) == {"count": 1, "mean": 45.0, "stddev": 0.0}
+
+
+def test_jitter_at_the_edge_is_not_a_departure():
+    fence = geofencer()
+    move(fence, 0, 0.0)
+    # Outside the radius but inside the exit margin
+    assert move(fence, DEFAULT_RADIUS_M * 1.2, 5.0) == []
+    assert move(fence, DEFAULT_RADIUS_M * 0.9, 10.0) == []
+    assert fence.at_stop("B1") == "STOP001"
+
+
+def test_stop_near_a_grid_cell_edge_is_found_from_the_neighbouring_cell():
+    fence = StopGeofencer(cell_degrees=0.005)
+    # Stop just south of a cell boundary, bus just north of it
+    fence.add_stop("EDGE", 16.5099, 80.6480)
+    events = fence.process([("B1", "Route 12", None, 16.5101, 80.6480, 0.0)])
+    assert [event["stop_id"] for event in events] == ["EDGE"]
+
+
+def test_forgotten_bus_arrives_again_without_a_departure():
+    fence = geofencer()
+    move(fence, 0, 0.0)
+    fence.forget(["B1"])
+    assert fence.at_stop("B1") is None
+    [arrival] = move(fence, 0, 30.0)
+    assert arrival["type"] == "arrival"
+
+
+def test_dwell_stats_seed_and_round_trip():
+    stats = DwellStats()
+    stats.seed("driver", "Rajesh Kumar", 30.0, 2)
+    stats.add("driver", "Rajesh Kumar", 60.0)
+    assert stats.get("driver", "Rajesh Kumar")["mean"] == 40.0
+    restored = DwellStats()
+    restored.restore(stats.dump())
+    assert restored.all("driver") == stats.all("driver")
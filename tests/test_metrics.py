@@ -0,0 +1,42 @@
+import asyncio
+
+from metrics.middleware import MetricsMiddleware, http_request_duration, http_request_size
+from metrics.registry import Registry
+
+
+def test_registry_renders_labelled_series():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests", ["route"])
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    requests.labels("/api/buses").inc()
+    requests.labels("/api/buses").inc(2)
+    latency.observe(0.5)
+    text = registry.render()
+    assert 'requests_total{route="/api/buses"} 3' in text
+    assert 'latency_seconds_bucket{le="0.1"} 0' in text
+    assert 'latency_seconds_bucket{le="1"} 1' in text
+    assert "latency_seconds_count 1" in text
+
+
+async def ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def call(headers):
+    scope = {"type": "http", "method": "PUT", "path": "/x", "headers": headers}
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(MetricsMiddleware(ok_app)(scope, None, send))
+    return sent
+
+
+def test_malformed_content_length_is_recorded_as_empty():
+    before = http_request_size.labels("PUT", "unmatched").count
+    sent = call([(b"content-length", b"12abc")])
+    assert sent[0]["status"] == 200
+    assert http_request_size.labels("PUT", "unmatched").count == before + 1
+    assert http_request_duration.labels("PUT", "unmatched", 200).count >= 1
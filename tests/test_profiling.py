@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from api import routes
+from profiling.sampler import StackSampler
+from profiling.slow import IDLE, WAITING, SlowCapture
+
+
+def test_sampler_runs_one_session_at_a_time():
+    sampler = StackSampler()
+    started = threading.Event()
+    thread = threading.Thread(target=lambda: (started.set(), sampler.sample(0.2, 0.01)))
+    thread.start()
+    started.wait()
+    time.sleep(0.02)
+    try:
+        sampler.sample(0.01)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("second session was allowed to start")
+    finally:
+        thread.join()
+    # Free again once the first session is over
+    assert not sampler.running
+    sampler.sample(0.01)
+
+
+def test_profile_race_is_a_conflict(monkeypatch):
+    def busy(*args):
+        raise RuntimeError("A profiling session is already running")
+
+    monkeypatch.setattr(routes.sampler, "sample", busy)
+    app = FastAPI()
+    app.include_router(routes.router)
+
+    async def request():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post("/api/admin/profile", params={"seconds": 1})
+
+    response = asyncio.run(request())
+    assert response.status_code == 409
+
+
+def test_profiler_and_slow_capture_settings_are_bounded(monkeypatch):
+    monkeypatch.setattr(routes.sampler, "sample", lambda *args: {})
+    app = FastAPI()
+    app.include_router(routes.router)
+
+    async def requests():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return [
+                await client.post("/api/admin/profile", params={"seconds": 1, "interval_ms": 0}),
+                await client.post("/api/admin/profile", params={"seconds": 1, "interval_ms": -5}),
+                await client.put("/api/admin/slow-requests", params={"threshold_ms": -1}),
+            ]
+
+    assert [response.status_code for response in asyncio.run(requests())] == [422, 422, 422]
+
+
+def test_await_stack_is_captured_once_per_stall():
+    capture = SlowCapture(threshold_ms=20, sample_interval=0.001)
+    scheduled = []
+
+    async def blocking():
+        loop = asyncio.get_running_loop()
+        original = loop.call_soon_threadsafe
+        loop.call_soon_threadsafe = lambda *args: scheduled.append(args) or original(*args)
+        with capture.track("blocking"):
+            await asyncio.sleep(0)
+            block_the_loop()
+            await asyncio.sleep(0)
+
+    try:
+        asyncio.run(blocking())
+    finally:
+        capture.disable()
+    assert len(scheduled) == 1
+    assert capture.recent()[0]["await_stack"]
+
+
+def block_the_loop():
+    time.sleep(0.2)
+
+
+def test_slow_capture_attributes_loop_samples_to_the_running_operation():
+    capture = SlowCapture(threshold_ms=50, sample_interval=0.005)
+
+    async def blocking():
+        with capture.track("blocking"):
+            await asyncio.sleep(0)
+            block_the_loop()
+
+    async def waiting():
+        with capture.track("waiting"):
+            await asyncio.sleep(0.2)
+
+    async def scenario():
+        await asyncio.gather(waiting(), blocking())
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        capture.disable()
+    records = {record["name"]: record for record in capture.recent()}
+    assert "block_the_loop" in records["blocking"]["stacks"]
+    assert WAITING not in records["blocking"]["stacks"]
+    assert "block_the_loop" not in records["waiting"]["stacks"]
+    assert WAITING in records["waiting"]["breakdown"]
+
+
+def test_slow_capture_labels_an_idle_loop_as_awaiting_io():
+    capture = SlowCapture(threshold_ms=50, sample_interval=0.005)
+
+    async def awaiting_io():
+        with capture.track("awaiting_io"):
+            await asyncio.sleep(0.2)
+
+    try:
+        asyncio.run(awaiting_io())
+    finally:
+        capture.disable()
+    [record] = capture.recent()
+    assert IDLE in record["breakdown"]
+    assert WAITING not in record["stacks"]
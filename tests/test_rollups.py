@@ -0,0 +1,229 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import AutoReconnect
+
+from analytics import rollups as rollups_module
+from analytics.rollups import DELAY_EDGES, OCCUPANCY_LABELS, WINDOW_DAYS, Rollup, RollupStore
+from db.schema import INDEXES
+
+# 2026-03-02 10:15 IST
+MORNING = datetime(2026, 3, 2, 4, 45, tzinfo=timezone.utc).timestamp()
+DAY_START = datetime(2026, 3, 1, 18, 30, tzinfo=timezone.utc)
+DAY_END = datetime(2026, 3, 2, 18, 30, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def frozen_clock(monkeypatch):
+    """The in-memory window is relative to now; keep the fixed test dates inside it"""
+    monkeypatch.setattr(rollups_module.time, "time", lambda: MORNING + 86400)
+
+
+class FlakyCollection:
+    """Delegates to a mongomock collection, failing the next bulk writes on demand"""
+
+    def __init__(self, collection, failures=0):
+        self.collection = collection
+        self.failures = failures
+
+    def find(self, *args, **kwargs):
+        return self.collection.find(*args, **kwargs)
+
+    async def bulk_write(self, operations, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect("connection refused")
+        return await self.collection.bulk_write(operations, ordered=ordered)
+
+
+def new_collection():
+    return AsyncMongoMockClient()["test"]["rollups"]
+
+
+def day_total(store, route="R1"):
+    [result] = asyncio.run(store.query("route", "day", DAY_START, DAY_END, route, group_by="total"))
+    return result
+
+
+def test_merge_equals_adding_everything_to_one_rollup():
+    samples = [(-3, 40), (2, 55), (7, 90), (12, 101), (0, 10), (80, 100)]
+    left, right, whole = Rollup(), Rollup(), Rollup()
+    for i, (delay, occupancy) in enumerate(samples):
+        (left if i % 2 else right).add(delay, occupancy)
+        whole.add(delay, occupancy)
+    left.merge(right)
+    assert left.summary() == whole.summary()
+    assert left.summary()["observations"] == 6
+    assert left.summary()["peak_occupancy"] == 101
+    assert left.summary()["occupancy_distribution"][OCCUPANCY_LABELS[-1]] == 1
+    assert whole.p95_delay() == float(DELAY_EDGES[-1])
+
+
+def test_document_round_trip_keeps_histograms():
+    rollup = Rollup()
+    rollup.add(3, 45)
+    rollup.add(9, 88)
+    update = rollup.to_update()
+    document = {"count": update["$inc"]["count"], "on_time": update["$inc"]["on_time"],
+                "delay_sum": update["$inc"]["delay_sum"], "occupancy_sum": update["$inc"]["occupancy_sum"],
+                "occupancy_max": update["$max"]["occupancy_max"],
+                "delay_hist": {}, "occupancy_hist": {}}
+    for field, value in update["$inc"].items():
+        if "." in field:
+            slot, index = field.split(".")
+            document[slot][index] = value
+    assert Rollup.from_document(document).summary() == rollup.summary()
+
+
+def test_flush_adds_increments_from_every_writer():
+    async def scenario():
+        collection = new_collection()
+        first, second = RollupStore(), RollupStore()
+        await first.load(collection)
+        await second.load(collection)
+        first.record(MORNING, 2, 40, route="R1")
+        second.record(MORNING, 8, 90, route="R1")
+        await first.flush(collection)
+        await second.flush(collection)
+        first.record(MORNING + 60, 4, 60, route="R1")
+        await first.flush(collection)
+
+        restarted = RollupStore()
+        await restarted.load(collection)
+        return restarted
+
+    result = day_total(asyncio.run(scenario()))
+    assert result["observations"] == 3
+    assert result["otp"] == 66.7
+    assert result["peak_occupancy"] == 90
+    assert result["occupancy_distribution"]["30-40"] == 1
+    assert result["occupancy_distribution"]["80-90"] == 1
+
+
+def test_flush_only_writes_what_changed_since_the_last_flush():
+    async def scenario():
+        collection = new_collection()
+        store = RollupStore()
+        await store.load(collection)
+        store.record(MORNING, 1, 50, route="R1", depot="D1")
+        written = await store.flush(collection)
+        again = await store.flush(collection)
+        return written, again
+
+    # Hour and day buckets for the route and the depot
+    assert asyncio.run(scenario()) == (4, 0)
+
+
+def test_flush_is_refused_until_stored_rollups_load():
+    async def scenario():
+        collection = new_collection()
+        store = RollupStore()
+        store.record(MORNING, 1, 50, route="R1")
+        with pytest.raises(RuntimeError):
+            await store.flush(collection)
+        return await collection.count_documents({})
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_load_merges_stored_buckets_into_recorded_ones():
+    async def scenario():
+        collection = new_collection()
+        earlier = RollupStore()
+        await earlier.load(collection)
+        earlier.record(MORNING, 1, 50, route="R1")
+        await earlier.flush(collection)
+
+        store = RollupStore()
+        store.record(MORNING + 60, 3, 70, route="R1")
+        await store.load(collection)
+        await store.flush(collection)
+
+        restarted = RollupStore()
+        await restarted.load(collection)
+        return store, restarted
+
+    store, restarted = asyncio.run(scenario())
+    assert day_total(store)["observations"] == 2
+    assert day_total(restarted)["observations"] == 2
+
+
+def test_failed_flush_keeps_increments_for_the_next_one():
+    async def scenario():
+        collection = new_collection()
+        flaky = FlakyCollection(collection, failures=1)
+        store = RollupStore()
+        await store.load(flaky)
+        store.record(MORNING, 1, 50, route="R1")
+        with pytest.raises(AutoReconnect):
+            await store.flush(flaky)
+        store.record(MORNING + 60, 9, 30, route="R1")
+        await store.flush(flaky)
+
+        restarted = RollupStore()
+        await restarted.load(collection)
+        return restarted
+
+    result = day_total(asyncio.run(scenario()))
+    assert result["observations"] == 2
+    assert result["otp"] == 50.0
+
+
+def test_only_the_recent_window_is_loaded_and_older_ranges_read_the_store():
+    old = MORNING - (WINDOW_DAYS["hour"] + 5) * 86400
+    old_start = datetime.fromtimestamp(old - 3600, timezone.utc)
+    old_end = datetime.fromtimestamp(old + 3600, timezone.utc)
+
+    async def scenario():
+        collection = new_collection()
+        writer = RollupStore()
+        await writer.load(collection)
+        writer.record(old, 4, 60, route="R1")
+        writer.record(MORNING, 2, 40, route="R1")
+        await writer.flush(collection)
+
+        store = RollupStore()
+        await store.load(collection)
+        in_memory = await store.query("route", "hour", old_start, old_end, "R1", group_by="total")
+        stored = await store.query("route", "hour", old_start, old_end, "R1", group_by="total",
+                                   collection=collection)
+        old_day = await store.query("route", "day", old_start, old_end, "R1", group_by="total")
+        return in_memory, stored, old_day
+
+    in_memory, stored, old_day = asyncio.run(scenario())
+    # The old hourly bucket stays in MongoDB; its daily bucket is still in the window
+    assert in_memory == []
+    assert stored[0]["observations"] == 1
+    assert old_day[0]["observations"] == 1
+
+
+def test_reload_picks_up_other_writers_and_keeps_unflushed_increments():
+    async def scenario():
+        collection = new_collection()
+        first, second = RollupStore(), RollupStore()
+        await first.load(collection)
+        await second.load(collection)
+        first.record(MORNING, 2, 40, route="R1")
+        await first.flush(collection)
+        second.record(MORNING + 60, 8, 90, route="R1")
+        await second.load(collection)
+        return second
+
+    assert day_total(asyncio.run(scenario()))["observations"] == 2
+
+
+def test_stored_buckets_expire():
+    async def scenario():
+        collection = new_collection()
+        store = RollupStore()
+        await store.load(collection)
+        store.record(MORNING, 1, 50, route="R1")
+        await store.flush(collection)
+        return {document["granularity"]: document["expires_at"] async for document in collection.find()}
+
+    expiry = asyncio.run(scenario())
+    assert expiry["hour"] < expiry["day"]
+    assert expiry["hour"] > datetime(2026, 3, 2) + timedelta(days=rollups_module.RETENTION_DAYS["hour"] - 1)
+    assert any(index.document.get("expireAfterSeconds") == 0 for index in INDEXES["rollups"])
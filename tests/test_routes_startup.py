@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+from api import routes
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(routes.__file__)).rsplit(os.sep, 1)[0]
+
+
+def test_import_builds_no_live_pipeline(tmp_path):
+    check = "from api import routes; assert routes.eta_engine is None and routes.checkpointer is None"
+    subprocess.run([sys.executable, "-c", check], cwd=tmp_path, check=True,
+                   env={**os.environ, "PYTHONPATH": BACKEND_DIR})
+
+
+def test_start_live_state_builds_pipeline(tmp_path, monkeypatch):
+    monkeypatch.setenv("CHECKPOINT_DIR", str(tmp_path))
+    assert routes.start_live_state() == []
+    assert routes.eta_engine is not None
+    assert routes.checkpointer.path.parent == tmp_path
+    # ETAs and clusters are derived from the live fleet at startup
+    assert any(bus.eta_seconds is not None for bus in routes.live_buses)
+    assert routes.bus_clusters.clusters(0)
+
+
+def test_refresh_fills_delay_predictions_and_forgets_departed_buses(tmp_path, monkeypatch):
+    monkeypatch.setenv("CHECKPOINT_DIR", str(tmp_path))
+    routes.start_live_state()
+    bus = next(bus for bus in routes.live_buses if bus.eta_seconds is not None)
+    prediction = routes.delay_predictions_data[0].model_copy(update={"bus_id": bus.bus_id, "eta": "--:--"})
+    monkeypatch.setattr(routes, "delay_predictions_data", [prediction])
+    routes.refresh_etas()
+    assert prediction.next_stop == bus.next_stop
+    arrival = routes.datetime.now().timestamp() + bus.eta_seconds
+    assert prediction.eta in {routes.datetime.fromtimestamp(arrival + shift).strftime("%H:%M") for shift in (-60, 0)}
+
+    monkeypatch.setattr(routes, "live_buses", routes.FleetState([
+        other for other in routes.live_buses if other.bus_id != prediction.bus_id
+    ]))
+    routes.geofencer.process([(bus.bus_id, bus.route, None, 16.5062, 80.6480, 0.0)])
+    routes.refresh_etas()
+    assert prediction.bus_id not in routes.eta_engine._last
+    assert routes.geofencer.at_stop(prediction.bus_id) is None
@@ -0,0 +1,74 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from mongomock_motor import AsyncMongoMockClient
+from pymongo import IndexModel
+
+from db import schema
+from db.schema import INDEXES, ensure_indexes
+
+
+def index_info(collection):
+    async def read():
+        return {index["name"]: index async for index in collection.list_indexes()}
+    return asyncio.run(read())
+
+
+def test_creates_missing_indexes_once():
+    db = AsyncMongoMockClient()["test"]
+    created = asyncio.run(ensure_indexes(db))
+    assert len(created) == sum(len(indexes) for indexes in INDEXES.values())
+    assert asyncio.run(ensure_indexes(db)) == []
+
+
+def test_rebuilds_index_with_changed_options(monkeypatch):
+    db = AsyncMongoMockClient()["test"]
+    asyncio.run(db.drivers.create_index("employee_id"))
+    monkeypatch.setattr(schema, "INDEXES", {"drivers": [IndexModel("employee_id", unique=True)]})
+    assert asyncio.run(ensure_indexes(db)) == ["employee_id_1"]
+    assert index_info(db.drivers)["employee_id_1"].get("unique") is True
+
+
+def test_rebuilds_named_index_with_changed_keys(monkeypatch):
+    db = AsyncMongoMockClient()["test"]
+    asyncio.run(db.trips.create_index([("route", 1)], name="by_route"))
+    monkeypatch.setattr(schema, "INDEXES", {"trips": [IndexModel([("route", 1), ("timestamp", 1)], name="by_route")]})
+    assert asyncio.run(ensure_indexes(db)) == ["by_route"]
+    assert list(index_info(db.trips)["by_route"]["key"]) == ["route", "timestamp"]
+
+
+def test_only_one_concurrent_bootstrap_migrates(monkeypatch):
+    db = AsyncMongoMockClient()["test"]
+    asyncio.run(db.drivers.create_index("employee_id"))
+    monkeypatch.setattr(schema, "INDEXES", {"drivers": [IndexModel("employee_id", unique=True)]})
+
+    async def workers():
+        return await asyncio.gather(ensure_indexes(db), ensure_indexes(db))
+
+    assert sorted(asyncio.run(workers())) == [[], ["employee_id_1"]]
+    # The lock is released for the next deploy
+    assert asyncio.run(db[schema.INDEX_LOCK_COLLECTION].count_documents({})) == 0
+
+
+def test_held_index_lock_defers_and_expired_one_is_taken_over(monkeypatch):
+    db = AsyncMongoMockClient()["test"]
+    asyncio.run(db.drivers.create_index("employee_id"))
+    monkeypatch.setattr(schema, "INDEXES", {"drivers": [IndexModel("employee_id", unique=True)]})
+    held = {"_id": schema.INDEX_LOCK_ID, "owner": "other:1", "expires_at": datetime.utcnow() + timedelta(minutes=5)}
+    asyncio.run(db[schema.INDEX_LOCK_COLLECTION].insert_one(held))
+    assert asyncio.run(ensure_indexes(db)) == []
+    assert index_info(db.drivers)["employee_id_1"].get("unique") is None
+
+    expired = {"expires_at": datetime.utcnow() - timedelta(seconds=1)}
+    asyncio.run(db[schema.INDEX_LOCK_COLLECTION].update_one({"_id": schema.INDEX_LOCK_ID}, {"$set": expired}))
+    assert asyncio.run(ensure_indexes(db)) == ["employee_id_1"]
+
+
+def test_unreachable_database_only_logs_from_the_background_bootstrap(monkeypatch, caplog):
+    import server
+
+    async def unreachable(db):
+        raise ConnectionError("no servers available")
+    monkeypatch.setattr(schema, "ensure_indexes", unreachable)
+    asyncio.run(server.bootstrap_indexes(AsyncMongoMockClient()["test"]))
+    assert "Index bootstrap skipped: no servers available" in caplog.text
@@ -0,0 +1,151 @@
+import asyncio
+import json
+from collections import Counter
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from api import routes
+from sharding import snapshot as snapshot_module
+from sharding.ring import HashRing
+from sharding.snapshot import SEQUENCE, SnapshotReader, SnapshotWriter
+
+ROUTES = [f"route-{i}" for i in range(4000)]
+
+
+def test_ring_spreads_routes_evenly():
+    ring = HashRing(4)
+    shares = Counter(ring.partition(route) for route in ROUTES)
+    assert set(shares) == {0, 1, 2, 3}
+    assert all(abs(count - 1000) < 200 for count in shares.values())
+
+
+def test_ring_is_stable_across_instances():
+    first, second = HashRing(4), HashRing(4)
+    assert [first.partition(route) for route in ROUTES] == [second.partition(route) for route in ROUTES]
+
+
+def test_adding_a_partition_only_moves_routes_to_it():
+    before, after = HashRing(4), HashRing(5)
+    moved = [route for route in ROUTES if before.partition(route) != after.partition(route)]
+    assert all(after.partition(route) == 4 for route in moved)
+    assert 0.12 < len(moved) / len(ROUTES) < 0.28
+
+
+def test_ring_needs_a_partition():
+    with pytest.raises(ValueError):
+        HashRing(0)
+
+
+@pytest.fixture
+def segment():
+    reader = SnapshotReader(64 * 1024)
+    writer = SnapshotWriter(reader.name)
+    yield reader, writer
+    writer.close()
+    reader.close()
+
+
+def test_snapshot_round_trip(segment):
+    reader, writer = segment
+    assert reader.read() == {}
+    writer.write({"buses:active": b'{"id":"B1"}', "totals": b'{"buses":1}'})
+    assert reader.read() == {"buses:active": b'{"id":"B1"}', "totals": b'{"buses":1}'}
+    assert reader.read(prefix="buses:") == {"buses:active": b'{"id":"B1"}'}
+    assert reader.read(names=["totals", "missing"]) == {"totals": b'{"buses":1}'}
+
+
+def test_read_waits_out_a_write_in_progress(segment, monkeypatch):
+    reader, writer = segment
+    writer.write({"rows": b"old"})
+    # Writer midway: odd sequence; it finishes while the reader yields
+    SEQUENCE.pack_into(writer._memory.buf, 0, writer._sequence + 1)
+    writer._sequence += 1
+    finish = lambda _: SEQUENCE.pack_into(writer._memory.buf, 0, writer._sequence + 1)
+    monkeypatch.setattr(snapshot_module.time, "sleep", finish)
+    assert reader.read() == {"rows": b"old"}
+
+
+def test_read_retries_when_rewritten_during_the_copy(segment, monkeypatch):
+    reader, writer = segment
+    writer.write({"rows": b"first version"})
+    loads = json.loads
+    calls = []
+
+    def rewrite_after_index(data):
+        index = loads(data)
+        if not calls:
+            # A whole new snapshot lands between the index read and the section copy
+            writer.write({"rows": b"second"})
+        calls.append(index)
+        return index
+
+    monkeypatch.setattr(snapshot_module.json, "loads", rewrite_after_index)
+    assert reader.read() == {"rows": b"second"}
+    assert len(calls) == 2
+
+
+def test_read_gives_up_on_a_write_that_never_finishes(segment):
+    reader, writer = segment
+    writer.write({"rows": b"old"})
+    SEQUENCE.pack_into(writer._memory.buf, 0, writer._sequence + 1)
+    with pytest.raises(TimeoutError):
+        reader.read()
+    reader.reset()
+    assert reader.read() == {}
+
+
+def test_crashed_worker_is_restarted_and_fleet_restored_on_stop():
+    routes.start_live_state()
+    bus_ids = sorted(bus.bus_id for bus in routes.live_buses)
+
+    def sharded_ids():
+        return sorted(bus["id"] for bus in json.loads(routes.sharded_fleet.buses_json()))
+
+    async def stale_headers():
+        app = FastAPI()
+        app.include_router(routes.router)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return [(await client.get(path)).headers.get("x-data-stale") for path in ("/api/buses", "/api/kpis")]
+
+    async def worker_lookups(bus_id):
+        app = FastAPI()
+        app.include_router(routes.router)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return [await client.get(path) for path in (f"/api/buses/{bus_id}", "/api/buses/clusters?zoom=10",
+                                                         "/api/buses/clusters?zoom=18&bbox=-180,-90,180,90")]
+
+    async def scenario():
+        await routes.start_partitions(2)
+        try:
+            pool = routes.sharded_fleet
+            await routes.refresh_live_state()
+            assert sharded_ids() == bus_ids and len(routes.live_buses) == 0
+
+            crashed = pool._processes[0]
+            crashed.kill()
+            await asyncio.to_thread(crashed.join, 5)
+            # Reads keep coming from the dead worker's snapshot, marked stale
+            assert pool.stale
+            assert sharded_ids() == bus_ids
+            assert await stale_headers() == ["true", "true"]
+            # Lookups that need the dead worker ask the client to retry after the respawn
+            lost = next(bus_id for bus_id in bus_ids if pool._owners[bus_id] == 0)
+            for response in await worker_lookups(lost):
+                assert response.status_code == 503
+                assert response.headers["retry-after"] == str(routes.PARTITION_RETRY_AFTER)
+
+            await routes.refresh_live_state()
+            assert pool._processes[0] is not crashed and pool._processes[0].is_alive()
+            assert not pool.stale
+            assert sharded_ids() == bus_ids
+            assert await stale_headers() == [None, None]
+            restarted = [bus_id for bus_id in bus_ids if pool._owners[bus_id] == 0]
+            assert restarted and all([await pool.bus_json(bus_id) for bus_id in restarted])
+        finally:
+            await routes.stop_partitions()
+
+    asyncio.run(scenario())
+    assert routes.sharded_fleet is None
+    assert sorted(bus.bus_id for bus in routes.live_buses) == bus_ids
@@ -0,0 +1,109 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from api import routes
+from fleet.eta import RouteGeometry
+from simulation.engine import compare, departure_times, simulate
+from simulation.runner import SimulationRunner
+
+PROFILE = {
+    "route": "Route 12",
+    "stops": ["Benz Circle", "Governorpet", "MG Road"],
+    "segment_minutes": [6.5, 4.0],
+    "demand": [[960, 1140, 120]],
+    "headway_minutes": 15,
+    "capacity": 60
+}
+
+
+def post_simulations(body):
+    app = FastAPI()
+    app.include_router(routes.router)
+
+    async def request():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post("/api/simulations", json=body)
+
+    return asyncio.run(request())
+
+
+@pytest.mark.parametrize("scenario", [
+    {"headway_minutes": 0},
+    {"headway_minutes": -5},
+    {"add_buses": -1},
+    {"add_buses": routes.MAX_ADDED_BUSES + 1},
+    {"start": "7:00"},
+    {"start": "25:00"},
+    {"start": "17:00", "end": "16:00"},
+    {"add_busses": 1},
+])
+def test_out_of_bounds_scenarios_are_rejected(scenario):
+    assert post_simulations({"route": "Route 12", "scenarios": [scenario]}).status_code == 422
+
+
+def test_scenario_count_is_bounded():
+    assert post_simulations({"route": "Route 12", "scenarios": []}).status_code == 422
+    assert post_simulations({"route": "Route 12", "scenarios": [{}] * 101}).status_code == 422
+
+
+def test_engine_refuses_headways_that_never_finish():
+    with pytest.raises(ValueError):
+        departure_times(PROFILE, {"headway_minutes": -1})
+    with pytest.raises(ValueError):
+        departure_times(dict(PROFILE, headway_minutes=0), {})
+
+
+def test_routes_without_two_stops_are_rejected(monkeypatch):
+    stopless = RouteGeometry("Stopless", [[16.5, 80.6], [16.51, 80.61]], [])
+    monkeypatch.setitem(routes.eta_engine.routes, "Stopless", stopless)
+    assert post_simulations({"route": "Stopless", "scenarios": [{}]}).status_code == 400
+    with pytest.raises(ValueError):
+        simulate(dict(PROFILE, stops=[], segment_minutes=[]), {})
+
+
+def test_added_buses_shorten_the_window_headway():
+    base = departure_times(PROFILE, {})
+    more = departure_times(PROFILE, {"add_buses": 2, "start": "17:00", "end": "19:00"})
+    assert len(base) == 72
+    in_window = lambda departures: [minute for minute in departures if 17 * 60 <= minute < 19 * 60]
+    assert len(in_window(more)) > len(in_window(base))
+    assert [minute for minute in more if minute < 17 * 60] == [minute for minute in base if minute < 17 * 60]
+
+
+def test_scenario_improves_crowded_peak():
+    result = compare(PROFILE, {"add_buses": 2, "start": "16:00", "end": "19:00"}, replications=2)
+    assert result["projected"]["occupancy"] < result["baseline"]["occupancy"]
+
+
+def test_cached_results_are_copies():
+    async def scenario():
+        runner = SimulationRunner(max_workers=1)
+        runner._pool = ThreadPoolExecutor(max_workers=1)
+        try:
+            scenario = {"add_buses": 1, "start": "17:00", "end": "19:00"}
+            first, second = await asyncio.gather(runner.run(PROFILE, scenario), runner.run(PROFILE, scenario))
+            first["kpi_impact"]["otp"] = "changed"
+            third = await runner.run(PROFILE, scenario)
+            return first, second, third, runner._cache
+        finally:
+            runner.shutdown()
+
+    first, second, third, cache = asyncio.run(scenario())
+    assert second["kpi_impact"]["otp"] != "changed"
+    assert third == second
+    assert third["data_version"] == first["data_version"]
+    assert all("data_version" not in result for result in cache.values())
+
+
+def test_pool_spawns_its_workers():
+    runner = SimulationRunner(max_workers=1)
+    try:
+        assert runner._executor()._mp_context.get_start_method() == "spawn"
+        result = asyncio.run(runner.run(PROFILE, {"add_buses": 1}))
+        assert result["route"] == "Route 12"
+    finally:
+        runner.shutdown()
@@ -0,0 +1,141 @@
+import sys
+import time
+from datetime import datetime
+
+import pytest
+
+from api.routes import bus_model
+from fleet.state import FIELDS, BusState, FleetState
+
+
+def message(bus_id="B1", **fields):
+    base = {
+        "bus_id": bus_id,
+        "route": "R1",
+        "driver": "Asha",
+        "location": {"lat": 12.97, "lng": 77.59, "address": "MG Road"},
+        "status": "active",
+        "occupancy": 40,
+        "delay": 2,
+        "speed": 31.5,
+        "direction": 90,
+        "next_stop": "Trinity",
+        "last_update": "2026-03-02T04:45:00"
+    }
+    base.update(fields)
+    return base
+
+
+def test_message_round_trip():
+    bus = BusState.from_message(message())
+    assert bus.to_message() == {**message(), "distance_to_next_stop": None, "eta_seconds": None}
+
+
+def test_naive_and_aware_timestamps_are_utc():
+    naive = BusState.from_message(message(last_update="2026-03-02T04:45:00"))
+    aware = BusState.from_message(message(last_update="2026-03-02T10:15:00+05:30"))
+    assert naive.updated_at == aware.updated_at == 1772426700.0
+    assert aware.to_message()["last_update"] == "2026-03-02T04:45:00"
+
+
+@pytest.fixture
+def kolkata_time(monkeypatch):
+    if not hasattr(time, "tzset"):
+        pytest.skip("needs time.tzset")
+    monkeypatch.setenv("TZ", "Asia/Kolkata")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_naive_datetimes_are_utc_in_any_local_timezone(kolkata_time):
+    from_mongo = BusState.from_message(message(last_update=datetime(2026, 3, 2, 4, 45)))
+    assert from_mongo.updated_at == 1772426700.0
+    assert bus_model(from_mongo).last_update == datetime(2026, 3, 2, 4, 45)
+
+
+def test_repeated_strings_are_interned():
+    route = "".join(["R", "1"])
+    first = BusState("B1", route, 0, 0)
+    second = BusState.from_message(message("B2", route="".join(["R", "1"])))
+    assert first.route is second.route is sys.intern("R1")
+
+
+def test_values_are_coerced_to_slot_types():
+    bus = BusState.from_message(message(occupancy="55", delay=3.0, location={"lat": "12.5", "lng": 77}))
+    assert (bus.occupancy, bus.delay, bus.lat, bus.lng) == (55, 3, 12.5, 77.0)
+    assert isinstance(bus.lng, float)
+
+
+def test_set_handles_dotted_paths_and_unknown_fields():
+    bus = BusState.from_message(message())
+    assert bus.set("location.address", "Indiranagar")
+    assert not bus.set("colour", "blue")
+    assert bus.address == "Indiranagar"
+
+
+def test_none_resets_a_field_to_its_default():
+    bus = BusState.from_message(message())
+    bus.set("status", None)
+    bus.set("occupancy", None)
+    assert (bus.status, bus.occupancy) == ("active", 0)
+
+
+def test_clear_resets_removed_fields_but_keeps_identity():
+    bus = BusState.from_message(message())
+    updated_at = bus.updated_at
+    for path in ("next_stop", "location.lat", "bus_id", "last_update"):
+        bus.clear(path)
+    assert (bus.next_stop, bus.lat) == (None, 0.0)
+    assert (bus.bus_id, bus.updated_at) == ("B1", updated_at)
+
+
+def test_row_round_trip_keeps_every_slot():
+    bus = BusState.from_message(message())
+    bus.eta_seconds = 120.0
+    restored = BusState.from_row(bus.to_row())
+    assert [getattr(restored, slot) for slot in FIELDS] == bus.to_row()
+    assert restored.route is sys.intern("R1")
+
+
+def test_apply_adds_new_buses_and_merges_known_ones():
+    fleet = FleetState()
+    first = fleet.apply(message())
+    merged = fleet.apply({"bus_id": "B1", "occupancy": 75, "location": {"lat": 13.0}})
+    assert merged is first
+    assert len(fleet) == 1
+    assert (merged.occupancy, merged.lat, merged.lng) == (75, 13.0, 77.59)
+
+
+def test_fleet_keeps_first_seen_order():
+    fleet = FleetState()
+    for bus_id in ("B3", "B1", "B2"):
+        fleet.apply(message(bus_id))
+    fleet.apply(message("B1", occupancy=10))
+    assert [bus.bus_id for bus in fleet] == ["B3", "B1", "B2"]
+    assert [item["bus_id"] for item in fleet.messages()] == ["B3", "B1", "B2"]
+
+
+def test_add_remove_get_and_select():
+    fleet = FleetState([BusState("B1", "R1", 0, 0, status="delayed"), BusState("B2", "R2", 0, 0)])
+    fleet.add(BusState("B3", "R1", 0, 0))
+    assert "B3" in fleet and fleet.get("B4") is None
+    assert fleet.remove("B2") and not fleet.remove("B2")
+    assert [bus.bus_id for bus in fleet.select(lambda bus: bus.route == "R1")] == ["B1", "B3"]
+    assert [bus.bus_id for bus in fleet.select(lambda bus: bus.status == "delayed")] == ["B1"]
+
+
+def test_dump_and_restore():
+    fleet = FleetState()
+    for bus_id in ("B1", "B2"):
+        fleet.apply(message(bus_id))
+    restored = FleetState([BusState("OLD", "R9", 0, 0)])
+    restored.restore(fleet.dump())
+    assert "OLD" not in restored
+    assert restored.messages() == fleet.messages()
+
+
+def test_restore_rejects_other_fields():
+    with pytest.raises(ValueError):
+        FleetState().restore({"fields": ["bus_id", "route"], "rows": [["B1", "R1"]]})
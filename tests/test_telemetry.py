@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+from telemetry.log import RECORD, TelemetryLog, TelemetryRecorder
+from telemetry.replay import Replayer
+from websocket import server as ws_server
+
+
+def bus(bus_id, route="Route 12", lat=16.5, lng=80.6):
+    return {"bus_id": bus_id, "route": route, "location": {"lat": lat, "lng": lng},
+            "speed": 30.0, "direction": 90, "occupancy": 40, "status": "delayed"}
+
+
+def test_recorded_ticks_read_back_in_order(tmp_path):
+    path = str(tmp_path / "feed.aptl")
+    recorder = TelemetryRecorder(path)
+    recorder.record_tick([bus("A"), bus("B")], 100.0)
+    recorder.record_tick([bus("A", lat=16.6)], 102.0)
+    recorder.close()
+
+    log = TelemetryLog(path)
+    try:
+        ticks = list(log.ticks())
+        assert [(timestamp, len(records)) for timestamp, records in ticks] == [(100.0, 2), (102.0, 1)]
+        assert ticks[1][1][0]["location"]["lat"] == 16.6
+        assert ticks[0][1][1]["status"] == "delayed"
+        assert log.seek(101.0) == 2
+        assert list(log.ticks(start=101.0)) == ticks[1:]
+    finally:
+        log.close()
+
+
+def test_torn_trailing_record_is_ignored(tmp_path):
+    path = tmp_path / "feed.aptl"
+    recorder = TelemetryRecorder(str(path))
+    recorder.record_tick([bus("A"), bus("B")], 100.0)
+    recorder.close()
+    path.write_bytes(path.read_bytes()[:-RECORD.size // 2])
+    log = TelemetryLog(str(path))
+    assert len(log) == 1
+    log.close()
+
+
+def test_appending_after_a_crash_cuts_the_torn_record(tmp_path):
+    path = tmp_path / "feed.aptl"
+    recorder = TelemetryRecorder(str(path))
+    recorder.record_tick([bus("A"), bus("B")], 100.0)
+    recorder.close()
+    path.write_bytes(path.read_bytes()[:-RECORD.size // 2])
+
+    recorder = TelemetryRecorder(str(path))
+    recorder.record_tick([bus("C")], 102.0)
+    recorder.close()
+    log = TelemetryLog(str(path))
+    try:
+        assert [(timestamp, [record["bus_id"] for record in records]) for timestamp, records in log.ticks()] \
+            == [(100.0, ["A"]), (102.0, ["C"])]
+        assert log.seek(101.0) == 1
+    finally:
+        log.close()
+
+
+def test_recorder_refuses_to_append_to_a_foreign_file(tmp_path):
+    path = tmp_path / "feed.aptl"
+    path.write_bytes(b"NOTATELEMETRYLOG")
+    with pytest.raises(ValueError):
+        TelemetryRecorder(str(path))
+    assert path.read_bytes() == b"NOTATELEMETRYLOG"
+
+
+def test_recorder_rewrites_a_torn_header(tmp_path):
+    path = tmp_path / "feed.aptl"
+    path.write_bytes(b"APT")
+    recorder = TelemetryRecorder(str(path))
+    recorder.record_tick([bus("A")], 100.0)
+    recorder.close()
+    log = TelemetryLog(str(path))
+    assert len(log) == 1
+    log.close()
+
+
+@pytest.mark.parametrize("content", [b"", b"APT"])
+def test_empty_log_has_no_ticks(tmp_path, content):
+    path = tmp_path / "empty.aptl"
+    path.write_bytes(content)
+    log = TelemetryLog(str(path))
+    assert len(log) == 0
+    assert log.start is None
+    assert list(log.ticks()) == []
+    log.close()
+
+
+def test_long_ids_are_cut_on_a_character_boundary(tmp_path):
+    path = str(tmp_path / "feed.aptl")
+    recorder = TelemetryRecorder(path)
+    # 15 ASCII bytes then a 3-byte character that does not fit
+    recorder.record_tick([bus("APSRTC000000001" + "అ", route="రూట్ 12 విజయవాడ")], 100.0)
+    recorder.close()
+    log = TelemetryLog(path)
+    record = log.record(0)
+    log.close()
+    assert record["bus_id"] == "APSRTC000000001"
+    assert len(record["route"].encode()) <= 16
+    assert "రూట్ 12 విజయవాడ".startswith(record["route"])
+
+
+def test_out_of_range_fields_are_clamped_and_bad_buses_skipped(tmp_path, caplog):
+    recorder = TelemetryRecorder(str(tmp_path / "feed.aptl"))
+    wild = dict(bus("A"), direction=-90, occupancy=300)
+    broken = dict(bus("B"), speed=None)
+    recorder.record_tick([wild, broken, bus("C")], 100.0)
+    recorder.close()
+    assert recorder.records == 2
+    assert "bus 'B' skipped" in caplog.text
+    log = TelemetryLog(recorder.path)
+    [(_, updates)] = list(log.ticks())
+    log.close()
+    assert [update["bus_id"] for update in updates] == ["A", "C"]
+    assert (updates[0]["direction"], updates[0]["occupancy"]) == (270, 255)
+
+
+@pytest.mark.parametrize("speed", [0.5, 101])
+def test_replay_speed_must_be_between_1_and_100(tmp_path, speed):
+    path = str(tmp_path / "feed.aptl")
+    TelemetryRecorder(path).close()
+    log = TelemetryLog(path)
+    with pytest.raises(ValueError):
+        Replayer(log, speed)
+    log.close()
+
+
+def test_replayed_tick_uses_the_recorded_time(tmp_path, monkeypatch):
+    seen = {}
+
+    class Recorder:
+        def update(self, positions):
+            seen["eta"] = {position[-1] for position in positions}
+            return {}
+
+        stop_etas = {}
+
+    def process(positions):
+        seen["geofence"] = {position[-1] for position in positions}
+        return []
+
+    monkeypatch.setattr(ws_server, "eta_engine", Recorder())
+    monkeypatch.setattr(ws_server.geofencer, "process", process)
+    recorder = TelemetryRecorder(str(tmp_path / "feed.aptl"))
+    monkeypatch.setattr(ws_server, "telemetry_recorder", recorder)
+    asyncio.run(ws_server.publish_tick(1_700_000_000.0))
+    recorder.close()
+
+    assert seen == {"eta": {1_700_000_000.0}, "geofence": {1_700_000_000.0}}
+    log = TelemetryLog(recorder.path)
+    assert log.start == 1_700_000_000.0
+    assert len(log) == len(ws_server.live_buses)
+    log.close()